@@ -1,6 +1,9 @@
 import streamlit as st
 
+from core.local_embeddings import EMBEDDING_BACKENDS
+from core.mock_provider import configure_mock
 from core.schemas import DEFAULT_MODEL, DEFAULT_PROVIDER, PROVIDER_MODELS, LLMConfig
+from core.telemetry import start_metrics_server
 
 st.set_page_config(
     page_title="Prompt Testing v2",
@@ -8,6 +11,9 @@ st.set_page_config(
     layout="wide",
 )
 
+# Prometheus scrape endpoint, enabled by PROMPT_TESTING_METRICS_PORT
+start_metrics_server()
+
 # ── Navigation ──────────────────────────────────────────────────────────────
 
 prompt_lab = st.Page(
@@ -57,6 +63,26 @@ if use_custom_model or not models_for_provider:
 else:
     model_name = st.sidebar.selectbox("Model", models_for_provider)
 
+if provider == "mock":
+    with st.sidebar.expander("Mock provider", icon=":material/smart_toy:"):
+        st.caption("Offline fake provider for load testing. No API key needed.")
+        mock_latency = st.selectbox(
+            "Latency distribution", ["fixed", "uniform", "lognormal", "exponential"]
+        )
+        mock_latency_ms = st.number_input("Latency (ms)", min_value=0.0, value=200.0)
+        mock_spread_ms = st.number_input("Latency spread (ms)", min_value=0.0, value=100.0)
+        mock_rate_limit = st.slider("429 rate", 0.0, 1.0, 0.0, step=0.01)
+        mock_errors = st.slider("5xx rate", 0.0, 1.0, 0.0, step=0.01)
+        mock_seed = st.number_input("Seed", min_value=0, value=0, step=1)
+    configure_mock(
+        latency=mock_latency,
+        latency_ms=mock_latency_ms,
+        latency_spread_ms=mock_spread_ms,
+        rate_limit_rate=mock_rate_limit,
+        error_rate=mock_errors,
+        seed=int(mock_seed),
+    )
+
 # ── Sidebar: Hyperparameters ────────────────────────────────────────────────
 
 st.sidebar.divider()
@@ -86,6 +112,15 @@ if show_penalties:
         "Presence Penalty", min_value=0.0, max_value=2.0, step=0.01, value=0.0
     )
 
+request_timeout = st.sidebar.number_input(
+    "Request timeout (s)",
+    min_value=0.0,
+    value=0.0,
+    step=5.0,
+    help="Per-request limit for generation, embedding and judge calls; 0 (default) for none",
+)
+timeout_s = request_timeout or None
+
 # ── Build config ────────────────────────────────────────────────────────────
 
 config = LLMConfig(
@@ -97,6 +132,7 @@ config = LLMConfig(
     max_tokens=max_tokens,
     frequency_penalty=frequency_penalty,
     presence_penalty=presence_penalty,
+    timeout_s=timeout_s,
 )
 st.session_state["llm_config"] = config
 
@@ -132,6 +168,14 @@ with st.sidebar.expander("Judge Model Settings", icon=":material/gavel:"):
         placeholder="Same as above if blank",
         key="judge_api_key_input",
     )
+    embedding_backend = st.selectbox(
+        "Embeddings",
+        EMBEDDING_BACKENDS,
+        key="embedding_backend_select",
+        help="Answer Relevancy embeddings: the provider's API, or a small model "
+        "on this machine's CPU (works offline; needs sentence-transformers or "
+        "onnxruntime installed)",
+    )
 
 judge_config = LLMConfig(
     provider=judge_provider,
@@ -139,6 +183,8 @@ judge_config = LLMConfig(
     api_key=judge_api_key or api_key,
     temperature=0.0,
     max_tokens=1024,
+    timeout_s=timeout_s,
+    embedding_backend=embedding_backend,
 )
 st.session_state["judge_config"] = judge_config
 
@@ -0,0 +1,92 @@
+import pytest
+
+from core.batch import run_batch
+from core.cache import _process_cache
+from core.mock_provider import configure_mock
+from core.schemas import BatchRow, BatchSpec, CascadePolicy, HedgePolicy, LLMConfig
+
+NUM_ROWS = 40
+PROMPTS = ["You are a helpful AI Assistant.", "Answer in one sentence."]
+
+
+@pytest.fixture
+def rows() -> list[BatchRow]:
+    return [
+        BatchRow(
+            question=f"What is fact {i}?",
+            context=f"Fact {i} is that item {i} weighs {i} kilograms. " * 5,
+        )
+        for i in range(NUM_ROWS)
+    ]
+
+
+def _spec(judge_config: LLMConfig, llm_metrics: list[str]) -> BatchSpec:
+    return BatchSpec(
+        prompts=PROMPTS,
+        configs=[
+            LLMConfig(provider="mock", model_name="mock/echo"),
+            LLMConfig(provider="mock", model_name="mock/scripted"),
+        ],
+        judge_config=judge_config,
+        llm_metrics=llm_metrics,
+        provider_concurrency={"mock": 16},
+        max_workers=16,
+    )
+
+
+def _run_uncached(rows, spec):
+    _process_cache.clear()
+    return run_batch(rows, spec)
+
+
+def bench_batch_generation_only(benchmark, rows, judge_config, mock_settings):
+    df, stats = benchmark(_run_uncached, rows, _spec(judge_config, []))
+    assert len(df) == NUM_ROWS * 2
+    assert stats.generation_units == NUM_ROWS * 2 * len(PROMPTS)
+
+
+def bench_batch_with_judges(benchmark, rows, judge_config, mock_settings):
+    spec = _spec(judge_config, ["Faithfulness", "Answer Relevancy"])
+    df, _ = benchmark(_run_uncached, rows, spec)
+    assert "Faithfulness_Prompt1" in df.columns
+
+
+def bench_batch_with_latency(benchmark, rows, judge_config):
+    # 5 ms per call: measures how well the pool overlaps provider latency
+    configure_mock(latency="uniform", latency_ms=4.0, latency_spread_ms=2.0, seed=1)
+    try:
+        df, _ = benchmark.pedantic(
+            _run_uncached, args=(rows, _spec(judge_config, [])), rounds=3
+        )
+    finally:
+        configure_mock()
+    assert len(df) == NUM_ROWS * 2
+
+
+@pytest.mark.parametrize("hedged", [False, True], ids=["plain", "hedged"])
+def bench_batch_heavy_tail(benchmark, rows, judge_config, hedged):
+    # Lognormal latency with a long tail: a few stragglers hold up the run
+    # unless duplicates are sent past the p95
+    configure_mock(latency="lognormal", latency_ms=10.0, latency_spread_ms=20.0, seed=3)
+    spec = _spec(judge_config, []).model_copy(
+        update={"hedging": HedgePolicy(max_extra_fraction=0.1) if hedged else None}
+    )
+    try:
+        df, _ = benchmark.pedantic(_run_uncached, args=(rows, spec), rounds=3)
+    finally:
+        configure_mock()
+    assert len(df) == NUM_ROWS * 2
+
+
+def bench_batch_cascade(benchmark, rows, judge_config, mock_settings):
+    # A cheap logprob judge scores everything; only unsure items escalate
+    cheap = judge_config.model_copy(update={"temperature": 0.5})
+    spec = _spec(judge_config, ["Faithfulness", "Critique"]).model_copy(
+        update={
+            "critique_name": "Coherence",
+            "cascade": CascadePolicy(cheap_judge=cheap, audit_fraction=0.1),
+        }
+    )
+    df, stats = benchmark(_run_uncached, rows, spec)
+    assert stats.cascade_items == stats.judge_units
+    assert stats.cascade_escalated < stats.cascade_items
@@ -0,0 +1,99 @@
+import random
+
+import evaluate
+import numpy as np
+import pytest
+
+from core.bertscore_fast import (
+    FastBERTScorer,
+    get_scorer,
+    length_buckets,
+    padding_fraction,
+)
+from core.embedding_cache import EmbeddingCache, embedding_key
+from core.metrics import NLPMetrics
+
+NUM_PAIRS = 50
+# Mixed lengths, as in real answers, so bucketing has something to do
+PREDICTIONS = [
+    f"The capital of country {i} is city {i}" + ", known for its old harbour" * (i % 7)
+    for i in range(NUM_PAIRS)
+]
+REFERENCES = [
+    f"City {i} is the capital of country {i}" + " and has a historic harbour" * (i % 5)
+    for i in range(NUM_PAIRS)
+]
+FAST_BACKENDS = ["torch", "int8", "onnx", "onnx-int8"]
+# Max absolute F1 difference from the evaluate/bert_score reference; the
+# fp32 backends only differ by float summation order
+PARITY_TOLERANCE = {"torch": 1e-4, "onnx": 1e-4, "int8": 0.02, "onnx-int8": 0.02}
+
+
+def _require_backend(backend: str) -> None:
+    pytest.importorskip("transformers")
+    pytest.importorskip("onnxruntime" if backend.startswith("onnx") else "torch")
+    # The model (and for ONNX the export) comes from the Hugging Face Hub
+    try:
+        get_scorer(backend=backend)
+    except Exception as e:
+        pytest.skip(f"BERTScore backend {backend!r} unavailable: {e}")
+
+
+@pytest.fixture(scope="module")
+def reference_f1() -> list[float]:
+    try:
+        evaluate.load("bertscore")
+        return NLPMetrics.bert_score(PREDICTIONS, REFERENCES)["f1"]
+    except Exception as e:
+        pytest.skip(f"evaluate bertscore unavailable: {e}")
+
+
+def bench_length_buckets(benchmark):
+    rng = random.Random(0)
+    lengths = [rng.randint(5, 300) for _ in range(2000)]
+    batches = benchmark(length_buckets, lengths)
+    assert sorted(i for b in batches for i in b) == list(range(len(lengths)))
+    # Arrival-order batches of the same size pad far more
+    arrival = [list(range(i, min(i + 64, len(lengths)))) for i in range(0, len(lengths), 64)]
+    assert padding_fraction(lengths, batches) < padding_fraction(lengths, arrival) / 2
+
+
+def bench_embedding_cache_disk_read(benchmark, tmp_path):
+    # A rerun over the same dataset: every text comes from the disk tier
+    path = str(tmp_path / "embeddings.sqlite3")
+    rng = np.random.default_rng(0)
+    items = {
+        embedding_key("bench", f"text {i}"): (
+            rng.standard_normal((40, 768), dtype=np.float32),
+            np.ones(40, dtype=np.float32),
+        )
+        for i in range(200)
+    }
+    EmbeddingCache(path).put_many(items)
+    found = benchmark(lambda: EmbeddingCache(path).get_many(list(items)))
+    assert len(found) == len(items)
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("backend", FAST_BACKENDS)
+def bench_bert_score_parity(benchmark, backend, reference_f1):
+    _require_backend(backend)
+    result = benchmark.pedantic(
+        NLPMetrics.bert_score,
+        args=(PREDICTIONS, REFERENCES),
+        kwargs={"backend": backend},
+        rounds=1,
+    )
+    diffs = [abs(a - b) for a, b in zip(result["f1"], reference_f1)]
+    # Scores are rounded to 3 places on both sides
+    assert max(diffs) <= PARITY_TOLERANCE[backend] + 1e-3
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("backend", FAST_BACKENDS)
+def bench_bert_score_throughput(benchmark, backend):
+    _require_backend(backend)
+    # No embedding cache, so every round runs the encoder
+    scorer = FastBERTScorer(backend=backend)
+    result = benchmark.pedantic(scorer.score, args=(PREDICTIONS, REFERENCES), rounds=3)
+    assert len(result["f1"]) == NUM_PAIRS
@@ -0,0 +1,20 @@
+from core.cache import cache_key
+from core.schemas import LLMConfig
+
+SYSTEM_PROMPT = "You are a helpful AI Assistant. " * 20
+USER_MESSAGE = "Context paragraph. " * 400 + "\n\nWhat does the context say?"
+
+
+def bench_cache_key(benchmark):
+    config = LLMConfig(temperature=0.7, max_tokens=512)
+    key = benchmark(cache_key, config, SYSTEM_PROMPT, USER_MESSAGE)
+    assert len(key) == 64
+
+
+def bench_cache_key_many_configs(benchmark):
+    configs = [LLMConfig(temperature=t / 100) for t in range(100)]
+
+    def _hash_all():
+        return {cache_key(c, SYSTEM_PROMPT, USER_MESSAGE) for c in configs}
+
+    assert len(benchmark(_hash_all)) == 100
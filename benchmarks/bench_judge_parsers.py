@@ -0,0 +1,181 @@
+import json
+
+import pytest
+
+from core.local_nli import get_nli
+from core.metrics import _NLI_PREFIX, LLMJudge, _choice_distributions
+from core.mock_provider import configure_mock, mock_call_count
+from core.retrieval import _build_index, prune_context
+from core.schemas import LLMConfig, RubricCriterion, TokenLogprob
+
+NUM_STATEMENTS = 50
+
+STATEMENTS_OUTPUT = "\n".join(
+    f"{i + 1}. Statement number {i + 1} about the topic." for i in range(NUM_STATEMENTS)
+)
+STRICT_VERDICTS = "\n".join(
+    f"{i + 1}. {'Yes' if i % 3 else 'No'}" for i in range(NUM_STATEMENTS)
+)
+LOOSE_VERDICTS = "\n".join("Yes." if i % 3 else "no" for i in range(NUM_STATEMENTS))
+CRITIQUE_OUTPUT = "Reasoning: " + "The answer is well organised. " * 30 + "\nVerdict: Yes"
+RUBRIC = [
+    RubricCriterion(name=name, description=f"{name} of the answer")
+    for name in ("Accuracy", "Helpfulness", "Clarity", "Completeness", "Tone")
+]
+RUBRIC_OUTPUT = "Accuracy: 4\nHelpfulness: 3\nClarity = 5\nCompleteness - 2\nTone 9"
+WINNER_OUTPUT = "Answer A is more complete and cites the context.\nWinner: A"
+STRUCTURED_VERDICTS = json.dumps(
+    {"verdicts": ["Yes" if i % 3 else "No" for i in range(NUM_STATEMENTS)]}
+)
+# A long RAG context (~20k words) of distinct facts, and statements about
+# a handful of them
+LONG_CONTEXT = " ".join(
+    f"Warehouse {i} in district {i % 40} stores {i * 7} crates of item {i * 13}."
+    for i in range(2000)
+)
+LONG_STATEMENTS = [f"Warehouse {i} stores {i * 7} crates." for i in (5, 480, 1999)]
+
+
+@pytest.fixture(scope="module")
+def judge() -> LLMJudge:
+    return LLMJudge(LLMConfig(provider="mock", model_name="mock/judge"))
+
+
+def bench_parse_statements(benchmark, judge):
+    assert len(benchmark(judge._parse_statements, STATEMENTS_OUTPUT)) == NUM_STATEMENTS
+
+
+def bench_parse_verdicts_strict(benchmark, judge):
+    yes, no = benchmark(judge._parse_verdicts, STRICT_VERDICTS)
+    assert yes + no == NUM_STATEMENTS
+
+
+def bench_parse_verdicts_structured(benchmark, judge):
+    yes, no = benchmark(judge._parse_verdicts, STRUCTURED_VERDICTS)
+    assert yes + no == NUM_STATEMENTS
+
+
+def bench_parse_verdicts_fallback(benchmark, judge):
+    yes, no = benchmark(judge._parse_verdicts, LOOSE_VERDICTS)
+    assert yes + no == NUM_STATEMENTS
+
+
+def bench_parse_critique_verdict(benchmark, judge):
+    assert benchmark(judge._parse_critique_verdict, CRITIQUE_OUTPUT) == 1
+
+
+def bench_parse_rubric_scores(benchmark, judge):
+    scores = benchmark(judge._parse_rubric_scores, RUBRIC_OUTPUT, RUBRIC)
+    assert scores == {
+        "Accuracy": 4,
+        "Helpfulness": 3,
+        "Clarity": 5,
+        "Completeness": 2,
+        "Tone": 5,
+    }
+
+
+def bench_parse_winner(benchmark, judge):
+    assert benchmark(judge._parse_winner, WINNER_OUTPUT)[0] == "A"
+
+
+def bench_faithfulness_end_to_end(benchmark, judge_config, mock_settings):
+    # Zero-latency mock judge: measures prompt building and parsing overhead
+    judge = LLMJudge(judge_config)
+    answer = " ".join(f"Fact {i} holds for the subject." for i in range(20))
+    score = benchmark(judge.faithfulness, "What holds?", answer, "Context " * 200, 3)
+    assert 0.0 <= score <= 1.0
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def bench_prune_context(benchmark, cached):
+    # Index build plus top-k lookup, or lookup alone once the context's
+    # index is cached
+    def _prune():
+        if not cached:
+            _build_index.cache_clear()
+        return prune_context(LONG_CONTEXT, LONG_STATEMENTS)
+
+    pruned = benchmark(_prune)
+    assert len(pruned) * 10 < len(LONG_CONTEXT)
+    assert "Warehouse 480 in district 0 stores 3360 crates" in pruned
+
+
+@pytest.mark.parametrize("context_mode", ["full", "retrieval"])
+def bench_faithfulness_long_context(benchmark, judge_config, mock_settings, context_mode):
+    judge = LLMJudge(judge_config, context_mode=context_mode)
+    answer = " ".join(LONG_STATEMENTS)
+    score = benchmark(judge.faithfulness, "How many crates?", answer, LONG_CONTEXT, 3)
+    assert 0.0 <= score <= 1.0
+
+
+def bench_nli_logprob_distributions(benchmark):
+    tokens = []
+    for i in range(NUM_STATEMENTS):
+        tokens += [
+            TokenLogprob(token=f"{i + 1}", logprob=0.0),
+            TokenLogprob(token=".", logprob=0.0),
+            TokenLogprob(token=" Yes", logprob=-0.2, top={" Yes": -0.2, " No": -1.7}),
+            TokenLogprob(token="\n", logprob=0.0),
+        ]
+    dists = benchmark(_choice_distributions, tokens, ["yes", "no"], _NLI_PREFIX)
+    assert len(dists) == NUM_STATEMENTS
+
+
+@pytest.mark.parametrize("verdicts", ["sample", "logprobs"])
+def bench_critique_strictness(benchmark, judge_config, verdicts):
+    # Strictness 5 at 20ms per call: voting makes five calls, logprobs one
+    configure_mock(latency_ms=20)
+    judge = LLMJudge(judge_config, verdicts=verdicts)
+    calls = []
+
+    def _critique():
+        start = mock_call_count()
+        result = judge.critique_verdict("Q?", "An answer.", "Is it correct?", 5)
+        calls.append(mock_call_count() - start)
+        return result
+
+    result = benchmark.pedantic(_critique, rounds=3)
+    configure_mock()
+    assert set(calls) == {5 if verdicts == "sample" else 1}
+    assert result.method == ("sampling" if verdicts == "sample" else "logprobs")
+
+
+@pytest.mark.parametrize("pack_size", [1, 8])
+def bench_critique_listwise(benchmark, judge_config, pack_size):
+    # 16 answers (4 prompts x 4 models of a row) at 20ms per call: one
+    # request per answer, or two packs of eight
+    configure_mock(latency_ms=20)
+    judge = LLMJudge(judge_config)
+    answers = [f"Answer {i}: Paris is the capital of France." for i in range(16)]
+    calls = []
+
+    def _critique():
+        start = mock_call_count()
+        result = judge.critique_many("Q?", answers, "Is it correct?", pack_size)
+        calls.append(mock_call_count() - start)
+        return result
+
+    result = benchmark.pedantic(_critique, rounds=3)
+    configure_mock()
+    assert len(result) == len(answers)
+    assert set(calls) == {16 if pack_size == 1 else 2}
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("backend", ["torch", "int8"])
+def bench_local_nli(benchmark, backend):
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    # The model comes from the Hugging Face Hub on first use
+    try:
+        nli = get_nli(backend)
+    except Exception as e:
+        pytest.skip(f"Local NLI backend {backend!r} unavailable: {e}")
+    # 50 answers x 5 statements, as one batch run would verify them
+    context = "Item 3 weighs 3 kilograms and is kept in the north warehouse. " * 20
+    hypotheses = [f"Item {i % 7} weighs {i % 5} kilograms." for i in range(250)]
+    verdicts = benchmark.pedantic(
+        nli.entails, args=([context] * len(hypotheses), hypotheses), rounds=3
+    )
+    assert len(verdicts) == len(hypotheses)
@@ -0,0 +1,55 @@
+import evaluate
+import pytest
+
+from core.metrics import NLPMetrics
+
+NUM_PAIRS = 50
+PREDICTIONS = [
+    f"The capital of country {i} is city {i}, known for its old harbour."
+    for i in range(NUM_PAIRS)
+]
+REFERENCES = [
+    f"City {i} is the capital of country {i} and has a historic harbour."
+    for i in range(NUM_PAIRS)
+]
+
+
+def _require(metric: str) -> None:
+    # evaluate fetches metric scripts from the Hugging Face Hub on first use
+    try:
+        evaluate.load(metric)
+    except Exception as e:
+        pytest.skip(f"evaluate metric {metric!r} unavailable: {e}")
+
+
+def bench_rouge_per_pair(benchmark):
+    _require("rouge")
+    result = benchmark(NLPMetrics.rouge_score, PREDICTIONS, REFERENCES)
+    assert len(result["rougeL"]) == NUM_PAIRS
+
+
+def bench_rouge_batched(benchmark):
+    _require("rouge")
+    rouge = evaluate.load("rouge")
+    result = benchmark(
+        rouge.compute,
+        predictions=PREDICTIONS,
+        references=REFERENCES,
+        use_aggregator=False,
+    )
+    assert len(result["rougeL"]) == NUM_PAIRS
+
+
+def bench_bleu_per_pair(benchmark):
+    _require("bleu")
+    result = benchmark(NLPMetrics.bleu_score, PREDICTIONS, REFERENCES)
+    assert len(result["bleu"]) == NUM_PAIRS
+
+
+@pytest.mark.slow
+def bench_bert_score(benchmark):
+    _require("bertscore")
+    result = benchmark.pedantic(
+        NLPMetrics.bert_score, args=(PREDICTIONS, REFERENCES), rounds=3
+    )
+    assert len(result["f1"]) == NUM_PAIRS
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from core.llm_client import cosine_similarity, get_embeddings
+from core.local_embeddings import get_embedder
+from core.schemas import LLMConfig
+
+DIM = 1536
+# Answer Relevancy at strictness 3: the question plus three generated ones
+TEXTS = [
+    "Which team won the first ODI Cricket World Cup?",
+    "Who won the 1975 Cricket World Cup?",
+    "Which country hosted the first ODI Cricket World Cup?",
+    "When was the first ODI Cricket World Cup held?",
+]
+
+
+def bench_cosine_similarity(benchmark):
+    rng = np.random.default_rng(0)
+    vec_a = rng.standard_normal(DIM).tolist()
+    vec_b = rng.standard_normal(DIM).tolist()
+    score = benchmark(cosine_similarity, vec_a, vec_b)
+    assert -1.0 <= score <= 1.0
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("backend", ["sentence-transformers", "onnx", "onnx-int8"])
+def bench_local_embeddings(benchmark, backend):
+    pytest.importorskip(
+        "onnxruntime" if backend.startswith("onnx") else "sentence_transformers"
+    )
+    # The model comes from the Hugging Face Hub on first use
+    try:
+        get_embedder(backend)
+    except Exception as e:
+        pytest.skip(f"Local embedding backend {backend!r} unavailable: {e}")
+    config = LLMConfig(provider="mock", model_name="mock/echo", embedding_backend=backend)
+    vectors = benchmark(get_embeddings, TEXTS, config)
+    assert len(vectors) == len(TEXTS)
+    assert len({len(v) for v in vectors}) == 1
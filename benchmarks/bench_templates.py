@@ -0,0 +1,64 @@
+import re
+
+import pandas as pd
+import pytest
+
+from core.templates import compile_template, expand_sweep
+
+TEMPLATE = (
+    "You are a {{role}} assistant for {{company}}. Answer in {{language}} "
+    "and keep a {{tone}} tone. Mention {{company}} only when relevant."
+)
+NUM_ROWS = 100_000
+
+_VAR_PATTERN = re.compile(r"\{\{(\w+)\}\}")
+
+
+def _regex_render(template: str, variables: dict[str, str]) -> str:
+    # The pre-compilation implementation, kept as the comparison baseline
+    def _replacer(match: re.Match) -> str:
+        key = match.group(1)
+        if key not in variables:
+            raise KeyError(f"Missing template variable: {key}")
+        return str(variables[key])
+
+    return _VAR_PATTERN.sub(_replacer, template)
+
+
+@pytest.fixture(scope="module")
+def variables_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "role": [f"role{i % 17}" for i in range(NUM_ROWS)],
+            "company": [f"Company {i % 101}" for i in range(NUM_ROWS)],
+            "language": ["English", "French", "German", "Hindi"] * (NUM_ROWS // 4),
+            "tone": [f"tone{i % 5}" for i in range(NUM_ROWS)],
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def variable_sets(variables_df: pd.DataFrame) -> list[dict[str, str]]:
+    return variables_df.to_dict("records")
+
+
+def bench_regex_loop(benchmark, variable_sets):
+    result = benchmark(lambda: [_regex_render(TEMPLATE, vs) for vs in variable_sets])
+    assert len(result) == NUM_ROWS
+
+
+def bench_expand_sweep(benchmark, variable_sets):
+    result = benchmark(expand_sweep, TEMPLATE, variable_sets)
+    assert len(result) == NUM_ROWS
+
+
+def bench_render_frame(benchmark, variables_df, variable_sets):
+    compiled = compile_template(TEMPLATE)
+    result = benchmark(compiled.render_frame, variables_df)
+    assert result.iloc[123] == _regex_render(TEMPLATE, variable_sets[123])
+
+
+def bench_iter_render(benchmark, variable_sets):
+    compiled = compile_template(TEMPLATE)
+    result = benchmark(lambda: sum(1 for _ in compiled.iter_render(variable_sets)))
+    assert result == NUM_ROWS
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from core.mock_provider import configure_mock  # noqa: E402
+from core.schemas import LLMConfig  # noqa: E402
+
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+
+
+def pytest_configure(config):
+    # Keep saved runs next to the suite regardless of the working directory,
+    # so --benchmark-compare always finds the committed baseline.
+    if config.getoption("benchmark_storage", None) == "file://./.benchmarks":
+        config.option.benchmark_storage = f"file://{BASELINE_DIR}"
+
+
+@pytest.fixture
+def mock_settings():
+    settings = configure_mock()
+    yield settings
+    configure_mock()
+
+
+@pytest.fixture
+def mock_config() -> LLMConfig:
+    return LLMConfig(provider="mock", model_name="mock/echo")
+
+
+@pytest.fixture
+def judge_config() -> LLMConfig:
+    return LLMConfig(provider="mock", model_name="mock/judge", max_tokens=1024)
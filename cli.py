@@ -0,0 +1,423 @@
+"""Run a batch evaluation from the command line.
+
+Example:
+    python cli.py data.csv \\
+        --model openai:gpt-4o-mini \\
+        --model anthropic:claude-haiku-4-5-20251001 \\
+        --model ollama:ollama/llama3 \\
+        --prompt "You are a helpful AI Assistant." \\
+        --metric "ROUGE Score" --metric Faithfulness \\
+        --output results.csv
+
+API keys are read from OPENAI_API_KEY, ANTHROPIC_API_KEY and GEMINI_API_KEY.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+from core.batch import (
+    CONTEXT_COLUMNS,
+    CRITERIA_DICT,
+    GROUND_TRUTH_COLUMNS,
+    LLM_METRICS,
+    NLP_METRICS,
+    QUESTION_COLUMNS,
+    find_column_index,
+    load_rows,
+    match_variable_columns,
+    run_batch,
+)
+from core.bertscore_fast import BACKENDS as BERTSCORE_BACKENDS
+from core.budget import BudgetManager, use_budget
+from core.cascade import cascade_summary
+from core.deadline import deadline
+from core.llm_client import use_hedging
+from core.local_embeddings import EMBEDDING_BACKENDS
+from core.local_nli import NLI_BACKENDS, STATEMENT_EXTRACTORS
+from core.retrieval import CONTEXT_MODES
+from core.schemas import (
+    API_KEY_ENV,
+    DEFAULT_MODEL,
+    DEFAULT_PROVIDER,
+    BatchSpec,
+    BudgetLimits,
+    CascadePolicy,
+    HedgePolicy,
+    LLMConfig,
+)
+from core.sweep import SWEEP_PARAMS, config_label, expand_config_grid, parse_values, run_sweep
+from core.templates import extract_variables
+
+
+def _parse_model(spec: str) -> tuple[str, str]:
+    if ":" not in spec:
+        raise argparse.ArgumentTypeError(
+            f"Model must be given as provider:model_name, got {spec!r}"
+        )
+    provider, model = spec.split(":", 1)
+    return provider, model
+
+
+def _make_config(provider: str, model: str, args: argparse.Namespace) -> LLMConfig:
+    return LLMConfig(
+        provider=provider,
+        model_name=model,
+        api_key=os.environ.get(API_KEY_ENV.get(provider, ""), ""),
+        temperature=args.temperature,
+        top_p=args.top_p,
+        max_tokens=args.max_tokens,
+        timeout_s=args.timeout,
+        embedding_backend=args.embeddings,
+    )
+
+
+def _resolve_column(
+    columns: list[str], explicit: str | None, candidates: list[str]
+) -> str:
+    if explicit:
+        if explicit not in columns:
+            raise SystemExit(f"Column {explicit!r} not found in CSV")
+        return explicit
+    return columns[find_column_index(columns, candidates)]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Evaluate system prompts across a CSV of questions."
+    )
+    parser.add_argument("csv", help="Input CSV file")
+    parser.add_argument(
+        "--model",
+        action="append",
+        type=_parse_model,
+        dest="models",
+        help="provider:model_name; repeat to run several models in one pass",
+    )
+    parser.add_argument(
+        "--prompt", action="append", dest="prompts", help="System prompt (repeatable)"
+    )
+    parser.add_argument(
+        "--metric",
+        action="append",
+        dest="metrics",
+        default=[],
+        choices=NLP_METRICS + LLM_METRICS,
+    )
+    parser.add_argument("--critique", choices=list(CRITERIA_DICT.keys()))
+    parser.add_argument(
+        "--judge",
+        type=_parse_model,
+        default=(DEFAULT_PROVIDER, DEFAULT_MODEL),
+        help="provider:model_name of the judge model",
+    )
+    parser.add_argument(
+        "--cascade-judge",
+        type=_parse_model,
+        help="provider:model_name of a cheap judge that scores every item first; "
+        "only items it is unsure of go to --judge",
+    )
+    parser.add_argument(
+        "--cascade-confidence",
+        type=float,
+        default=0.85,
+        help="Cheap Critique verdicts at least this confident are kept",
+    )
+    parser.add_argument(
+        "--cascade-audit",
+        type=float,
+        default=0.0,
+        help="Fraction of early decisions re-scored by --judge to measure agreement",
+    )
+    parser.add_argument("--question-col")
+    parser.add_argument("--context-col")
+    parser.add_argument("--gt-col", help="Ground truth column (optional)")
+    parser.add_argument(
+        "--var",
+        action="append",
+        default=[],
+        metavar="NAME=COLUMN",
+        help="Fill {{NAME}} in system prompts from a CSV column (repeatable); "
+        "variables named like a column are mapped automatically",
+    )
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--top-p", type=float, default=1.0)
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument(
+        "--concurrency",
+        action="append",
+        default=[],
+        metavar="PROVIDER=N",
+        help="Fixed per-provider concurrency cap (repeatable); by default the "
+        "limit adapts to observed latency and errors",
+    )
+    parser.add_argument(
+        "--nlp-processes",
+        type=int,
+        help="Worker processes for NLP metrics (0 = score in the main process; "
+        "default decides from the metrics and batch size)",
+    )
+    parser.add_argument(
+        "--bertscore-backend",
+        choices=BERTSCORE_BACKENDS,
+        default="evaluate",
+        help="BERTScore encoder: evaluate (PyTorch eager), torch, int8 "
+        "(dynamic quantization), onnx or onnx-int8 (ONNX Runtime)",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Send a duplicate request when a call outlives the model's recent "
+        "latency percentile; the first answer wins",
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=95.0,
+        help="Latency percentile that triggers a hedge",
+    )
+    parser.add_argument(
+        "--hedge-max-extra",
+        type=float,
+        default=0.05,
+        help="Max hedges as a fraction of calls (default 0.05)",
+    )
+    parser.add_argument(
+        "--hedge-max-cost", type=float, help="Max estimated USD spent on duplicate requests"
+    )
+    parser.add_argument(
+        "--embeddings",
+        choices=EMBEDDING_BACKENDS,
+        default="api",
+        help="Answer Relevancy embeddings: the provider's API, or a local CPU "
+        "model (sentence-transformers, onnx or onnx-int8)",
+    )
+    parser.add_argument(
+        "--nli",
+        choices=NLI_BACKENDS,
+        default="llm",
+        help="Faithfulness statement checks: the judge LLM, or a local "
+        "cross-encoder NLI model on the CPU (torch or int8)",
+    )
+    parser.add_argument(
+        "--statements",
+        choices=["llm", *STATEMENT_EXTRACTORS],
+        default="llm",
+        help="Faithfulness statement extraction: the judge LLM, or each "
+        "sentence of the answer",
+    )
+    parser.add_argument(
+        "--context-mode",
+        choices=CONTEXT_MODES,
+        default="full",
+        help="Faithfulness NLI context: the full context, or only the top BM25 "
+        "passages for each statement (much shorter prompts on long contexts)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, help="Per-request timeout in seconds (each attempt)"
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Wall-clock limit for the whole run in seconds; unfinished cells "
+        "are reported as TIMEOUT",
+    )
+    parser.add_argument(
+        "--judge-pack",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Critique up to N answers to the same question in one judge request",
+    )
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument(
+        "--sweep",
+        action="append",
+        default=[],
+        metavar="PARAM=VALUES",
+        help="Sweep a hyperparameter, e.g. temperature=0,0.5,1 or top_p=0.8:1:0.1",
+    )
+    parser.add_argument(
+        "--sweep-metric",
+        choices=NLP_METRICS + LLM_METRICS,
+        help="Metric to rank sweep configs on (must also be passed via --metric)",
+    )
+    parser.add_argument(
+        "--minimize", action="store_true", help="Lower sweep metric is better"
+    )
+    parser.add_argument(
+        "--no-halving",
+        action="store_true",
+        help="Run the full grid instead of successive halving",
+    )
+    parser.add_argument("--eta", type=int, default=2, help="Keep 1 in ETA configs per rung")
+    parser.add_argument(
+        "--max-cost", type=float, help="Stop new LLM calls once this many USD are spent"
+    )
+    parser.add_argument(
+        "--max-total-tokens", type=int, help="Stop new LLM calls after this many tokens"
+    )
+    parser.add_argument("--warn-cost", type=float, help="Warn once spend passes this USD")
+    parser.add_argument("--output", "-o", default="batch_eval_report.csv")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    df = pd.read_csv(args.csv)
+    columns = list(df.columns)
+    question_col = _resolve_column(columns, args.question_col, QUESTION_COLUMNS)
+    context_col = _resolve_column(columns, args.context_col, CONTEXT_COLUMNS)
+    gt_col = args.gt_col
+    if gt_col is None:
+        lower_cols = [c.lower().strip() for c in columns]
+        gt_col = next(
+            (columns[lower_cols.index(c)] for c in GROUND_TRUTH_COLUMNS if c in lower_cols),
+            None,
+        )
+
+    if "Critique" in args.metrics and not args.critique:
+        raise SystemExit("--critique is required when the Critique metric is selected")
+
+    provider_concurrency: dict[str, int] = {}
+    for item in args.concurrency:
+        provider, _, limit = item.partition("=")
+        provider_concurrency[provider] = int(limit)
+
+    sweep_grid: dict[str, list[float]] = {}
+    for item in args.sweep:
+        param, _, values = item.partition("=")
+        if param not in SWEEP_PARAMS:
+            raise SystemExit(f"Cannot sweep {param!r}; choose from {SWEEP_PARAMS}")
+        sweep_grid[param] = parse_values(values)
+    if sweep_grid and args.sweep_metric not in args.metrics:
+        raise SystemExit("--sweep-metric must be one of the selected --metric values")
+
+    models = args.models or [(DEFAULT_PROVIDER, DEFAULT_MODEL)]
+    configs = [_make_config(p, m, args) for p, m in models]
+    config_labels: list[str] = []
+    if sweep_grid:
+        configs = [v for c in configs for v in expand_config_grid(c, sweep_grid)]
+        config_labels = [config_label(c, list(sweep_grid)) for c in configs]
+    judge_config = _make_config(*args.judge, args).model_copy(
+        update={"temperature": 0.0, "max_tokens": 1024}
+    )
+    spec = BatchSpec(
+        prompts=args.prompts or ["You are a helpful AI Assistant."],
+        configs=configs,
+        config_labels=config_labels,
+        judge_config=judge_config,
+        nlp_metrics=[m for m in args.metrics if m in NLP_METRICS] if gt_col else [],
+        llm_metrics=[m for m in args.metrics if m in LLM_METRICS],
+        critique_name=args.critique,
+        use_cache=not args.no_cache,
+        max_workers=args.workers,
+        provider_concurrency=provider_concurrency,
+        nlp_processes=args.nlp_processes,
+        bertscore_backend=args.bertscore_backend,
+        hedging=HedgePolicy(
+            percentile=args.hedge_percentile,
+            max_extra_fraction=args.hedge_max_extra,
+            max_extra_cost_usd=args.hedge_max_cost,
+        )
+        if args.hedge
+        else None,
+        deadline_s=args.deadline,
+        judge_pack_size=args.judge_pack,
+        nli_backend=args.nli,
+        statement_extractor=args.statements,
+        context_mode=args.context_mode,
+        cascade=CascadePolicy(
+            cheap_judge=_make_config(*args.cascade_judge, args).model_copy(
+                update={"temperature": 0.0, "max_tokens": 1024}
+            ),
+            min_confidence=args.cascade_confidence,
+            audit_fraction=args.cascade_audit,
+        )
+        if args.cascade_judge
+        else None,
+    )
+    template_vars = list(
+        dict.fromkeys(v for p in spec.prompts for v in extract_variables(p))
+    )
+    variable_columns = match_variable_columns(template_vars, columns)
+    for item in args.var:
+        var, _, col = item.partition("=")
+        if col not in columns:
+            raise SystemExit(f"Column {col!r} not found in CSV")
+        variable_columns[var] = col
+    unmapped = [v for v in template_vars if v not in variable_columns]
+    if unmapped:
+        raise SystemExit(f"No CSV column for template variable(s): {', '.join(unmapped)}")
+
+    rows = load_rows(df, question_col, context_col, gt_col, variable_columns)
+
+    budget = BudgetManager(
+        BudgetLimits(
+            max_cost_usd=args.max_cost,
+            max_tokens=args.max_total_tokens,
+            warn_cost_usd=args.warn_cost,
+        )
+    )
+    warned = False
+
+    def _on_progress(stage: str, done: int, total: int) -> None:
+        nonlocal warned
+        print(f"\r{stage}: {done}/{total}", end="", file=sys.stderr, flush=True)
+        if done == total:
+            print(file=sys.stderr)
+        warning = budget.warning()
+        if warning and not warned:
+            print(f"\nWarning: {warning}", file=sys.stderr)
+            warned = True
+
+    # The deadline covers every rung of a sweep, not each batch separately
+    with use_budget(budget), use_hedging(spec.hedging) as hedge_run, deadline(
+        args.deadline
+    ):
+        if sweep_grid:
+            leaderboard, results_df, plan_stats = run_sweep(
+                rows,
+                spec,
+                args.sweep_metric,
+                maximize=not args.minimize,
+                halving=not args.no_halving,
+                eta=args.eta,
+                on_progress=_on_progress,
+            )
+        else:
+            results_df, plan_stats = run_batch(rows, spec, on_progress=_on_progress)
+    if sweep_grid:
+        print(leaderboard.to_string(index=False))
+        stem, ext = os.path.splitext(args.output)
+        leaderboard_path = f"{stem}_leaderboard{ext or '.csv'}"
+        leaderboard.to_csv(leaderboard_path, index=False)
+    results_df.to_csv(args.output, index=False)
+    print(
+        f"Executed {plan_stats.generation_units}/{plan_stats.generation_cells} generations, "
+        f"{plan_stats.judge_units}/{plan_stats.judge_cells} judge evaluations, "
+        f"{plan_stats.nlp_units}/{plan_stats.nlp_pairs} NLP pairs "
+        f"({plan_stats.calls_saved} LLM calls saved)",
+        file=sys.stderr,
+    )
+    print(budget.summary(), file=sys.stderr)
+    if hedge_run is not None:
+        print(hedge_run.summary(), file=sys.stderr)
+    if spec.cascade is not None:
+        print(cascade_summary(plan_stats), file=sys.stderr)
+    if plan_stats.timed_out:
+        print(f"{plan_stats.timed_out} cells timed out", file=sys.stderr)
+    if reason := budget.exceeded():
+        print(f"Budget cap hit, remaining calls were skipped: {reason}", file=sys.stderr)
+    print(f"Wrote {len(results_df)} rows to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
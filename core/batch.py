@@ -0,0 +1,586 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Iterable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from core.budget import BudgetExceeded, budget_exceeded
+from core.cascade import Cascade, record, rouge_l
+from core.concurrency import ProviderLimiter, make_executor
+from core.deadline import deadline, is_timeout, remaining
+from core.llm_client import get_completion, use_hedging
+from core.local_nli import STATEMENT_EXTRACTORS
+from core.metrics import LLMJudge, pack_answers
+from core.nlp_pool import NLPScorer, default_processes
+from core.planner import dedupe, fan_out, generation_key, judge_key, nlp_key
+from core.schemas import (
+    BatchRow,
+    BatchSpec,
+    CascadeOutcome,
+    LLMConfig,
+    LLMResponse,
+    PlanStats,
+)
+from core.templates import compile_template
+from core.tracing import span, traced
+
+NLP_METRICS = ["ROUGE Score", "BLEU Score", "BERT Score"]
+LLM_METRICS = ["Answer Relevancy", "Faithfulness", "Critique"]
+
+CRITERIA_DICT = {
+    "Harmfulness": "Does the answer cause or have the potential to cause harm?",
+    "Coherence": "Does the answer present ideas in a logical and organized manner?",
+    "Correctness": "Is the answer factually accurate and free from errors?",
+    "Conciseness": "Does the answer convey information clearly and efficiently?",
+}
+
+QUESTION_COLUMNS = ["question", "questions", "query"]
+CONTEXT_COLUMNS = ["context", "contexts", "passage"]
+GROUND_TRUTH_COLUMNS = ["ground_truth", "groundtruth", "reference", "answer"]
+
+# (stage, done, total) — invoked from the calling thread only
+ProgressCallback = Callable[[str, int, int], None]
+
+# (row index, model index, prompt index)
+Cell = tuple[int, int, int]
+
+
+def find_column_index(columns: list[str], candidates: list[str]) -> int:
+    lower_cols = [c.lower().strip() for c in columns]
+    for candidate in candidates:
+        if candidate.lower() in lower_cols:
+            return lower_cols.index(candidate.lower())
+    return 0
+
+
+def load_rows(
+    df: pd.DataFrame,
+    question_col: str,
+    context_col: str,
+    gt_col: Optional[str] = None,
+    variable_columns: Optional[dict[str, str]] = None,
+) -> list[BatchRow]:
+    variable_columns = variable_columns or {}
+    rows: list[BatchRow] = []
+    for _, row in df.iterrows():
+        ctx = row[context_col]
+        gt = row.get(gt_col) if gt_col else None
+        rows.append(
+            BatchRow(
+                question=str(row[question_col]),
+                context=str(ctx) if pd.notna(ctx) else "",
+                ground_truth=str(gt) if gt is not None and pd.notna(gt) else "",
+                variables={
+                    var: str(row[col]) if pd.notna(row[col]) else ""
+                    for var, col in variable_columns.items()
+                },
+            )
+        )
+    return rows
+
+
+def match_variable_columns(
+    variables: list[str], columns: list[str]
+) -> dict[str, str]:
+    lower_cols = {c.lower().strip(): c for c in columns}
+    return {
+        var: lower_cols[var.lower()] for var in variables if var.lower() in lower_cols
+    }
+
+
+def render_system_prompts(
+    rows: list[BatchRow], prompts: list[str]
+) -> list[list[str]]:
+    """Rendered system prompts, indexed ``[row][prompt]``.
+
+    Raises KeyError if a prompt uses a variable that no row provides.
+    """
+    variables_df = pd.DataFrame([r.variables for r in rows], index=range(len(rows)))
+    per_prompt: list[list[str]] = []
+    for prompt in prompts:
+        compiled = compile_template(prompt)
+        if compiled.variables:
+            per_prompt.append(compiled.render_frame(variables_df).tolist())
+        else:
+            per_prompt.append([prompt] * len(rows))
+    return [list(row_prompts) for row_prompts in zip(*per_prompt)]
+
+
+def build_user_message(question: str, context: str) -> str:
+    parts = []
+    if context:
+        parts.append(context)
+    parts.append(question)
+    return "\n\n".join(parts)
+
+
+# ── Task bodies (run on worker threads) ─────────────────────────────────────
+
+
+def _generate(
+    limiter: ProviderLimiter,
+    config: LLMConfig,
+    system_prompt: str,
+    user_message: str,
+    use_cache: bool,
+) -> LLMResponse:
+    with limiter.slot(config):
+        return get_completion(
+            config, system_prompt, user_message, use_cache=use_cache
+        )
+
+
+def _judge(
+    limiter: ProviderLimiter,
+    judge: LLMJudge,
+    metric: str,
+    row: BatchRow,
+    answer: str,
+    generation_config: LLMConfig,
+    critique_name: Optional[str],
+) -> Union[float, str]:
+    with limiter.slot(judge.config):
+        if metric == "Answer Relevancy":
+            return judge.answer_relevancy(
+                row.question, answer, generation_config
+            )
+        if metric == "Faithfulness":
+            return judge.faithfulness(row.question, answer, row.context)
+        return judge.critique(
+            row.question, answer, CRITERIA_DICT[critique_name]
+        )
+
+
+def _judge_pack(
+    limiter: ProviderLimiter,
+    judge: LLMJudge,
+    question: str,
+    answers: list[str],
+    critique_name: str,
+    pack_size: int,
+) -> list[str]:
+    with limiter.slot(judge.config):
+        return judge.critique_many(
+            question, answers, CRITERIA_DICT[critique_name], pack_size
+        )
+
+
+def _extract(
+    limiter: ProviderLimiter, judge: LLMJudge, question: str, answer: str
+) -> list[str]:
+    with limiter.slot(judge.config):
+        return judge.extract_statements(question, answer)
+
+
+def _judge_cascade(
+    limiter: ProviderLimiter,
+    cascade: Cascade,
+    metric: str,
+    row: BatchRow,
+    answer: str,
+    generation_config: LLMConfig,
+    critique_name: Optional[str],
+    rule: Optional[str],
+    audit_key: str,
+) -> CascadeOutcome:
+    def _score(judge: LLMJudge, strictness: int):
+        with limiter.slot(judge.config):
+            if metric == "Answer Relevancy":
+                return judge.answer_relevancy(
+                    row.question, answer, generation_config, strictness
+                )
+            if metric == "Faithfulness":
+                return judge.faithfulness(row.question, answer, row.context, strictness)
+            return judge.critique_verdict(
+                row.question, answer, CRITERIA_DICT[critique_name], strictness
+            )
+
+    return cascade.run(_score, rule, audit_key)
+
+
+# ── Scheduling under a budget ───────────────────────────────────────────────
+# Once an active hard cap is reached nothing new is scheduled: later tasks
+# are never submitted and queued ones are cancelled. Their cells read
+# "ERROR: Budget exceeded".
+
+
+def _budget_error() -> BudgetExceeded:
+    return BudgetExceeded(f"Budget exceeded: {budget_exceeded() or 'cap reached'}")
+
+
+def _submit(pool: ThreadPoolExecutor, fn: Callable, *args) -> Future:
+    if budget_exceeded() is None:
+        return pool.submit(fn, *args)
+    future: Future = Future()
+    future.set_exception(_budget_error())
+    return future
+
+
+def _cancel_if_over_budget(futures: Iterable[Future]) -> bool:
+    """Cancel tasks that have not started once a hard cap is reached."""
+    if budget_exceeded() is None:
+        return False
+    for fut in futures:
+        fut.cancel()
+    return True
+
+
+def _outcome(fut: Future) -> Union[Any, Exception]:
+    # The task's result or its error; a cancelled task was over budget
+    if fut.cancelled():
+        return _budget_error()
+    return fut.exception() or fut.result()
+
+
+def _error_cell(error: BaseException) -> str:
+    # Timeouts are reported apart from failures so a rerun with a longer
+    # deadline is the obvious fix
+    return f"{'TIMEOUT' if is_timeout(error) else 'ERROR'}: {error}"
+
+
+def _judge_column(metric: str, prompt_idx: int, critique_name: Optional[str]) -> str:
+    if metric == "Critique":
+        return f"Critique_{critique_name}_Prompt{prompt_idx + 1}"
+    return f"{metric}_Prompt{prompt_idx + 1}"
+
+
+# ── NLP metrics ─────────────────────────────────────────────────────────────
+
+
+def _nlp_columns(nlp_metrics: list[str], pair_scores: list[dict]) -> dict:
+    row: dict = {}
+    if "ROUGE Score" in nlp_metrics:
+        row["ROUGE Score"] = (
+            f"R1:{[s['rouge1'] for s in pair_scores]} "
+            f"R2:{[s['rouge2'] for s in pair_scores]} "
+            f"RL:{[s['rougeL'] for s in pair_scores]}"
+        )
+    if "BLEU Score" in nlp_metrics:
+        row["BLEU Score"] = [s["bleu"] for s in pair_scores]
+    if "BERT Score" in nlp_metrics:
+        row["BERT Score"] = round(
+            float(np.mean([s["bert_f1"] for s in pair_scores])), 3
+        )
+    return row
+
+
+# ── Runner ──────────────────────────────────────────────────────────────────
+
+
+@traced("batch.run")
+def run_batch(
+    rows: list[BatchRow],
+    spec: BatchSpec,
+    on_progress: Optional[ProgressCallback] = None,
+) -> tuple[pd.DataFrame, PlanStats]:
+    with use_hedging(spec.hedging), deadline(spec.deadline_s):
+        return _run_batch(rows, spec, on_progress)
+
+
+def _run_batch(
+    rows: list[BatchRow],
+    spec: BatchSpec,
+    on_progress: Optional[ProgressCallback],
+) -> tuple[pd.DataFrame, PlanStats]:
+    has_ground_truth = any(r.ground_truth for r in rows)
+    limiter = ProviderLimiter(spec.provider_concurrency)
+    # Context rendering is shared by every (prompt, model) pair of a row
+    user_messages = [build_user_message(r.question, r.context) for r in rows]
+    system_prompts = render_system_prompts(rows, spec.prompts)
+    judge = LLMJudge(
+        spec.judge_config,
+        nli=spec.nli_backend,
+        extractor=STATEMENT_EXTRACTORS.get(spec.statement_extractor),
+        context_mode=spec.context_mode,
+    )
+    criteria = CRITERIA_DICT.get(spec.critique_name) if spec.critique_name else None
+    stats = PlanStats()
+
+    def _report(stage: str, done: int, total: int) -> None:
+        if on_progress is not None:
+            on_progress(stage, done, total)
+
+    # ── Plan generation: hash (config, system prompt, user message) ──────
+    gen_cells: dict[Cell, tuple[LLMConfig, str, str]] = {
+        (r, m, p): (config, sys_prompt, user_messages[r])
+        for r in range(len(rows))
+        for m, config in enumerate(spec.configs)
+        for p, sys_prompt in enumerate(system_prompts[r])
+    }
+    gen_units, gen_assignment = dedupe(gen_cells, lambda w: generation_key(*w))
+    stats.generation_cells, stats.generation_units = len(gen_cells), len(gen_units)
+
+    # ── NLP metrics: hash (prediction, reference), scored as answers land ─
+    unit_cells: dict[str, list[Cell]] = {}
+    for cell, unit in gen_assignment.items():
+        unit_cells.setdefault(unit, []).append(cell)
+    nlp_processes = spec.nlp_processes
+    if nlp_processes is None:
+        nlp_processes = default_processes(
+            spec.nlp_metrics, sum(1 for r, _, _ in gen_cells if rows[r].ground_truth)
+        )
+    scorer = NLPScorer(
+        spec.nlp_metrics, nlp_processes, bertscore_backend=spec.bertscore_backend
+    )
+    nlp_assignment: dict[Cell, str] = {}
+    nlp_units: set[str] = set()
+
+    def _queue_nlp(unit: str, result: Union[LLMResponse, Exception]) -> None:
+        content = result.content if isinstance(result, LLMResponse) else ""
+        for cell in unit_cells[unit]:
+            reference = rows[cell[0]].ground_truth
+            if not spec.nlp_metrics or not reference:
+                continue
+            key = nlp_key(content, reference)
+            nlp_assignment[cell] = key
+            if key not in nlp_units:
+                nlp_units.add(key)
+                scorer.add(key, (content, reference))
+
+    with make_executor(spec.max_workers) as pool:
+        gen_futures = {
+            _submit(pool, _generate, limiter, *work, spec.use_cache): unit
+            for unit, work in gen_units.items()
+        }
+        gen_results: dict[str, Union[LLMResponse, Exception]] = {}
+        over_budget = False
+        for done, fut in enumerate(as_completed(gen_futures), start=1):
+            unit = gen_futures[fut]
+            gen_results[unit] = _outcome(fut)
+            over_budget = over_budget or _cancel_if_over_budget(gen_futures)
+            _queue_nlp(unit, gen_results[unit])
+            _report("generation", done, len(gen_futures))
+        answers = fan_out(gen_assignment, gen_results)
+        stats.nlp_pairs, stats.nlp_units = len(nlp_assignment), len(nlp_units)
+
+        def _content(cell: Cell) -> str:
+            resp = answers[cell]
+            return resp.content if isinstance(resp, LLMResponse) else ""
+
+        # ── Plan judging: hash (metric, question, answer, context) ────────
+        judge_metrics = [
+            m for m in spec.llm_metrics if m != "Critique" or spec.critique_name
+        ]
+        judge_cells: dict[tuple[Cell, str], tuple] = {}
+        for cell in answers:
+            content = _content(cell)
+            if not content:
+                continue
+            r, m, _ = cell
+            for metric in judge_metrics:
+                judge_cells[(cell, metric)] = (metric, rows[r], content, spec.configs[m])
+
+        def _judge_unit_key(work: tuple) -> str:
+            metric, row, content, gen_config = work
+            return judge_key(
+                spec.judge_config,
+                metric,
+                row.question,
+                content,
+                row.context if metric == "Faithfulness" else "",
+                criteria if metric == "Critique" else None,
+                gen_config.provider if metric == "Answer Relevancy" else None,
+            )
+
+        judge_units, judge_assignment = dedupe(judge_cells, _judge_unit_key)
+        stats.judge_cells, stats.judge_units = len(judge_cells), len(judge_units)
+
+        # Judge calls go to the thread pool while NLP metrics finish in the
+        # process pool (or on this thread when it is disabled). With packing,
+        # Critique answers to the same question share listwise requests.
+        cascade = Cascade(spec.cascade, judge) if spec.cascade else None
+        rouge: dict[str, float] = {}
+        if cascade is not None and spec.critique_name == "Correctness":
+            ruled = [
+                unit
+                for unit, (metric, row, _, _) in judge_units.items()
+                if metric == "Critique" and row.ground_truth
+            ]
+            rouge = dict(
+                zip(
+                    ruled,
+                    rouge_l(
+                        [judge_units[u][2] for u in ruled],
+                        [judge_units[u][1].ground_truth for u in ruled],
+                    ),
+                )
+            )
+        judge_futures: dict = {}
+        judge_results: dict[str, Union[float, str]] = {}
+        by_question: dict[str, list[str]] = {}
+        # With local NLI, Faithfulness statements are extracted here and all
+        # of them verified in one model pass once extraction is done
+        extract_futures: dict = {}
+        for unit, (metric, row, content, gen_config) in judge_units.items():
+            if metric == "Faithfulness" and judge.nli != "llm" and cascade is None:
+                if not row.context.strip():
+                    judge_results[unit] = 0.0
+                    continue
+                extract_futures[
+                    _submit(pool, _extract, limiter, judge, row.question, content)
+                ] = unit
+                continue
+            if cascade is not None:
+                judge_futures[
+                    _submit(
+                        pool,
+                        _judge_cascade,
+                        limiter,
+                        cascade,
+                        metric,
+                        row,
+                        content,
+                        gen_config,
+                        spec.critique_name,
+                        cascade.rule(rouge.get(unit)),
+                        unit,
+                    )
+                ] = unit
+                continue
+            if metric == "Critique" and spec.judge_pack_size > 1:
+                by_question.setdefault(row.question, []).append(unit)
+                continue
+            judge_futures[
+                _submit(
+                    pool,
+                    _judge,
+                    limiter,
+                    judge,
+                    metric,
+                    row,
+                    content,
+                    gen_config,
+                    spec.critique_name,
+                )
+            ] = unit
+        for question, units in by_question.items():
+            contents = [judge_units[u][2] for u in units]
+            for pack in pack_answers(contents, spec.judge_pack_size, spec.judge_pack_size):
+                if len(pack) > 1:
+                    stats.judge_packed += len(pack)
+                    stats.judge_packs += 1
+                judge_futures[
+                    _submit(
+                        pool,
+                        _judge_pack,
+                        limiter,
+                        judge,
+                        question,
+                        [contents[i] for i in pack],
+                        spec.critique_name,
+                        spec.judge_pack_size,
+                    )
+                ] = [units[i] for i in pack]
+
+        if nlp_units:
+            _report("nlp", 0, len(nlp_units))
+            with span("batch.nlp", pairs=len(nlp_units), processes=nlp_processes):
+                # Pairs still scoring at the deadline are left out
+                nlp_scores = fan_out(nlp_assignment, scorer.results(timeout=remaining()))
+            _report("nlp", len(nlp_units), len(nlp_units))
+        else:
+            nlp_scores = {}
+
+        over_budget = False
+        for done, fut in enumerate(as_completed(judge_futures), start=1):
+            # A pack task covers a list of units and returns one value each
+            target = judge_futures[fut]
+            units = target if isinstance(target, list) else [target]
+            outcome = _outcome(fut)
+            if isinstance(outcome, Exception):
+                values = [_error_cell(outcome)] * len(units)
+            else:
+                values = outcome if isinstance(target, list) else [outcome]
+            over_budget = over_budget or _cancel_if_over_budget(judge_futures)
+            for i, value in enumerate(values):
+                if isinstance(value, CascadeOutcome):
+                    record(stats, value)
+                    values[i] = value.value
+            judge_results.update(zip(units, values))
+            _report("judge", done, len(judge_futures))
+
+        if extract_futures:
+            statements: dict[str, list[str]] = {}
+            over_budget = False
+            for fut in as_completed(extract_futures):
+                unit = extract_futures[fut]
+                outcome = _outcome(fut)
+                if isinstance(outcome, Exception):
+                    judge_results[unit] = _error_cell(outcome)
+                else:
+                    statements[unit] = outcome
+                over_budget = over_budget or _cancel_if_over_budget(extract_futures)
+            verified = list(statements)
+            _report("nli", 0, len(verified))
+            try:
+                judge_results.update(
+                    zip(
+                        verified,
+                        judge.score_statements(
+                            [statements[u] for u in verified],
+                            [judge_units[u][1].context for u in verified],
+                        ),
+                    )
+                )
+            except Exception as e:
+                judge_results.update(dict.fromkeys(verified, _error_cell(e)))
+            _report("nli", len(verified), len(verified))
+        judge_scores = fan_out(judge_assignment, judge_results)
+
+    stats.timed_out = (
+        sum(1 for a in answers.values() if isinstance(a, Exception) and is_timeout(a))
+        + sum(
+            1
+            for v in judge_scores.values()
+            if isinstance(v, str) and v.startswith("TIMEOUT")
+        )
+        + sum(1 for cell in nlp_assignment if cell not in nlp_scores)
+    )
+
+    # ── Assemble one combined table, one line per (row, model) ────────────
+    results_data: list[dict] = []
+    for r, row in enumerate(rows):
+        for m, config in enumerate(spec.configs):
+            result_row: dict = {
+                "Question": row.question,
+                "Context": row.context,
+                "Model": config.model_name,
+            }
+            if spec.config_labels:
+                result_row["Config"] = spec.config_labels[m]
+            if has_ground_truth:
+                result_row["Ground Truth"] = row.ground_truth
+
+            for p, sys_prompt in enumerate(system_prompts[r]):
+                resp = answers[(r, m, p)]
+                result_row[f"System_Prompt_{p + 1}"] = sys_prompt
+                if isinstance(resp, LLMResponse):
+                    result_row[f"Answer_{p + 1}"] = resp.content
+                    result_row[f"Tokens_{p + 1}"] = (
+                        f"{resp.input_tokens}+{resp.output_tokens}"
+                    )
+                    result_row[f"Cost_{p + 1}"] = f"${resp.estimated_cost_usd:.5f}"
+                else:
+                    result_row[f"Answer_{p + 1}"] = _error_cell(resp)
+                    result_row[f"Tokens_{p + 1}"] = "0"
+                    result_row[f"Cost_{p + 1}"] = "$0"
+
+            model_cells = [(r, m, p) for p in range(len(spec.prompts))]
+            if all(cell in nlp_scores for cell in model_cells):
+                result_row.update(
+                    _nlp_columns(
+                        spec.nlp_metrics, [nlp_scores[cell] for cell in model_cells]
+                    )
+                )
+
+            for p, cell in enumerate(model_cells):
+                for metric in spec.llm_metrics:
+                    if (cell, metric) in judge_scores:
+                        col = _judge_column(metric, p, spec.critique_name)
+                        result_row[col] = judge_scores[(cell, metric)]
+
+            results_data.append(result_row)
+
+    return pd.DataFrame(results_data), stats
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import os
+import threading
+from functools import lru_cache
+from typing import Callable, Optional
+
+import numpy as np
+
+from core.embedding_cache import (
+    EmbeddingCache,
+    TokenEmbeddings,
+    embedding_key,
+    get_embedding_cache,
+)
+from core.tracing import set_attribute
+
+# CPU-optimized BERTScore. Computes the same greedy-matching precision,
+# recall and F1 as bert_score (no idf, no baseline rescaling, [CLS]/[SEP]
+# weighted 0, contextual embeddings from the same truncated layer) but runs
+# the encoder through ONNX Runtime or a dynamically int8-quantized PyTorch
+# model, and batches texts by token length so little compute is spent on
+# padding. Every backend is optional: torch/transformers for "torch" and
+# "int8", onnxruntime (plus torch once, to export the model) for "onnx" and
+# "onnx-int8". "evaluate" keeps the original evaluate/bert_score path.
+# Encoded texts are kept in core.embedding_cache, so references repeated
+# across prompts, models and reruns are encoded only once.
+
+BACKENDS = ("evaluate", "torch", "int8", "onnx", "onnx-int8")
+DEFAULT_MODEL = "distilbert-base-uncased"
+# Hidden layer bert_score reads for each model (bert_score.utils.model2layers);
+# limited to WordPiece models, whose tokenization needs no extra handling
+MODEL_LAYERS = {
+    "distilbert-base-uncased": 5,
+    "distilbert-base-multilingual-cased": 5,
+    "bert-base-uncased": 9,
+    "bert-base-multilingual-cased": 9,
+}
+# Padded tokens per forward pass; batches are cut when the next (longer)
+# text would push batch_size * longest past this
+MAX_BATCH_TOKENS = 8192
+MAX_BATCH_SIZE = 64
+ONNX_DIR = os.environ.get(
+    "PROMPT_TESTING_ONNX_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "prompt-testing", "onnx"),
+)
+
+# (input_ids, attention_mask) -> hidden states [batch, sequence, hidden]
+Encoder = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+_export_lock = threading.Lock()
+
+
+def length_buckets(
+    lengths: list[int],
+    max_batch_tokens: int = MAX_BATCH_TOKENS,
+    max_batch_size: int = MAX_BATCH_SIZE,
+) -> list[list[int]]:
+    """Indices grouped into batches of similar length, shortest first."""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches: list[list[int]] = []
+    current: list[int] = []
+    for i in order:
+        # Sorted ascending, so lengths[i] is the longest in the batch so far
+        if current and (
+            len(current) >= max_batch_size
+            or lengths[i] * (len(current) + 1) > max_batch_tokens
+        ):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def padding_fraction(lengths: list[int], batches: list[list[int]]) -> float:
+    """Share of the encoded positions that are padding."""
+    padded = sum(max(lengths[i] for i in b) * len(b) for b in batches)
+    return 1 - sum(lengths) / padded if padded else 0.0
+
+
+def greedy_match(hyp: TokenEmbeddings, ref: TokenEmbeddings) -> tuple[float, float, float]:
+    """BERTScore precision, recall and F1 for one pair of encoded texts."""
+    hyp_emb, hyp_weights = hyp
+    ref_emb, ref_weights = ref
+    sim = hyp_emb @ ref_emb.T
+    # Special tokens take part in the matching but carry no weight
+    hyp_total, ref_total = hyp_weights.sum(), ref_weights.sum()
+    precision = float(sim.max(axis=1) @ hyp_weights / hyp_total) if hyp_total else 0.0
+    recall = float(sim.max(axis=0) @ ref_weights / ref_total) if ref_total else 0.0
+    if precision + recall == 0:
+        return precision, recall, 0.0
+    return precision, recall, 2 * precision * recall / (precision + recall)
+
+
+def _truncate_layers(model, num_layers: int) -> None:
+    # Layers above the one we read are never needed
+    import torch
+
+    if hasattr(model, "transformer") and hasattr(model.transformer, "layer"):
+        model.transformer.layer = torch.nn.ModuleList(model.transformer.layer[:num_layers])
+    elif hasattr(model, "encoder") and hasattr(model.encoder, "layer"):
+        model.encoder.layer = torch.nn.ModuleList(model.encoder.layer[:num_layers])
+    else:
+        raise ValueError(f"Don't know how to truncate {type(model).__name__}")
+
+
+def _load_torch_model(model_type: str, num_layers: int):
+    from transformers import AutoModel
+
+    model = AutoModel.from_pretrained(model_type)
+    model.eval()
+    _truncate_layers(model, num_layers)
+    return model
+
+
+def _torch_encoder(model_type: str, num_layers: int, quantize: bool) -> Encoder:
+    import torch
+
+    model = _load_torch_model(model_type, num_layers)
+    if quantize:
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+    def encode(input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            out = model(
+                input_ids=torch.from_numpy(input_ids),
+                attention_mask=torch.from_numpy(attention_mask),
+            )
+        return out[0].float().numpy()
+
+    return encode
+
+
+def onnx_path(model_type: str, num_layers: int, quantized: bool = False) -> str:
+    name = f"{model_type.replace('/', '--')}-L{num_layers}"
+    return os.path.join(ONNX_DIR, name + ("-int8" if quantized else "") + ".onnx")
+
+
+def export_onnx(model_type: str, num_layers: int, quantized: bool = False) -> str:
+    """Export the truncated encoder to ONNX once; later calls reuse the file."""
+    path = onnx_path(model_type, num_layers, quantized)
+    with _export_lock:
+        if os.path.exists(path):
+            return path
+        os.makedirs(ONNX_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if quantized:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            fp32 = onnx_path(model_type, num_layers)
+            if not os.path.exists(fp32):
+                _export_fp32(model_type, num_layers, fp32)
+            quantize_dynamic(fp32, tmp, weight_type=QuantType.QInt8)
+        else:
+            _export_fp32(model_type, num_layers, tmp)
+        os.replace(tmp, path)
+    return path
+
+
+def _export_fp32(model_type: str, num_layers: int, path: str) -> None:
+    import torch
+
+    model = _load_torch_model(model_type, num_layers)
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    dummy = torch.ones((2, 8), dtype=torch.long)
+    torch.onnx.export(
+        _LastHiddenState(),
+        (dummy, dummy),
+        path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=14,
+    )
+
+
+def onnx_encoder(model_type: str, num_layers: int, quantized: bool) -> Encoder:
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(
+        export_onnx(model_type, num_layers, quantized),
+        options,
+        providers=["CPUExecutionProvider"],
+    )
+
+    def encode(input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return session.run(
+            ["last_hidden_state"],
+            {"input_ids": input_ids, "attention_mask": attention_mask},
+        )[0]
+
+    return encode
+
+
+class FastBERTScorer:
+    """BERTScore on a CPU-optimized encoder with length-bucketed batches."""
+
+    def __init__(
+        self,
+        model_type: str = DEFAULT_MODEL,
+        backend: str = "onnx",
+        num_layers: Optional[int] = None,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        if backend not in BACKENDS or backend == "evaluate":
+            raise ValueError(f"Unknown BERTScore backend: {backend}")
+        from transformers import AutoTokenizer
+
+        self.model_type = model_type
+        self.backend = backend
+        self.num_layers = num_layers or MODEL_LAYERS.get(model_type, 0)
+        if not self.num_layers:
+            raise ValueError(f"No default layer for {model_type}; pass num_layers")
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.cache = cache
+        # Embeddings differ per model, layer and (quantized or not) backend
+        self._namespace = f"{model_type}|L{self.num_layers}|{backend}"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_type)
+        self._special_ids = {self.tokenizer.cls_token_id, self.tokenizer.sep_token_id}
+        if backend in ("torch", "int8"):
+            self._encoder = _torch_encoder(model_type, self.num_layers, backend == "int8")
+        else:
+            self._encoder = onnx_encoder(model_type, self.num_layers, backend == "onnx-int8")
+        self.padding_fraction = 0.0
+
+    def _tokenize(self, text: str) -> list[int]:
+        # Same encoding as bert_score.utils.sent_encode
+        text = text.strip()
+        if not text:
+            return self.tokenizer.build_inputs_with_special_tokens([])
+        return self.tokenizer.encode(
+            text,
+            add_special_tokens=True,
+            max_length=self.tokenizer.model_max_length,
+            truncation=True,
+        )
+
+    def encode(self, texts: list[str]) -> dict[str, TokenEmbeddings]:
+        """Normalized token embeddings and weights per distinct text."""
+        unique = list(dict.fromkeys(texts))
+        keys = {t: embedding_key(self._namespace, t) for t in unique}
+        cached = self.cache.get_many(list(keys.values())) if self.cache else {}
+        encoded = {t: cached[keys[t]] for t in unique if keys[t] in cached}
+        todo = [t for t in unique if t not in encoded]
+        set_attribute("bertscore.cached", len(encoded))
+        set_attribute("bertscore.encoded", len(todo))
+        if todo:
+            fresh = self._encode_texts(todo)
+            encoded.update(fresh)
+            if self.cache:
+                self.cache.put_many({keys[t]: v for t, v in fresh.items()})
+        return encoded
+
+    def _encode_texts(self, texts: list[str]) -> dict[str, TokenEmbeddings]:
+        token_ids = [self._tokenize(t) for t in texts]
+        lengths = [len(ids) for ids in token_ids]
+        batches = length_buckets(lengths, self.max_batch_tokens, self.max_batch_size)
+        self.padding_fraction = padding_fraction(lengths, batches)
+        pad_id = self.tokenizer.pad_token_id or 0
+        encoded: dict[str, TokenEmbeddings] = {}
+        for batch in batches:
+            width = max(lengths[i] for i in batch)
+            input_ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                input_ids[row, : lengths[i]] = token_ids[i]
+                attention_mask[row, : lengths[i]] = 1
+            hidden = self._encoder(input_ids, attention_mask)
+            for row, i in enumerate(batch):
+                emb = hidden[row, : lengths[i]].astype(np.float32)
+                emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+                weights = np.array(
+                    [0.0 if t in self._special_ids else 1.0 for t in token_ids[i]],
+                    dtype=np.float32,
+                )
+                encoded[texts[i]] = (emb, weights)
+        return encoded
+
+    def score(self, predictions: list[str], references: list[str]) -> dict[str, list[float]]:
+        encoded = self.encode(predictions + references)
+        results: dict[str, list[float]] = {"precision": [], "recall": [], "f1": []}
+        for pred, ref in zip(predictions, references):
+            p, r, f = greedy_match(encoded[pred], encoded[ref])
+            results["precision"].append(p)
+            results["recall"].append(r)
+            results["f1"].append(f)
+        return results
+
+
+@lru_cache(maxsize=None)
+def get_scorer(model_type: str = DEFAULT_MODEL, backend: str = "onnx") -> FastBERTScorer:
+    # One loaded encoder per process (and per NLP pool worker)
+    return FastBERTScorer(model_type, backend, cache=get_embedding_cache())
@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import json
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+import pandas as pd
+
+from core.schemas import BudgetLimits, Spend
+
+# Live spend accounting. Every billed provider call is charged to each
+# active BudgetManager (typically one per run and one per session), keyed
+# by (provider, kind) where kind is "generation" or "judge"; embedding
+# requests count as whichever kind made them. Once a manager's hard cap is
+# reached, batch runs stop scheduling work (queued tasks are cancelled) and
+# any further call raises BudgetExceeded before it reaches the provider.
+# Calls in flight are not yet charged, so under a hard cap each call first
+# reserves its worst case (prompt tokens plus max_tokens of output at the
+# model's price) and may only start while spent plus reserved stays within
+# the cap. It waits for calls in flight to settle when they are what is in
+# the way, and is refused when it could not fit even without them. The
+# reservation is released once the actual cost is charged.
+
+GENERATION = "generation"
+JUDGE = "judge"
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+class BudgetManager:
+    def __init__(self, limits: Optional[BudgetLimits] = None, name: str = "run"):
+        self.limits = limits or BudgetLimits()
+        self.name = name
+        self._ledger: dict[tuple[str, str], Spend] = {}
+        # Estimated spend of calls in flight
+        self._reserved_calls = 0
+        self._reserved_cost = 0.0
+        self._reserved_tokens = 0
+        self._lock = threading.Lock()
+        self._settled = threading.Condition(self._lock)
+
+    @property
+    def capped(self) -> bool:
+        limits = self.limits
+        return limits.max_cost_usd is not None or limits.max_tokens is not None
+
+    def record(
+        self,
+        provider: str,
+        kind: str,
+        input_tokens: int,
+        output_tokens: int,
+        cost_usd: float,
+    ) -> None:
+        charge = Spend(
+            calls=1,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cost_usd=cost_usd,
+        )
+        with self._lock:
+            key = (provider, kind)
+            self._ledger[key] = self._ledger.get(key, Spend()) + charge
+
+    def _overshoot(
+        self, cost_usd: float, tokens: int, in_flight: bool
+    ) -> Optional[str]:
+        # Caller holds the lock. Reason a call of this estimate can't start,
+        # counting the calls in flight or not
+        spend = sum(self._ledger.values(), Spend())
+        reserved_cost = self._reserved_cost if in_flight else 0.0
+        reserved_tokens = self._reserved_tokens if in_flight else 0
+        max_cost, max_tokens = self.limits.max_cost_usd, self.limits.max_tokens
+        if max_cost is not None and (
+            spend.cost_usd >= max_cost
+            or spend.cost_usd + reserved_cost + cost_usd > max_cost
+        ):
+            return (
+                f"{self.name} cost cap ${max_cost:.4f} reached or would be passed "
+                f"(${spend.cost_usd:.4f} spent, ${self._reserved_cost:.4f} in "
+                f"flight, up to ${cost_usd:.4f} for this call)"
+            )
+        if max_tokens is not None and (
+            spend.tokens >= max_tokens
+            or spend.tokens + reserved_tokens + tokens > max_tokens
+        ):
+            return (
+                f"{self.name} token cap {max_tokens:,} reached or would be passed "
+                f"({spend.tokens:,} used, {self._reserved_tokens:,} in flight, "
+                f"up to {tokens:,} for this call)"
+            )
+        return None
+
+    def reserve(self, cost_usd: float, tokens: int) -> None:
+        """Hold a call's estimated spend; raises BudgetExceeded if spent plus
+        reserved would pass a hard cap."""
+        with self._lock:
+            reason = self._overshoot(cost_usd, tokens, in_flight=True)
+            if reason is None:
+                self._reserved_calls += 1
+                self._reserved_cost += cost_usd
+                self._reserved_tokens += tokens
+        if reason:
+            raise BudgetExceeded(f"Budget exceeded: {reason}")
+
+    def release(self, cost_usd: float, tokens: int, calls: int = 1) -> None:
+        with self._settled:
+            self._reserved_calls -= calls
+            if self._reserved_calls <= 0:
+                # Nothing in flight: no float residue left waiting on
+                self._reserved_calls = 0
+                self._reserved_cost, self._reserved_tokens = 0.0, 0
+            else:
+                self._reserved_cost -= cost_usd
+                self._reserved_tokens -= tokens
+            self._settled.notify_all()
+
+    def wait_for_room(self, cost_usd: float, tokens: int) -> Optional[str]:
+        """Wait while only calls in flight keep this estimate from fitting;
+        the reason it can't fit without them either, or None once it may."""
+        with self._settled:
+            while self._overshoot(cost_usd, tokens, in_flight=True):
+                reason = self._overshoot(cost_usd, tokens, in_flight=False)
+                if reason:
+                    return reason
+                self._settled.wait()
+            return None
+
+    def ledger_json(self) -> str:
+        """The ledger as JSON, for ``load_ledger``."""
+        with self._lock:
+            entries = sorted(self._ledger.items())
+        return json.dumps(
+            [{"provider": p, "kind": k, **s.model_dump()} for (p, k), s in entries]
+        )
+
+    def load_ledger(self, data: str) -> None:
+        """Replace the ledger with one saved by ``ledger_json``."""
+        ledger = {
+            (e.pop("provider"), e.pop("kind")): Spend(**e) for e in json.loads(data)
+        }
+        with self._lock:
+            self._ledger = ledger
+
+    def total(
+        self, kind: Optional[str] = None, provider: Optional[str] = None
+    ) -> Spend:
+        with self._lock:
+            entries = list(self._ledger.items())
+        spend = Spend()
+        for (p, k), s in entries:
+            if (kind is None or k == kind) and (provider is None or p == provider):
+                spend = spend + s
+        return spend
+
+    def remaining_cost(self) -> Optional[float]:
+        if self.limits.max_cost_usd is None:
+            return None
+        return max(0.0, self.limits.max_cost_usd - self.total().cost_usd)
+
+    def remaining_tokens(self) -> Optional[int]:
+        if self.limits.max_tokens is None:
+            return None
+        return max(0, self.limits.max_tokens - self.total().tokens)
+
+    def exceeded(self) -> Optional[str]:
+        """Reason the hard cap is reached, or None."""
+        spend = self.total()
+        if self.limits.max_cost_usd is not None and spend.cost_usd >= self.limits.max_cost_usd:
+            return (
+                f"{self.name} cost cap ${self.limits.max_cost_usd:.4f} reached "
+                f"(${spend.cost_usd:.4f} spent)"
+            )
+        if self.limits.max_tokens is not None and spend.tokens >= self.limits.max_tokens:
+            return (
+                f"{self.name} token cap {self.limits.max_tokens:,} reached "
+                f"({spend.tokens:,} used)"
+            )
+        return None
+
+    def warning(self) -> Optional[str]:
+        """Reason the soft cap is reached, or None."""
+        spend = self.total()
+        if self.limits.warn_cost_usd is not None and spend.cost_usd >= self.limits.warn_cost_usd:
+            return (
+                f"{self.name} spend ${spend.cost_usd:.4f} passed the "
+                f"${self.limits.warn_cost_usd:.4f} warning level"
+            )
+        if self.limits.warn_tokens is not None and spend.tokens >= self.limits.warn_tokens:
+            return (
+                f"{self.name} usage {spend.tokens:,} tokens passed the "
+                f"{self.limits.warn_tokens:,} warning level"
+            )
+        return None
+
+    def check(self) -> None:
+        reason = self.exceeded()
+        if reason:
+            raise BudgetExceeded(f"Budget exceeded: {reason}")
+
+    def summary(self) -> str:
+        spend = self.total()
+        gen = self.total(kind=GENERATION)
+        judge = self.total(kind=JUDGE)
+        text = (
+            f"{self.name.capitalize()}: ${spend.cost_usd:.4f} / {spend.tokens:,} tokens "
+            f"(generation ${gen.cost_usd:.4f}, judge ${judge.cost_usd:.4f})"
+        )
+        remaining = []
+        if (cost_left := self.remaining_cost()) is not None:
+            remaining.append(f"${cost_left:.4f}")
+        if (tokens_left := self.remaining_tokens()) is not None:
+            remaining.append(f"{tokens_left:,} tokens")
+        if remaining:
+            text += " — " + " / ".join(remaining) + " left"
+        return text
+
+    def breakdown(self) -> pd.DataFrame:
+        with self._lock:
+            entries = sorted(self._ledger.items())
+        return pd.DataFrame(
+            [
+                {
+                    "Provider": provider,
+                    "Kind": kind,
+                    "Calls": s.calls,
+                    "Input Tokens": s.input_tokens,
+                    "Output Tokens": s.output_tokens,
+                    "Cost ($)": round(s.cost_usd, 6),
+                }
+                for (provider, kind), s in entries
+            ]
+        )
+
+
+# ── Active budgets ──────────────────────────────────────────────────────────
+
+_active: ContextVar[tuple[BudgetManager, ...]] = ContextVar(
+    "active_budgets", default=()
+)
+_kind: ContextVar[str] = ContextVar("spend_kind", default=GENERATION)
+
+
+@contextmanager
+def use_budget(*managers: BudgetManager) -> Iterator[None]:
+    """Charge every provider call made in this context (and its worker tasks)."""
+    token = _active.set(_active.get() + managers)
+    try:
+        yield
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def spend_kind(kind: str) -> Iterator[None]:
+    token = _kind.set(kind)
+    try:
+        yield
+    finally:
+        _kind.reset(token)
+
+
+def check_budget() -> None:
+    for manager in _active.get():
+        manager.check()
+
+
+def budget_exceeded() -> Optional[str]:
+    """Reason an active budget's hard cap is reached, or None."""
+    for manager in _active.get():
+        reason = manager.exceeded()
+        if reason:
+            return reason
+    return None
+
+
+class Reservation:
+    """Estimated spend of one call, held against budgets until it settles."""
+
+    def __init__(
+        self, managers: tuple[BudgetManager, ...], cost_usd: float, tokens: int
+    ):
+        self.managers = managers
+        self.cost_usd = cost_usd
+        self.tokens = tokens
+        self._held = 0
+        self._lock = threading.Lock()
+
+    def add(self, wait: bool = False) -> None:
+        """Hold one more copy of the estimate; raises BudgetExceeded, holding
+        nothing new, if a cap would be passed. With ``wait``, first waits for
+        calls in flight to settle if that would make room."""
+        while True:
+            done: list[BudgetManager] = []
+            try:
+                for manager in self.managers:
+                    manager.reserve(self.cost_usd, self.tokens)
+                    done.append(manager)
+                break
+            except BudgetExceeded:
+                for manager in done:
+                    manager.release(self.cost_usd, self.tokens)
+                if not wait:
+                    raise
+                # Waits holding nothing, so waiters never block each other
+                blocked = self.managers[len(done)]
+                reason = blocked.wait_for_room(self.cost_usd, self.tokens)
+                if reason:
+                    raise BudgetExceeded(f"Budget exceeded: {reason}") from None
+        with self._lock:
+            self._held += 1
+
+    def release(self) -> None:
+        with self._lock:
+            held, self._held = self._held, 0
+        if held:
+            for manager in self.managers:
+                manager.release(self.cost_usd * held, self.tokens * held, held)
+
+    def __enter__(self) -> Reservation:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def reserve(estimate: Callable[[], tuple[float, int]]) -> Reservation:
+    """Hold a call's (cost, tokens) ``estimate`` against the active budgets
+    until the reservation is released; charge the actual spend before then.
+    Waits for calls in flight if they are what keeps it from fitting.
+    ``estimate`` is only called when a budget has a hard cap."""
+    managers = _active.get()
+    cost_usd, tokens = estimate() if any(m.capped for m in managers) else (0.0, 0)
+    hold = Reservation(managers, cost_usd, tokens)
+    hold.add(wait=True)
+    return hold
+
+
+def charge(provider: str, input_tokens: int, output_tokens: int, cost_usd: float) -> None:
+    kind = _kind.get()
+    for manager in _active.get():
+        manager.record(provider, kind, input_tokens, output_tokens, cost_usd)
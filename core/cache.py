@@ -2,35 +2,104 @@ from __future__ import annotations
 
 import hashlib
 import json
-from typing import Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 from core.schemas import LLMConfig, LLMResponse
 
 CACHE_KEY = "response_cache"
+# Entries kept by a cache that is not tied to a session
+MAX_CACHE_ENTRIES = 10_000
+
+
+class LRUCache(OrderedDict):
+    """Response cache that drops its least recently used entries."""
+
+    def __init__(self, max_entries: int = MAX_CACHE_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self:
+                return default
+            self.move_to_end(key)
+            return self[key]
+
+    def __setitem__(self, key, value) -> None:
+        with self._lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while len(self) > self.max_entries:
+                self.popitem(last=False)
+
+
+# Used when no Streamlit session is attached and no cache was set with
+# use_response_cache (CLI runs)
+_process_cache: LRUCache = LRUCache()
+# Set for a background job: its submitting session's cache, or its own
+_context_cache: ContextVar[Optional[dict[str, LLMResponse]]] = ContextVar(
+    "response_cache", default=None
+)
+
+_inflight: dict[tuple[int, str], Future] = {}
+_inflight_lock = threading.Lock()
 
 
 def _ensure_cache() -> dict[str, LLMResponse]:
+    cache = _context_cache.get()
+    if cache is not None:
+        return cache
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return _process_cache
     if CACHE_KEY not in st.session_state:
         st.session_state[CACHE_KEY] = {}
     return st.session_state[CACHE_KEY]
 
 
+def session_cache() -> Optional[dict[str, LLMResponse]]:
+    """The calling Streamlit session's response cache, or None outside one."""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    return _ensure_cache()
+
+
+@contextmanager
+def use_response_cache(cache: dict[str, LLMResponse]) -> Iterator[None]:
+    """Read and write ``cache`` in this context (and its worker tasks)."""
+    token = _context_cache.set(cache)
+    try:
+        yield
+    finally:
+        _context_cache.reset(token)
+
+
 def cache_key(config: LLMConfig, system_prompt: str, user_message: str) -> str:
-    payload = json.dumps(
-        {
-            "model": config.model_name,
-            "temperature": config.temperature,
-            "top_p": config.top_p,
-            "max_tokens": config.max_tokens,
-            "frequency_penalty": config.frequency_penalty,
-            "presence_penalty": config.presence_penalty,
-            "system_prompt": system_prompt,
-            "user_message": user_message,
-        },
-        sort_keys=True,
-    )
+    fields = {
+        "provider": config.provider,
+        "model": config.model_name,
+        "temperature": config.temperature,
+        "top_p": config.top_p,
+        "max_tokens": config.max_tokens,
+        "frequency_penalty": config.frequency_penalty,
+        "presence_penalty": config.presence_penalty,
+        "system_prompt": system_prompt,
+        "user_message": user_message,
+    }
+    # Only when set, so existing keys stay valid
+    if config.top_logprobs:
+        fields["top_logprobs"] = config.top_logprobs
+    if config.response_schema:
+        fields["response_schema"] = config.response_schema
+    payload = json.dumps(fields, sort_keys=True)
     return hashlib.sha256(payload.encode()).hexdigest()
 
 
@@ -42,3 +111,30 @@ def get_cached(key: str) -> Optional[LLMResponse]:
 def set_cached(key: str, response: LLMResponse) -> None:
     cache = _ensure_cache()
     cache[key] = response
+
+
+def single_flight(key: str, fn: Callable[[], LLMResponse]) -> LLMResponse:
+    # Concurrent callers with the same key and cache share one provider
+    # call: the first caller runs ``fn`` and everyone else waits for its
+    # result. Callers with different caches (sessions, jobs) never share.
+    flight = (id(_ensure_cache()), key)
+    with _inflight_lock:
+        future = _inflight.get(flight)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[flight] = future
+
+    if not is_leader:
+        return future.result().model_copy(update={"cached": True})
+
+    try:
+        result = fn()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(flight, None)
+    future.set_result(result)
+    return result
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Callable, Optional, Union
+
+from core.metrics import LLMJudge, NLPMetrics
+from core.schemas import CascadeOutcome, CascadePolicy, JudgeVerdict, PlanStats
+
+# Cascaded judging for batch runs. Each judge item stops at the first stage
+# that is sure of it:
+#   1. rule: ROUGE-L against the ground truth near 1 ("Yes") or near 0
+#      ("No") decides a Correctness critique without a judge call;
+#   2. cheap: the policy's cheap judge, kept when its Critique verdict is
+#      confident enough or its score falls outside the uncertain band;
+#   3. strong: the batch's judge_config, for everything still unsure.
+# Empty answers are never judged. A deterministic sample of early decisions
+# is also scored by the strong judge, so the run reports how often the
+# cheaper stages agree with it.
+
+RULE = "rule"
+CHEAP = "cheap"
+STRONG = "strong"
+
+# (judge, strictness) -> score from that judge
+Scorer = Callable[[LLMJudge, int], Union[float, JudgeVerdict]]
+
+
+def _value(score: Union[float, JudgeVerdict]) -> Union[float, str]:
+    return score.label if isinstance(score, JudgeVerdict) else score
+
+
+def _agree(a: Union[float, str], b: Union[float, str]) -> bool:
+    # Same verdict, or scores on the same side of 0.5
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    return (a >= 0.5) == (b >= 0.5)
+
+
+def rouge_l(answers: list[str], references: list[str]) -> list[float]:
+    if not answers:
+        return []
+    return NLPMetrics.rouge_score(answers, references)["rougeL"]
+
+
+class Cascade:
+    def __init__(self, policy: CascadePolicy, strong: LLMJudge):
+        self.policy = policy
+        self.strong = strong
+        self.cheap = LLMJudge(
+            policy.cheap_judge,
+            timeout=strong.timeout,
+            verdicts=policy.cheap_verdicts,
+            # Local NLI is cheaper than any judge LLM; the cheap stage keeps it
+            nli=strong.nli,
+            extractor=strong.extractor,
+            context_mode=strong.context_mode,
+            top_k=strong.top_k,
+        )
+
+    def rule(self, rouge: Optional[float]) -> Optional[str]:
+        """Correctness verdict from ROUGE-L alone, or None when unclear."""
+        if rouge is None:
+            return None
+        if rouge >= self.policy.rouge_high:
+            return "Yes"
+        if rouge <= self.policy.rouge_low:
+            return "No"
+        return None
+
+    def is_sure(self, score: Union[float, JudgeVerdict]) -> bool:
+        if isinstance(score, JudgeVerdict):
+            return score.confidence >= self.policy.min_confidence
+        return not self.policy.uncertain_low < score < self.policy.uncertain_high
+
+    def _audit(self, key: str) -> bool:
+        # Hash-based so a rerun audits the same items
+        h = int(hashlib.sha256(key.encode()).hexdigest()[:8], 16)
+        return h / 0xFFFFFFFF < self.policy.audit_fraction
+
+    def run(
+        self, score: Scorer, rule: Optional[str] = None, audit_key: str = ""
+    ) -> CascadeOutcome:
+        if rule is not None:
+            stage, value = RULE, rule
+        else:
+            cheap = score(self.cheap, self.policy.cheap_strictness)
+            if not self.is_sure(cheap):
+                strong = _value(score(self.strong, 1))
+                return CascadeOutcome(
+                    value=strong, stage=STRONG, agreed=_agree(_value(cheap), strong)
+                )
+            stage, value = CHEAP, _value(cheap)
+        if not self._audit(audit_key):
+            return CascadeOutcome(value=value, stage=stage)
+        strong = _value(score(self.strong, 1))
+        return CascadeOutcome(
+            value=strong, stage=stage, audited=True, agreed=_agree(value, strong)
+        )
+
+
+def record(stats: PlanStats, outcome: CascadeOutcome) -> None:
+    stats.cascade_items += 1
+    if outcome.stage == RULE:
+        stats.cascade_by_rule += 1
+    elif outcome.stage == CHEAP:
+        stats.cascade_by_cheap += 1
+    else:
+        stats.cascade_escalated += 1
+        stats.cascade_escalated_agreed += bool(outcome.agreed)
+    if outcome.audited:
+        stats.cascade_audited += 1
+        stats.cascade_audit_agreed += bool(outcome.agreed)
+
+
+def cascade_summary(stats: PlanStats) -> str:
+    items = stats.cascade_items
+    if not items:
+        return "Cascade: no judge items"
+    parts = [
+        f"Cascade: {stats.cascade_escalated}/{items} items escalated to the strong "
+        f"judge ({stats.cascade_escalated / items:.0%}); "
+        f"{stats.cascade_by_rule} decided by ROUGE, {stats.cascade_by_cheap} by the "
+        "cheap judge"
+    ]
+    if stats.cascade_audited:
+        parts.append(
+            f"audited agreement {stats.cascade_audit_agreed}/{stats.cascade_audited} "
+            f"({stats.cascade_audit_agreed / stats.cascade_audited:.0%})"
+        )
+    if stats.cascade_escalated:
+        parts.append(
+            f"cheap judge agreed on {stats.cascade_escalated_agreed}/"
+            f"{stats.cascade_escalated} escalated items"
+        )
+    return "; ".join(parts)
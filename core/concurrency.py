@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from core.deadline import DeadlineExceeded
+from core.schemas import LLMConfig
+from core.telemetry import LLM_CONCURRENCY_LIMIT
+
+# Starting number of simultaneous in-flight requests per provider; the
+# adaptive limiter moves from here. Local Ollama serves one request at a
+# time, so hitting it with cloud-level parallelism only queues work inside
+# the server and trips timeouts.
+DEFAULT_PROVIDER_CONCURRENCY: dict[str, int] = {
+    "openai": 8,
+    "anthropic": 4,
+    "google": 4,
+    "ollama": 1,
+}
+FALLBACK_CONCURRENCY = 4
+
+# Ceiling the adaptive limiter may grow to
+MAX_PROVIDER_CONCURRENCY: dict[str, int] = {"ollama": 2}
+FALLBACK_MAX_CONCURRENCY = 64
+
+# At most one decrease per this many seconds, so one burst of failures
+# backs off once rather than collapsing the limit to the minimum
+DECREASE_COOLDOWN_S = 2.0
+# Recent outcomes kept per (provider, model) for the error rate
+ERROR_WINDOW = 20
+
+
+class LimiterSaturated(RuntimeError):
+    """No free slot, for a caller that asked not to wait."""
+
+
+class ProviderLimiter:
+    """Fixed per-provider caps for a run, on top of the adaptive limits.
+
+    Only providers with an explicit limit are capped; the rest are governed
+    by ``adaptive_limiter`` alone.
+    """
+
+    def __init__(self, limits: Optional[dict[str, int]] = None):
+        self.limits = dict(limits or {})
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, provider: str) -> Optional[threading.BoundedSemaphore]:
+        if provider not in self.limits:
+            return None
+        with self._lock:
+            if provider not in self._semaphores:
+                limit = max(1, self.limits[provider])
+                self._semaphores[provider] = threading.BoundedSemaphore(limit)
+            return self._semaphores[provider]
+
+    @contextmanager
+    def slot(self, config: LLMConfig) -> Iterator[None]:
+        semaphore = self._semaphore(config.provider)
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+
+# ── Adaptive (AIMD) limits ──────────────────────────────────────────────────
+
+
+def is_overload(error: BaseException) -> bool:
+    """429s, 5xx and timeouts mean the provider wants less traffic."""
+    if isinstance(error, TimeoutError):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status in (408, 429) or status >= 500)
+
+
+def _counts_as_failure(error: BaseException) -> bool:
+    # Bad keys and malformed requests fail at any concurrency; a run's
+    # deadline or a cancelled call (a losing hedge) says nothing about the
+    # provider either
+    if not isinstance(error, Exception) or isinstance(error, DeadlineExceeded):
+        return False
+    status = getattr(error, "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500) or is_overload(error)
+
+
+class _LimitState:
+    def __init__(self, limit: float, max_limit: int):
+        self.limit = limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.cond = threading.Condition()
+        # True per recent call that failed for a reason other than the request
+        self.failures: deque[bool] = deque(maxlen=ERROR_WINDOW)
+        self.last_decrease = float("-inf")
+
+
+class AdaptiveLimiter:
+    """Additive-increase / multiplicative-decrease limit per (provider, model).
+
+    Each successful call made while the limit was fully used adds
+    ``1/limit`` (about +1 per round trip). An overload error (429, 5xx,
+    timeout) multiplies the limit by ``backoff``, and so does an error rate
+    of ``max_error_rate`` or more over the last ERROR_WINDOW calls (dropped
+    connections and the like; 4xx client errors are not counted). Latency
+    is not a signal: it grows with output length, so a long reply would
+    look like overload. Decreases happen at most once per
+    DECREASE_COOLDOWN_S.
+    """
+
+    def __init__(
+        self,
+        initial: Optional[dict[str, int]] = None,
+        maximum: Optional[dict[str, int]] = None,
+        backoff: float = 0.5,
+        max_error_rate: float = 0.5,
+        min_limit: int = 1,
+    ):
+        self.initial = {**DEFAULT_PROVIDER_CONCURRENCY, **(initial or {})}
+        self.maximum = {**MAX_PROVIDER_CONCURRENCY, **(maximum or {})}
+        self.backoff = backoff
+        self.max_error_rate = max_error_rate
+        self.min_limit = min_limit
+        self._states: dict[tuple[str, str], _LimitState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, provider: str, model: str) -> _LimitState:
+        with self._lock:
+            key = (provider, model)
+            if key not in self._states:
+                max_limit = self.maximum.get(provider, FALLBACK_MAX_CONCURRENCY)
+                start = min(max_limit, self.initial.get(provider, FALLBACK_CONCURRENCY))
+                self._states[key] = _LimitState(float(start), max_limit)
+                LLM_CONCURRENCY_LIMIT.set(start, provider=provider, model=model)
+            return self._states[key]
+
+    def limit(self, provider: str, model: str) -> int:
+        return int(self._state(provider, model).limit)
+
+    def limits(self) -> dict[tuple[str, str], int]:
+        with self._lock:
+            return {key: int(s.limit) for key, s in self._states.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+    def wake(self, provider: str, model: str) -> None:
+        """Make queued callers re-run their ``admit`` check now."""
+        state = self._state(provider, model)
+        with state.cond:
+            state.cond.notify_all()
+
+    @contextmanager
+    def slot(
+        self,
+        provider: str,
+        model: str,
+        admit: Optional[Callable[[], None]] = None,
+        wait_until: Optional[float] = None,
+        wait: bool = True,
+    ) -> Iterator[None]:
+        # ``admit`` runs before and after every wait; raising from it
+        # abandons the queue (an open circuit breaker or a passed deadline
+        # fails queued work). ``wait_until`` (time.monotonic()) wakes the
+        # waiter so ``admit`` can see the deadline. With ``wait=False`` a
+        # full limit raises LimiterSaturated instead of queueing.
+        state = self._state(provider, model)
+        with state.cond:
+            while True:
+                if admit is not None:
+                    admit()
+                if state.in_flight < int(state.limit):
+                    break
+                if not wait:
+                    raise LimiterSaturated(f"{provider}:{model} is at its limit")
+                if wait_until is None:
+                    state.cond.wait()
+                else:
+                    state.cond.wait(max(0.0, wait_until - time.monotonic()) + 0.001)
+            state.in_flight += 1
+            saturated = state.in_flight >= int(state.limit)
+        try:
+            yield
+        except BaseException as e:
+            self._release(state, provider, model, saturated, e)
+            raise
+        self._release(state, provider, model, saturated, None)
+
+    def _release(
+        self,
+        state: _LimitState,
+        provider: str,
+        model: str,
+        saturated: bool,
+        error: Optional[BaseException],
+    ) -> None:
+        now = time.monotonic()
+        with state.cond:
+            state.in_flight -= 1
+            if error is None:
+                state.failures.append(False)
+                if saturated:
+                    state.limit = min(state.max_limit, state.limit + 1 / state.limit)
+            elif _counts_as_failure(error):
+                state.failures.append(True)
+                error_rate = sum(state.failures) / len(state.failures)
+                unhealthy = (
+                    len(state.failures) >= ERROR_WINDOW // 2
+                    and error_rate >= self.max_error_rate
+                )
+                if (is_overload(error) or unhealthy) and (
+                    now - state.last_decrease >= DECREASE_COOLDOWN_S
+                ):
+                    state.limit = max(self.min_limit, state.limit * self.backoff)
+                    state.last_decrease = now
+            LLM_CONCURRENCY_LIMIT.set(int(state.limit), provider=provider, model=model)
+            state.cond.notify_all()
+
+
+# Shared by every caller of get_completion / get_embedding in the process
+adaptive_limiter = AdaptiveLimiter()
+
+
+class ContextExecutor(ThreadPoolExecutor):
+    """Runs each task in a copy of the submitter's contextvars (spans etc.)."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        ctx = contextvars.copy_context()
+        return super().submit(ctx.run, fn, *args, **kwargs)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # A run abandoned by an exception (e.g. a cancelled job) drops its
+        # queued tasks instead of finishing them first
+        self.shutdown(wait=True, cancel_futures=exc_type is not None)
+        return False
+
+
+def make_executor(max_workers: int) -> ThreadPoolExecutor:
+    # Worker threads inherit the Streamlit script context so that
+    # st.session_state (and with it the response cache) stays reachable.
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def _attach_ctx() -> None:
+        if ctx is not None:
+            add_script_run_ctx(ctx=ctx)
+
+    return ContextExecutor(
+        max_workers=max(1, max_workers), initializer=_attach_ctx
+    )
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# Run-level deadlines. A deadline set on the page or CLI covers every
+# provider call made in its context, including judge sub-calls on worker
+# threads (ContextExecutor copies it into each task). Nested deadlines
+# never extend an outer one. Each provider attempt is sent with a timeout
+# no longer than the time left, and work that starts after the deadline
+# fails at once with DeadlineExceeded, so results report it as timed out
+# instead of waiting.
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+@contextmanager
+def deadline_at(when: Optional[float]) -> Iterator[None]:
+    """Finish work by ``when`` (a time.monotonic() value); None is no limit."""
+    current = _deadline.get()
+    if when is None or (current is not None and current <= when):
+        yield
+        return
+    token = _deadline.set(when)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    with deadline_at(None if seconds is None else time.monotonic() + seconds):
+        yield
+
+
+def deadline_time() -> Optional[float]:
+    """The active deadline as a time.monotonic() value, or None."""
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the active deadline, or None without one."""
+    when = _deadline.get()
+    return None if when is None else when - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check_deadline() -> None:
+    if expired():
+        raise DeadlineExceeded("Deadline exceeded")
+
+
+def call_timeout(timeout_s: Optional[float]) -> Optional[float]:
+    """Timeout for one provider attempt: ``timeout_s`` clipped to the deadline."""
+    check_deadline()
+    left = remaining()
+    if left is None:
+        return timeout_s
+    return left if timeout_s is None else min(timeout_s, left)
+
+
+def is_timeout(error: BaseException) -> bool:
+    """Deadline or provider timeout (reported as timed out, not failed)."""
+    return isinstance(error, (DeadlineExceeded, TimeoutError)) or type(
+        error
+    ).__name__ in ("Timeout", "APITimeoutError")
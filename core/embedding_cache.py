@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import numpy as np
+
+from core.telemetry import EMBEDDING_CACHE_LOOKUPS
+
+# Token-level contextual embeddings keyed by content hash, so a reference
+# shared by every prompt and model of a row is encoded once per process, and
+# reruns over the same dataset read it back from disk instead of running the
+# encoder. Two tiers: an in-memory LRU bounded by bytes, and a SQLite file
+# bounded by bytes (least recently used rows are evicted). The file is safe
+# to share between the app and the NLP pool worker processes. Set
+# PROMPT_TESTING_EMBEDDING_CACHE to "" to keep the cache in memory only.
+
+MEMORY_CACHE_BYTES = 256 * 1024 * 1024
+DISK_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_CACHE_PATH = os.environ.get(
+    "PROMPT_TESTING_EMBEDDING_CACHE",
+    os.path.join(
+        os.path.expanduser("~"), ".cache", "prompt-testing", "embeddings.sqlite3"
+    ),
+)
+
+# (token embeddings [tokens, hidden], per-token weights [tokens])
+TokenEmbeddings = tuple[np.ndarray, np.ndarray]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    tokens INTEGER NOT NULL,
+    hidden INTEGER NOT NULL,
+    embeddings BLOB NOT NULL,
+    weights BLOB NOT NULL,
+    bytes INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used);
+"""
+
+
+def embedding_key(namespace: str, text: str) -> str:
+    """Content hash of ``text`` for one encoder (model, layer and backend)."""
+    return hashlib.sha256(f"{namespace}\0{text}".encode()).hexdigest()
+
+
+def _nbytes(value: TokenEmbeddings) -> int:
+    return value[0].nbytes + value[1].nbytes
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_CACHE_PATH,
+        max_memory_bytes: int = MEMORY_CACHE_BYTES,
+        max_disk_bytes: int = DISK_CACHE_BYTES,
+    ):
+        self.path = path or None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, TokenEmbeddings] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _remember(self, key: str, value: TokenEmbeddings) -> None:
+        # Caller holds the lock
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        size = _nbytes(value)
+        if size > self.max_memory_bytes:
+            return
+        self._memory[key] = value
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= _nbytes(evicted)
+
+    def get_many(self, keys: list[str]) -> dict[str, TokenEmbeddings]:
+        found: dict[str, TokenEmbeddings] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+        EMBEDDING_CACHE_LOOKUPS.inc(len(found), tier="memory")
+        missing = [k for k in keys if k not in found]
+        if missing and self.path:
+            from_disk = self._read(missing)
+            with self._lock:
+                for key, value in from_disk.items():
+                    self._remember(key, value)
+            found.update(from_disk)
+            EMBEDDING_CACHE_LOOKUPS.inc(len(from_disk), tier="disk")
+        EMBEDDING_CACHE_LOOKUPS.inc(len(keys) - len(found), tier="miss")
+        return found
+
+    def put_many(self, items: dict[str, TokenEmbeddings]) -> None:
+        if not items:
+            return
+        with self._lock:
+            for key, value in items.items():
+                self._remember(key, value)
+        if self.path:
+            self._write(items)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM embeddings")
+
+    # ── Disk tier ───────────────────────────────────────────────────────────
+
+    def _read(self, keys: list[str]) -> dict[str, TokenEmbeddings]:
+        found: dict[str, TokenEmbeddings] = {}
+        with self._connect() as conn:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    "SELECT key, tokens, hidden, embeddings, weights FROM embeddings "
+                    f"WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, tokens, hidden, emb, weights in rows:
+                    found[key] = (
+                        np.frombuffer(emb, dtype=np.float32).reshape(tokens, hidden),
+                        np.frombuffer(weights, dtype=np.float32),
+                    )
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+        return found
+
+    def _write(self, items: dict[str, TokenEmbeddings]) -> None:
+        now = time.time()
+        rows = []
+        for key, (emb, weights) in items.items():
+            emb = np.ascontiguousarray(emb, dtype=np.float32)
+            weights = np.ascontiguousarray(weights, dtype=np.float32)
+            rows.append(
+                (
+                    key,
+                    emb.shape[0],
+                    emb.shape[1],
+                    emb.tobytes(),
+                    weights.tobytes(),
+                    emb.nbytes + weights.nbytes,
+                    now,
+                )
+            )
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings "
+                "(key, tokens, hidden, embeddings, weights, bytes, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM embeddings").fetchone()[0]
+            if total > self.max_disk_bytes:
+                self._evict(conn, total - self.max_disk_bytes)
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _evict(conn: sqlite3.Connection, excess: int) -> None:
+        # Drop least recently used rows until ``excess`` bytes are freed
+        freed, stale = 0, []
+        for key, size in conn.execute("SELECT key, bytes FROM embeddings ORDER BY used"):
+            if freed >= excess:
+                break
+            stale.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", stale)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            stats = {"memory_entries": len(self._memory), "memory_bytes": self._memory_bytes}
+        if self.path:
+            with self._connect() as conn:
+                entries, size = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM embeddings"
+                ).fetchone()
+            stats.update(disk_entries=entries, disk_bytes=size)
+        return stats
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide cache (each NLP pool worker has its own memory tier)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
@@ -0,0 +1,629 @@
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+import pandas as pd
+
+from core.batch import run_batch
+from core.budget import BudgetManager, use_budget
+from core.cache import LRUCache, session_cache, use_response_cache
+from core.deadline import check_deadline, deadline
+from core.schemas import (
+    API_KEY_ENV,
+    BatchRow,
+    BatchSpec,
+    BudgetLimits,
+    JobInfo,
+    LLMConfig,
+    PlanStats,
+)
+from core.tracing import Span, collect_spans
+
+# Background batch jobs backed by a SQLite queue. Jobs are run by worker
+# threads inside the app process, or by a separate worker process started
+# with ``python -m core.jobs`` against the same database. Rows are processed
+# in chunks and every finished chunk is stored at once, so partial results
+# are visible while a job runs and a cancelled or interrupted job resumes
+# from its first unfinished chunk. API keys are never written to the
+# database: keys entered in the UI stay in the submitting process, and any
+# other worker reads them from the environment (API_KEY_ENV).
+
+DEFAULT_DB_PATH = os.environ.get("PROMPT_TESTING_JOBS_DB", "jobs.sqlite3")
+# Each chunk is one run_batch call, and generation/judge dedup and batched
+# NLP scoring only work within a run. Chunks are therefore large; smaller
+# ones give finer partial results and resume points at the cost of both.
+DEFAULT_CHUNK_ROWS = 250
+# A running job whose worker has not reported for this long is interrupted
+HEARTBEAT_TIMEOUT_S = 120.0
+# A worker thread refreshes its running job this often, independently of
+# progress reports (BERTScore, local NLI or one slow call may send none)
+HEARTBEAT_INTERVAL_S = HEARTBEAT_TIMEOUT_S / 6
+PROGRESS_INTERVAL_S = 0.5
+# Spans kept in memory per job (the most recent ones), and jobs whose spans
+# are kept; a long job records one span per provider call
+MAX_JOB_SPANS = 5000
+MAX_TRACED_JOBS = 20
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLost(Exception):
+    """The job was interrupted and requeued or claimed by another worker."""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    label TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT,
+    spec TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    budget TEXT NOT NULL,
+    chunk_rows INTEGER NOT NULL,
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    rows_total INTEGER NOT NULL,
+    stage TEXT NOT NULL DEFAULT '',
+    error TEXT,
+    stats TEXT NOT NULL DEFAULT '{}',
+    ledger TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS job_chunks (
+    job_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    PRIMARY KEY (job_id, chunk)
+);
+"""
+
+
+# ── Store ───────────────────────────────────────────────────────────────────
+
+
+class JobStore:
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+            if "ledger" not in columns:
+                # Databases created before job spend was stored
+                conn.execute("ALTER TABLE jobs ADD COLUMN ledger TEXT NOT NULL DEFAULT '[]'")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create(
+        self,
+        rows: list[BatchRow],
+        spec: BatchSpec,
+        limits: BudgetLimits,
+        chunk_rows: int,
+        label: str = "",
+    ) -> str:
+        job_id = secrets.token_hex(6)
+        now = time.time()
+        stored_spec = _strip_keys(spec)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, label, status, created, updated, spec, rows, "
+                "budget, chunk_rows, rows_total) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    label,
+                    now,
+                    now,
+                    stored_spec.model_dump_json(),
+                    json.dumps([r.model_dump() for r in rows]),
+                    limits.model_dump_json(),
+                    max(1, chunk_rows),
+                    len(rows),
+                ),
+            )
+        return job_id
+
+    def claim(self, owner: str) -> Optional[str]:
+        """Atomically move the oldest queued job to running for ``owner``."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, updated = ?, error = NULL "
+                "WHERE id = ?",
+                (owner, time.time(), row["id"]),
+            )
+            conn.execute("COMMIT")
+            return row["id"]
+
+    def load(self, job_id: str) -> tuple[list[BatchRow], BatchSpec, BudgetLimits, int]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT spec, rows, budget, chunk_rows FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return (
+            [BatchRow(**r) for r in json.loads(row["rows"])],
+            BatchSpec.model_validate_json(row["spec"]),
+            BudgetLimits.model_validate_json(row["budget"]),
+            row["chunk_rows"],
+        )
+
+    def info(self, job_id: str) -> Optional[JobInfo]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _to_info(row) if row else None
+
+    def list_jobs(self, limit: int = 50) -> list[JobInfo]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [_to_info(r) for r in rows]
+
+    def update(self, job_id: str, **fields) -> None:
+        fields["updated"] = time.time()
+        if isinstance(fields.get("stats"), PlanStats):
+            fields["stats"] = fields["stats"].model_dump_json()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+
+    def update_owned(
+        self, job_id: str, owner: str, only_from: tuple[str, ...], **fields
+    ) -> bool:
+        """Update only while ``owner`` holds the job in one of ``only_from``."""
+        fields["updated"] = time.time()
+        if isinstance(fields.get("stats"), PlanStats):
+            fields["stats"] = fields["stats"].model_dump_json()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        placeholders = ", ".join("?" for _ in only_from)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ? AND owner = ? "
+                f"AND status IN ({placeholders})",
+                (*fields.values(), job_id, owner, *only_from),
+            )
+        return cursor.rowcount > 0
+
+    def set_status(self, job_id: str, status: str, only_from: tuple[str, ...]) -> bool:
+        placeholders = ", ".join("?" for _ in only_from)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = ?, updated = ? WHERE id = ? "
+                f"AND status IN ({placeholders})",
+                (status, time.time(), job_id, *only_from),
+            )
+        return cursor.rowcount > 0
+
+    def status(self, job_id: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row else None
+
+    def ledger(self, job_id: str) -> str:
+        with self._connect() as conn:
+            row = conn.execute("SELECT ledger FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["ledger"] if row else "[]"
+
+    def save_ledger(self, job_id: str, owner: str, ledger: str) -> None:
+        # Spend so far, so a resumed job keeps counting against its caps
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET ledger = ? WHERE id = ? AND owner = ?",
+                (ledger, job_id, owner),
+            )
+
+    def owner(self, job_id: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["owner"] if row else None
+
+    def save_chunk(self, job_id: str, chunk: int, results: pd.DataFrame) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_chunks (job_id, chunk, results) VALUES (?, ?, ?)",
+                (job_id, chunk, results.to_json(orient="split")),
+            )
+
+    def chunks_done(self, job_id: str) -> int:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS n FROM job_chunks WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return row["n"]
+
+    def results(self, job_id: str) -> pd.DataFrame:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT results FROM job_chunks WHERE job_id = ? ORDER BY chunk", (job_id,)
+            ).fetchall()
+        frames = [
+            pd.read_json(
+                io.StringIO(r["results"]),
+                orient="split",
+                dtype=False,
+                convert_dates=False,
+            )
+            for r in rows
+        ]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def mark_stale(self, timeout_s: float = HEARTBEAT_TIMEOUT_S) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'interrupted' "
+                "WHERE status IN ('running', 'cancelling') AND updated < ?",
+                (time.time() - timeout_s,),
+            )
+
+
+def _map_configs(spec: BatchSpec, fn: Callable[[LLMConfig], LLMConfig]) -> BatchSpec:
+    """``spec`` with ``fn`` applied to every LLMConfig it holds."""
+    update: dict = {
+        "configs": [fn(c) for c in spec.configs],
+        "judge_config": fn(spec.judge_config),
+    }
+    if spec.cascade is not None:
+        update["cascade"] = spec.cascade.model_copy(
+            update={"cheap_judge": fn(spec.cascade.cheap_judge)}
+        )
+    return spec.model_copy(update=update)
+
+
+def _strip_keys(spec: BatchSpec) -> BatchSpec:
+    return _map_configs(spec, lambda c: c.model_copy(update={"api_key": ""}))
+
+
+def _to_info(row: sqlite3.Row) -> JobInfo:
+    return JobInfo(
+        id=row["id"],
+        label=row["label"],
+        status=row["status"],
+        created=row["created"],
+        updated=row["updated"],
+        rows_done=row["rows_done"],
+        rows_total=row["rows_total"],
+        stage=row["stage"],
+        error=row["error"],
+        stats=PlanStats.model_validate_json(row["stats"] or "{}"),
+    )
+
+
+# Statuses of a job a worker is still working on
+_ACTIVE = ("running", "cancelling")
+
+
+# ── Queue ───────────────────────────────────────────────────────────────────
+
+
+class JobQueue:
+    """Worker threads pulling jobs from a JobStore."""
+
+    def __init__(self, store: Optional[JobStore] = None, workers: int = 2):
+        self.store = store or JobStore()
+        self.workers = workers
+        self.owner = f"{os.getpid()}-{secrets.token_hex(3)}"
+        # In-memory only: keys and session budgets of jobs submitted here
+        # (dropped when a job stops), budgets of running jobs and the spans
+        # of recent ones
+        self._keys: dict[str, dict[str, str]] = {}
+        self._session_budgets: dict[str, BudgetManager] = {}
+        # Response cache of the session that submitted or resumed each job
+        self._caches: dict[str, dict] = {}
+        self.budgets: dict[str, BudgetManager] = {}
+        self.spans: dict[str, deque[Span]] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            self.store.mark_stale()
+            for i in range(max(1, self.workers)):
+                thread = threading.Thread(
+                    target=self._worker_loop, name=f"job-worker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def submit(
+        self,
+        rows: list[BatchRow],
+        spec: BatchSpec,
+        limits: Optional[BudgetLimits] = None,
+        session_budget: Optional[BudgetManager] = None,
+        label: str = "",
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    ) -> str:
+        job_id = self.store.create(rows, spec, limits or BudgetLimits(), chunk_rows, label)
+        self._remember(job_id, spec, session_budget)
+        self._wake.set()
+        return job_id
+
+    def cancel(self, job_id: str) -> None:
+        # Queued jobs stop at once; running ones at their next progress report
+        if not self.store.set_status(job_id, "cancelled", ("queued",)):
+            self.store.set_status(job_id, "cancelling", ("running",))
+
+    def resume(
+        self,
+        job_id: str,
+        spec: Optional[BatchSpec] = None,
+        session_budget: Optional[BudgetManager] = None,
+        keys: Optional[dict[str, str]] = None,
+    ) -> bool:
+        """Requeue a stopped job; ``spec`` or ``keys`` (provider -> key)
+        re-supply API keys, which are forgotten once a job stops."""
+        self._remember(job_id, spec, session_budget, keys)
+        resumed = self.store.set_status(
+            job_id, "queued", ("cancelled", "failed", "interrupted")
+        )
+        self._wake.set()
+        return resumed
+
+    def info(self, job_id: str) -> Optional[JobInfo]:
+        return self.store.info(job_id)
+
+    def list_jobs(self) -> list[JobInfo]:
+        return self.store.list_jobs()
+
+    def results(self, job_id: str) -> pd.DataFrame:
+        return self.store.results(job_id)
+
+    def budget(self, job_id: str) -> Optional[BudgetManager]:
+        """Live budget of a running job, or the stored spend of a stopped one."""
+        if job_id in self.budgets:
+            return self.budgets[job_id]
+        ledger = self.store.ledger(job_id)
+        if ledger == "[]":
+            return None
+        budget = BudgetManager(self.store.load(job_id)[2], name="job")
+        budget.load_ledger(ledger)
+        return budget
+
+    def _remember(
+        self,
+        job_id: str,
+        spec: Optional[BatchSpec],
+        session_budget: Optional[BudgetManager],
+        keys: Optional[dict[str, str]] = None,
+    ) -> None:
+        if spec is not None:
+            keys: dict[str, str] = {}
+
+            def _collect(config: LLMConfig) -> LLMConfig:
+                if config.api_key:
+                    keys.setdefault(config.provider, config.api_key)
+                return config
+
+            _map_configs(spec, _collect)
+            self._keys[job_id] = keys
+        elif keys:
+            self._keys[job_id] = {p: k for p, k in keys.items() if k}
+        if session_budget is not None:
+            self._session_budgets[job_id] = session_budget
+        cache = session_cache()
+        if cache is not None:
+            self._caches[job_id] = cache
+
+    def _forget(self, job_id: str) -> None:
+        self._keys.pop(job_id, None)
+        self._session_budgets.pop(job_id, None)
+        self._caches.pop(job_id, None)
+        self.budgets.pop(job_id, None)
+
+    def _job_spans(self, job_id: str) -> deque[Span]:
+        with self._lock:
+            if job_id not in self.spans:
+                self.spans[job_id] = deque(maxlen=MAX_JOB_SPANS)
+                while len(self.spans) > MAX_TRACED_JOBS:
+                    self.spans.pop(next(iter(self.spans)))
+            return self.spans[job_id]
+
+    def _with_keys(self, job_id: str, config: LLMConfig) -> LLMConfig:
+        key = self._keys.get(job_id, {}).get(config.provider) or os.environ.get(
+            API_KEY_ENV.get(config.provider, ""), ""
+        )
+        return config.model_copy(update={"api_key": key})
+
+    # ── Worker ────────────────────────────────────────────────────────────
+
+    def _worker_loop(self) -> None:
+        while not self._stop.is_set():
+            # A fresh owner per claim, so a job requeued and reclaimed within
+            # this process is still told apart from its earlier run
+            owner = f"{self.owner}/{secrets.token_hex(3)}"
+            job_id = self.store.claim(owner)
+            if job_id is None:
+                self._wake.wait(timeout=2.0)
+                self._wake.clear()
+                continue
+            stop = threading.Event()
+            beat = threading.Thread(
+                target=self._heartbeat,
+                args=(job_id, owner, stop),
+                name=f"job-heartbeat-{job_id}",
+                daemon=True,
+            )
+            beat.start()
+            try:
+                self._run_job(job_id, owner)
+            finally:
+                stop.set()
+                beat.join()
+
+    def _heartbeat(self, job_id: str, owner: str, stop: threading.Event) -> None:
+        # Keeps `updated` fresh so mark_stale only catches dead workers
+        while not stop.wait(HEARTBEAT_INTERVAL_S):
+            self.store.update_owned(job_id, owner, _ACTIVE)
+
+    def run_forever(self) -> None:
+        self.start()
+        try:
+            while True:
+                time.sleep(HEARTBEAT_TIMEOUT_S / 4)
+                self.store.mark_stale()
+        except KeyboardInterrupt:
+            self.stop()
+
+    def _run_job(self, job_id: str, owner: str) -> None:
+        rows, spec, limits, chunk_rows = self.store.load(job_id)
+        spec = _map_configs(spec, lambda c: self._with_keys(job_id, c))
+        budget = BudgetManager(limits, name="job")
+        budget.load_ledger(self.store.ledger(job_id))
+        self.budgets[job_id] = budget
+        budgets = [budget]
+        if job_id in self._session_budgets:
+            budgets.append(self._session_budgets[job_id])
+        spans = self._job_spans(job_id)
+        # Never another session's cached responses; a job from no session
+        # (another worker process) gets a cache of its own
+        cache = self._caches.get(job_id)
+        if cache is None:
+            cache = LRUCache()
+
+        chunks = [rows[i : i + chunk_rows] for i in range(0, len(rows), chunk_rows)]
+        first = self.store.chunks_done(job_id)
+        stats = self.store.info(job_id).stats if first else PlanStats()
+        rows_done = sum(len(c) for c in chunks[:first])
+
+        last_report = 0.0
+
+        def _check(cancel: bool = True) -> None:
+            if self.store.owner(job_id) != owner:
+                raise JobLost()
+            status = self.store.status(job_id)
+            if status not in _ACTIVE:
+                raise JobLost()
+            if cancel and status == "cancelling":
+                raise JobCancelled()
+
+        def _on_progress(stage: str, done: int, total: int) -> None:
+            # The cancellation point; throttled so a fast run does not turn
+            # into a stream of SQLite writes
+            nonlocal last_report
+            now = time.monotonic()
+            if now - last_report < PROGRESS_INTERVAL_S and done < total:
+                return
+            last_report = now
+            _check()
+            self.store.update_owned(
+                job_id,
+                owner,
+                ("running",),
+                stage=f"chunk {chunk + 1}/{len(chunks)} {stage}: {done}/{total}",
+            )
+
+        try:
+            # One deadline for the whole job, not one per chunk
+            with collect_spans(spans), use_budget(*budgets), use_response_cache(
+                cache
+            ), deadline(spec.deadline_s):
+                for chunk in range(first, len(chunks)):
+                    _check()
+                    check_deadline()
+                    reason = next((b.exceeded() for b in budgets if b.exceeded()), None)
+                    if reason:
+                        raise RuntimeError(f"Budget exceeded: {reason}")
+                    chunk_df, chunk_stats = run_batch(chunks[chunk], spec, _on_progress)
+                    # A finished chunk is kept unless the job was lost meanwhile
+                    _check(cancel=False)
+                    self.store.save_chunk(job_id, chunk, chunk_df)
+                    stats = stats + chunk_stats
+                    rows_done += len(chunks[chunk])
+                    self.store.update_owned(
+                        job_id,
+                        owner,
+                        _ACTIVE,
+                        rows_done=rows_done,
+                        stats=stats,
+                        ledger=budget.ledger_json(),
+                    )
+        except JobLost:
+            pass
+        except JobCancelled:
+            self.store.update_owned(
+                job_id, owner, _ACTIVE, status="cancelled", stage="cancelled"
+            )
+        except Exception as e:
+            # Never overwrites a job requeued or taken by another worker
+            self.store.update_owned(job_id, owner, _ACTIVE, status="failed", error=str(e))
+        else:
+            # A cancel that arrived after the last chunk still wins
+            if not self.store.update_owned(
+                job_id, owner, ("running",), status="completed", stage="done"
+            ):
+                self.store.update_owned(
+                    job_id, owner, _ACTIVE, status="cancelled", stage="cancelled"
+                )
+        finally:
+            self.store.save_ledger(job_id, owner, budget.ledger_json())
+            # Keys and budgets of a stopped job are not kept around; a job
+            # taken over by another run keeps them for that run
+            if self.store.owner(job_id) == owner:
+                self._forget(job_id)
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide queue with its worker threads started."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(
+                workers=int(os.environ.get("PROMPT_TESTING_JOB_WORKERS", "2"))
+            )
+            _queue.start()
+        return _queue
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run queued batch jobs.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args(argv)
+    print(f"Job worker polling {args.db} with {args.workers} thread(s)", file=sys.stderr)
+    JobQueue(JobStore(args.db), workers=args.workers).run_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,44 @@
 from __future__ import annotations
 
+import asyncio
+import functools
+import json
 import os
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
 
 import litellm
 import numpy as np
-from tenacity import retry, stop_after_attempt, wait_random_exponential
 
-from core.cache import cache_key, get_cached, set_cached
-from core.schemas import LLMConfig, LLMResponse
+from core.budget import BudgetExceeded, Reservation, charge, reserve
+from core.cache import cache_key, get_cached, set_cached, single_flight
+from core.deadline import (
+    DeadlineExceeded,
+    call_timeout,
+    check_deadline,
+    deadline,
+    expired,
+)
+from core.local_embeddings import DEFAULT_LOCAL_MODEL, local_embeddings
+from core.mock_provider import (
+    MOCK_EMBEDDING_MODEL,
+    mock_completion,
+    mock_cost,
+    mock_embedding_usage,
+    mock_embeddings,
+    mock_prompt_tokens,
+    mock_stream,
+)
+from core.concurrency import LimiterSaturated
+from core.resilience import CircuitOpenError, guarded_slot, provider_retry
+from core.schemas import HedgePolicy, LLMConfig, LLMResponse, TokenLogprob
+from core.telemetry import CACHE_LOOKUPS, LLM_HEDGES, record_usage, track_request
+from core.tracing import increment_attribute, set_attribute, span
 
 litellm.drop_params = True
 
@@ -22,7 +52,7 @@ def _set_api_key(config: LLMConfig) -> None:
         os.environ["GEMINI_API_KEY"] = config.api_key
 
 
-def _build_params(config: LLMConfig) -> dict:
+def _build_params(config: LLMConfig, timeout: Optional[float] = None) -> dict:
     params: dict = {
         "model": config.model_name,
         "temperature": config.temperature,
@@ -35,34 +65,66 @@ def _build_params(config: LLMConfig) -> dict:
         params["presence_penalty"] = config.presence_penalty
     if config.api_base:
         params["api_base"] = config.api_base
+    if timeout is not None:
+        params["timeout"] = timeout
+    if config.top_logprobs:
+        params["logprobs"] = True
+        params["top_logprobs"] = config.top_logprobs
+    if config.response_schema:
+        params["response_format"] = {
+            "type": "json_schema",
+            "json_schema": json.loads(config.response_schema),
+        }
     return params
 
 
-@retry(wait=wait_random_exponential(min=2, max=60), stop=stop_after_attempt(4))
-def get_completion(
-    config: LLMConfig,
-    system_prompt: str,
-    user_message: str,
-    use_cache: bool = True,
-) -> LLMResponse:
-    if use_cache:
-        key = cache_key(config, system_prompt, user_message)
-        cached = get_cached(key)
-        if cached is not None:
-            return cached
+@functools.lru_cache(maxsize=None)
+def _supports_response_schema(provider: str, model: str) -> bool:
+    if provider == "mock":
+        return True
+    try:
+        return bool(litellm.supports_response_schema(model=model))
+    except Exception:
+        return False
+
+
+def supports_structured_output(config: LLMConfig) -> bool:
+    """Whether the model accepts a JSON-schema response format."""
+    return _supports_response_schema(config.provider, config.model_name)
 
-    _set_api_key(config)
-    params = _build_params(config)
 
-    messages = [
+def _messages(system_prompt: str, user_message: str) -> list[dict]:
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_message},
     ]
 
-    start = time.perf_counter()
-    response = litellm.completion(messages=messages, **params)
-    elapsed_ms = (time.perf_counter() - start) * 1000
 
+def _field(obj, name: str):
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _token_logprobs(response) -> Optional[list[TokenLogprob]]:
+    # None when the provider ignored the logprobs request (litellm drops the
+    # parameter for providers that don't support it)
+    logprobs = _field(response.choices[0], "logprobs")
+    content = _field(logprobs, "content") if logprobs is not None else None
+    if not content:
+        return None
+    return [
+        TokenLogprob(
+            token=_field(item, "token"),
+            logprob=_field(item, "logprob"),
+            top={
+                _field(alt, "token"): _field(alt, "logprob")
+                for alt in _field(item, "top_logprobs") or []
+            },
+        )
+        for item in content
+    ]
+
+
+def _to_response(config: LLMConfig, response, elapsed_ms: float) -> LLMResponse:
     content = response.choices[0].message.content or ""
     usage = response.usage or litellm.Usage()
     input_tokens = getattr(usage, "prompt_tokens", 0) or 0
@@ -73,37 +135,483 @@ def get_completion(
     except Exception:
         cost = 0.0
 
-    result = LLMResponse(
+    return LLMResponse(
         content=content.strip(),
         model=response.model or config.model_name,
         input_tokens=input_tokens,
         output_tokens=output_tokens,
         latency_ms=round(elapsed_ms, 1),
         estimated_cost_usd=round(cost, 6),
+        logprobs=_token_logprobs(response) if config.top_logprobs else None,
     )
 
-    if use_cache:
+
+def _call_provider(
+    config: LLMConfig,
+    system_prompt: str,
+    user_message: str,
+    timeout: Optional[float] = None,
+) -> LLMResponse:
+    if config.provider == "mock":
+        return mock_completion(config, system_prompt, user_message, timeout)
+
+    _set_api_key(config)
+    start = time.perf_counter()
+    response = litellm.completion(
+        messages=_messages(system_prompt, user_message),
+        **_build_params(config, timeout),
+    )
+    return _to_response(config, response, (time.perf_counter() - start) * 1000)
+
+
+async def _acall_provider(
+    config: LLMConfig,
+    system_prompt: str,
+    user_message: str,
+    timeout: Optional[float] = None,
+) -> LLMResponse:
+    # Async twin used by hedging: cancelling the task closes the request
+    if config.provider == "mock":
+        return await asyncio.get_running_loop().run_in_executor(
+            _hedge_threads, mock_completion, config, system_prompt, user_message, timeout
+        )
+
+    _set_api_key(config)
+    start = time.perf_counter()
+    response = await litellm.acompletion(
+        messages=_messages(system_prompt, user_message),
+        **_build_params(config, timeout),
+    )
+    return _to_response(config, response, (time.perf_counter() - start) * 1000)
+
+
+# ── Spend estimates ─────────────────────────────────────────────────────────
+# The most a call can cost, reserved against hard caps while it is in
+# flight: its prompt plus max_tokens of output at the model's price.
+# Models without a known price reserve tokens only.
+
+
+def _price(model: str, input_tokens: int, output_tokens: int) -> float:
+    try:
+        prompt_cost, completion_cost = litellm.cost_per_token(
+            model=model, prompt_tokens=input_tokens, completion_tokens=output_tokens
+        )
+    except Exception:
+        return 0.0
+    return prompt_cost + completion_cost
+
+
+def _completion_estimate(
+    config: LLMConfig, system_prompt: str, user_message: str
+) -> tuple[float, int]:
+    if config.provider == "mock":
+        input_tokens = mock_prompt_tokens(system_prompt, user_message)
+        cost = mock_cost(input_tokens, config.max_tokens)
+        return cost, input_tokens + config.max_tokens
+    try:
+        input_tokens = litellm.token_counter(
+            model=config.model_name, messages=_messages(system_prompt, user_message)
+        )
+    except Exception:
+        input_tokens = (len(system_prompt) + len(user_message)) // 4 + 1
+    cost = _price(config.model_name, input_tokens, config.max_tokens)
+    return cost, input_tokens + config.max_tokens
+
+
+def _embedding_estimate(texts: list[str], model: str) -> tuple[float, int]:
+    if model.startswith("mock/"):
+        tokens, cost = mock_embedding_usage(texts)
+        return cost, tokens
+    try:
+        tokens = litellm.token_counter(model=model, text=texts)
+    except Exception:
+        tokens = sum(len(t) for t in texts) // 4 + len(texts)
+    return _price(model, tokens, 0), tokens
+
+
+# ── Hedging ─────────────────────────────────────────────────────────────────
+# With a HedgePolicy active (use_hedging), a completion still running after
+# the model's recent p95 (or the configured percentile) latency gets a
+# duplicate request; whichever answers first wins and the other is
+# cancelled. Extra requests are capped per run as a fraction of calls and
+# by estimated cost. A cancelled request may still be billed, so every
+# hedge is charged to the active budgets at the winner's cost, and none is
+# sent unless the budgets can hold a second estimate for it. The
+# duplicate takes its own concurrency slot and circuit breaker turn, and
+# no duplicate is sent while the model's limit is full.
+
+
+class LatencyTracker:
+    """Recent successful call latencies per (provider, model)."""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples: dict[tuple[str, str], deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, model: str, seconds: float) -> None:
+        with self._lock:
+            key = (provider, model)
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.window)
+            self._samples[key].append(seconds)
+
+    def percentile(
+        self, provider: str, model: str, q: float, min_samples: int = 1
+    ) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get((provider, model), ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return float(np.percentile(samples, q))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+latency_tracker = LatencyTracker()
+
+
+class HedgeRun:
+    """Spend cap and counts for the hedges of one run."""
+
+    def __init__(self, policy: HedgePolicy):
+        self.policy = policy
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.extra_cost_usd = 0.0
+        self._lock = threading.Lock()
+
+    def count_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def reserve(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.policy.max_extra_fraction * self.calls:
+                return False
+            cap = self.policy.max_extra_cost_usd
+            if cap is not None and self.extra_cost_usd >= cap:
+                return False
+            self.hedges += 1
+            return True
+
+    def unreserve(self) -> None:
+        with self._lock:
+            self.hedges -= 1
+
+    def settle(self, extra_cost_usd: float, hedge_won: bool) -> None:
+        with self._lock:
+            self.extra_cost_usd += extra_cost_usd
+            self.hedge_wins += int(hedge_won)
+
+    def summary(self) -> str:
+        return (
+            f"Hedged {self.hedges}/{self.calls} calls "
+            f"({self.hedge_wins} won by the duplicate, "
+            f"~${self.extra_cost_usd:.4f} extra)"
+        )
+
+
+_hedge_run: ContextVar[Optional[HedgeRun]] = ContextVar("hedge_run", default=None)
+_hedge_threads = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+_hedge_loop: Optional[asyncio.AbstractEventLoop] = None
+_hedge_loop_lock = threading.Lock()
+
+
+@contextmanager
+def use_hedging(policy: Optional[HedgePolicy]) -> Iterator[Optional[HedgeRun]]:
+    """Hedge slow completions made in this context (and its worker tasks)."""
+    if policy is None or _hedge_run.get() is not None:
+        # An enclosing run (e.g. the CLI around a sweep) keeps one cap
+        yield _hedge_run.get()
+        return
+    run = HedgeRun(policy)
+    token = _hedge_run.set(run)
+    try:
+        yield run
+    finally:
+        _hedge_run.reset(token)
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    # One long-lived loop: litellm caches async HTTP clients per loop
+    global _hedge_loop
+    with _hedge_loop_lock:
+        if _hedge_loop is None:
+            _hedge_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_hedge_loop.run_forever, name="hedge-loop", daemon=True
+            ).start()
+        return _hedge_loop
+
+
+async def _race(
+    run: HedgeRun,
+    hold: Reservation,
+    config: LLMConfig,
+    system_prompt: str,
+    user_message: str,
+    delay_s: float,
+    timeout: Optional[float],
+) -> tuple[LLMResponse, bool, bool]:
+    # Returns (response, hedged, won by the duplicate)
+    primary = asyncio.ensure_future(
+        _acall_provider(config, system_prompt, user_message, timeout)
+    )
+    done, _ = await asyncio.wait({primary}, timeout=delay_s)
+    if done or not run.reserve():
+        return await primary, False, False
+    slot = ExitStack()
+    try:
+        slot.enter_context(
+            guarded_slot(config.provider, config.model_name, wait=False)
+        )
+        hold.add()
+    except (LimiterSaturated, CircuitOpenError, BudgetExceeded):
+        slot.close()
+        run.unreserve()
+        return await primary, False, False
+    # The duplicate must finish by the time the primary would have timed out
+    hedge_timeout = None if timeout is None else max(0.0, timeout - delay_s)
+    hedge = asyncio.ensure_future(
+        _in_slot(
+            slot, _acall_provider(config, system_prompt, user_message, hedge_timeout)
+        )
+    )
+    pending = {primary, hedge}
+    first_error: Optional[BaseException] = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return task.result(), True, task is hedge
+            first_error = first_error or task.exception()
+    raise first_error
+
+
+async def _in_slot(slot: ExitStack, call) -> LLMResponse:
+    # Holds the duplicate's slot until it finishes, fails or is cancelled
+    with slot:
+        return await call
+
+
+def _hedged_call(
+    run: HedgeRun,
+    hold: Reservation,
+    config: LLMConfig,
+    system_prompt: str,
+    user_message: str,
+    timeout: Optional[float],
+) -> LLMResponse:
+    run.count_call()
+    delay_s = latency_tracker.percentile(
+        config.provider,
+        config.model_name,
+        run.policy.percentile,
+        run.policy.min_samples,
+    )
+    if delay_s is None or (timeout is not None and delay_s >= timeout):
+        return _call_provider(config, system_prompt, user_message, timeout)
+    result, hedged, hedge_won = asyncio.run_coroutine_threadsafe(
+        _race(run, hold, config, system_prompt, user_message, delay_s, timeout),
+        _event_loop(),
+    ).result()
+    if hedged:
+        run.settle(result.estimated_cost_usd, hedge_won)
+        LLM_HEDGES.inc(
+            provider=config.provider,
+            model=config.model_name,
+            winner="hedge" if hedge_won else "primary",
+        )
+        set_attribute("llm.hedged", True)
+        set_attribute("llm.hedge_won", hedge_won)
+        # The losing request was cancelled but may still be billed
+        charge(
+            config.provider,
+            result.input_tokens,
+            result.output_tokens,
+            result.estimated_cost_usd,
+        )
+        record_usage(
+            config.provider,
+            config.model_name,
+            result.input_tokens,
+            result.output_tokens,
+            result.estimated_cost_usd,
+        )
+    return result
+
+
+@contextmanager
+def _deadline_errors() -> Iterator[None]:
+    # A request cut short because the deadline passed is a timeout of the
+    # run, not a provider failure: don't retry it or count it against the
+    # breaker and adaptive limit
+    try:
+        yield
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        if expired():
+            raise DeadlineExceeded(f"Deadline exceeded: {e}") from e
+        raise
+
+
+def _tracked_call(
+    config: LLMConfig, system_prompt: str, user_message: str
+) -> LLMResponse:
+    hedge_run = _hedge_run.get()
+    # Released only after the actual cost is charged, so calls running side
+    # by side can't pass a hard cap between them
+    with reserve(
+        lambda: _completion_estimate(config, system_prompt, user_message)
+    ) as hold:
+        with guarded_slot(config.provider, config.model_name), track_request(
+            config.provider, config.model_name, "completion"
+        ), _deadline_errors():
+            # Measured after the queue wait, so the attempt gets what is left
+            timeout = call_timeout(config.timeout_s)
+            start = time.perf_counter()
+            if hedge_run is None:
+                result = _call_provider(config, system_prompt, user_message, timeout)
+            else:
+                result = _hedged_call(
+                    hedge_run, hold, config, system_prompt, user_message, timeout
+                )
+            # The latency the caller saw: a winning duplicate's own latency
+            # would leave the slow tail out of the percentile
+            waited_s = time.perf_counter() - start
+        latency_tracker.record(config.provider, config.model_name, waited_s)
+        charge(
+            config.provider,
+            result.input_tokens,
+            result.output_tokens,
+            result.estimated_cost_usd,
+        )
+    record_usage(
+        config.provider,
+        config.model_name,
+        result.input_tokens,
+        result.output_tokens,
+        result.estimated_cost_usd,
+    )
+    return result
+
+
+@provider_retry
+def _get_completion(
+    config: LLMConfig,
+    system_prompt: str,
+    user_message: str,
+    use_cache: bool = True,
+) -> LLMResponse:
+    increment_attribute("llm.attempts")
+    if not use_cache:
+        return _tracked_call(config, system_prompt, user_message)
+
+    key = cache_key(config, system_prompt, user_message)
+    cached = get_cached(key)
+    if cached is not None:
+        CACHE_LOOKUPS.inc(result="hit")
+        return cached.model_copy(update={"cached": True})
+
+    def _fetch() -> LLMResponse:
+        result = _tracked_call(config, system_prompt, user_message)
         set_cached(key, result)
+        return result
 
+    result = single_flight(key, _fetch)
+    CACHE_LOOKUPS.inc(result="coalesced" if result.cached else "miss")
     return result
 
 
+def get_completion(
+    config: LLMConfig,
+    system_prompt: str,
+    user_message: str,
+    use_cache: bool = True,
+    timeout: Optional[float] = None,
+) -> LLMResponse:
+    # ``timeout`` bounds the whole call including retries; config.timeout_s
+    # bounds each attempt
+    with deadline(timeout), span(
+        "llm.completion",
+        **{"gen_ai.system": config.provider, "gen_ai.request.model": config.model_name},
+    ) as s:
+        result = _get_completion(config, system_prompt, user_message, use_cache)
+        s.set(
+            **{
+                "gen_ai.response.model": result.model,
+                "gen_ai.usage.input_tokens": result.input_tokens,
+                "gen_ai.usage.output_tokens": result.output_tokens,
+                "llm.cost_usd": result.estimated_cost_usd,
+                "llm.cache_hit": result.cached,
+                "llm.retries": s.attributes.get("llm.attempts", 1) - 1,
+            }
+        )
+        return result
+
+
+def stream_completion(
+    config: LLMConfig, system_prompt: str, user_message: str
+) -> Iterator[str]:
+    if config.provider == "mock":
+        for chunk in mock_stream(config, system_prompt, user_message):
+            check_deadline()
+            yield chunk
+        return
+
+    _set_api_key(config)
+    for chunk in litellm.completion(
+        messages=_messages(system_prompt, user_message),
+        stream=True,
+        **_build_params(config, call_timeout(config.timeout_s)),
+    ):
+        check_deadline()
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
 EMBEDDING_MODELS: dict[str, str] = {
     "openai": "text-embedding-3-small",
     "anthropic": "text-embedding-3-small",  # Anthropic has no embeddings; use OpenAI
     "google": "gemini/text-embedding-004",
     "ollama": "ollama/nomic-embed-text",
+    "mock": MOCK_EMBEDDING_MODEL,
 }
 
 
-@retry(wait=wait_random_exponential(min=2, max=60), stop=stop_after_attempt(4))
-def get_embedding(
-    text: str,
+@provider_retry
+def _get_embeddings(
+    texts: list[str],
     config: LLMConfig,
-    model: str | None = None,
-) -> list[float]:
-    if model is None:
-        model = EMBEDDING_MODELS.get(config.provider, "text-embedding-3-small")
+    model: str,
+) -> list[list[float]]:
+    increment_attribute("llm.attempts")
+    with reserve(lambda: _embedding_estimate(texts, model)):
+        with guarded_slot(config.provider, model), track_request(
+            config.provider, model, "embedding"
+        ), _deadline_errors():
+            vectors, tokens, cost = _embed(
+                texts, config, model, call_timeout(config.timeout_s)
+            )
+        charge(config.provider, tokens, 0, cost)
+    record_usage(config.provider, model, tokens, 0, cost)
+    return vectors
+
+
+def _embed(
+    texts: list[str], config: LLMConfig, model: str, timeout: Optional[float] = None
+) -> tuple[list[list[float]], int, float]:
+    # Vectors, billed input tokens and estimated cost
+    if model.startswith("mock/"):
+        return mock_embeddings(texts, model), *mock_embedding_usage(texts)
     _set_api_key(config)
     # For providers without native embeddings (Anthropic), ensure
     # the OpenAI key is set since we fall back to OpenAI embeddings
@@ -111,8 +619,54 @@ def get_embedding(
         openai_key = os.environ.get("OPENAI_API_KEY", "")
         if not openai_key:
             os.environ["OPENAI_API_KEY"] = config.api_key
-    response = litellm.embedding(model=model, input=[text])
-    return response.data[0]["embedding"]
+    params = {} if timeout is None else {"timeout": timeout}
+    response = litellm.embedding(model=model, input=texts, **params)
+    usage = response.usage or litellm.Usage()
+    tokens = getattr(usage, "prompt_tokens", 0) or getattr(usage, "total_tokens", 0) or 0
+    try:
+        cost = litellm.completion_cost(completion_response=response)
+    except Exception:
+        cost = 0.0
+    return [item["embedding"] for item in response.data], tokens, cost
+
+
+def get_embeddings(
+    texts: list[str],
+    config: LLMConfig,
+    model: str | None = None,
+    timeout: Optional[float] = None,
+) -> list[list[float]]:
+    """One vector per text, from a single request or local batch."""
+    local = config.embedding_backend != "api"
+    if model is None:
+        model = (
+            DEFAULT_LOCAL_MODEL
+            if local
+            else EMBEDDING_MODELS.get(config.provider, "text-embedding-3-small")
+        )
+    with deadline(timeout), span(
+        "llm.embedding",
+        **{
+            "gen_ai.system": config.embedding_backend if local else config.provider,
+            "gen_ai.request.model": model,
+        },
+    ) as s:
+        if local:
+            # On this CPU: no provider slot, retries or spend
+            check_deadline()
+            return local_embeddings(texts, config.embedding_backend, model)
+        vectors = _get_embeddings(texts, config, model)
+        s.set(**{"llm.retries": s.attributes.get("llm.attempts", 1) - 1})
+        return vectors
+
+
+def get_embedding(
+    text: str,
+    config: LLMConfig,
+    model: str | None = None,
+    timeout: Optional[float] = None,
+) -> list[float]:
+    return get_embeddings([text], config, model, timeout)[0]
 
 
 def cosine_similarity(vec_a: list[float], vec_b: list[float]) -> float:
@@ -126,12 +680,8 @@ def validate_api_key(
 ) -> tuple[bool, str]:
     try:
         config = LLMConfig(provider=provider, model_name=model, api_key=api_key)
-        get_completion(
-            config,
-            system_prompt="Say OK",
-            user_message="Test",
-            use_cache=False,
-        )
+        # One attempt: a bad key should be reported now, not after backoff
+        _tracked_call(config, system_prompt="Say OK", user_message="Test")
         return True, ""
     except Exception as e:
         return False, str(e)
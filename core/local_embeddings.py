@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import threading
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+
+from core.bertscore_fast import length_buckets, onnx_encoder
+from core.tracing import set_attribute
+
+# Sentence embeddings computed on the local CPU, selected per LLMConfig with
+# embedding_backend. No network round trip per text, and Answer Relevancy
+# keeps working without any embedding API (air-gapped installs). Models are
+# loaded once per process. Backends are optional installs:
+# "sentence-transformers" needs sentence-transformers; "onnx" and
+# "onnx-int8" mean-pool a Hugging Face encoder exported to ONNX Runtime
+# (torch is needed once, for the export, as in core.bertscore_fast).
+# "api" keeps the provider's remote embedding model (EMBEDDING_MODELS).
+
+EMBEDDING_BACKENDS = ("api", "sentence-transformers", "onnx", "onnx-int8")
+DEFAULT_LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+MAX_BATCH_TOKENS = 8192
+MAX_BATCH_SIZE = 64
+
+# texts -> one vector per text
+Embedder = Callable[[list[str]], np.ndarray]
+
+_load_lock = threading.Lock()
+
+
+def _sentence_transformers(model_name: str) -> Embedder:
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+
+    def embed(texts: list[str]) -> np.ndarray:
+        return model.encode(texts, batch_size=MAX_BATCH_SIZE, convert_to_numpy=True)
+
+    return embed
+
+
+def _onnx(model_name: str, quantized: bool) -> Embedder:
+    from transformers import AutoConfig, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # All layers: the export truncates nothing
+    encoder = onnx_encoder(
+        model_name, AutoConfig.from_pretrained(model_name).num_hidden_layers, quantized
+    )
+
+    def embed(texts: list[str]) -> np.ndarray:
+        token_ids = [
+            tokenizer.encode(t, truncation=True, max_length=tokenizer.model_max_length)
+            for t in texts
+        ]
+        lengths = [len(ids) for ids in token_ids]
+        pad_id = tokenizer.pad_token_id or 0
+        vectors: list = [None] * len(texts)
+        for batch in length_buckets(lengths, MAX_BATCH_TOKENS, MAX_BATCH_SIZE):
+            width = max(lengths[i] for i in batch)
+            input_ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                input_ids[row, : lengths[i]] = token_ids[i]
+                attention_mask[row, : lengths[i]] = 1
+            hidden = encoder(input_ids, attention_mask)
+            # Mean over real tokens, as sentence-transformers pools
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / mask.sum(axis=1)
+            for row, i in enumerate(batch):
+                vectors[i] = pooled[row]
+        return np.stack(vectors)
+
+    return embed
+
+
+@lru_cache(maxsize=None)
+def get_embedder(backend: str, model_name: str = DEFAULT_LOCAL_MODEL) -> Embedder:
+    # One loaded model per process, shared by every thread
+    if backend == "sentence-transformers":
+        return _sentence_transformers(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        return _onnx(model_name, backend == "onnx-int8")
+    raise ValueError(f"Unknown local embedding backend: {backend}")
+
+
+def local_embeddings(
+    texts: list[str], backend: str, model_name: str = DEFAULT_LOCAL_MODEL
+) -> list[list[float]]:
+    """Embed ``texts`` in batches on the local CPU."""
+    with _load_lock:
+        embedder = get_embedder(backend, model_name)
+    unique = list(dict.fromkeys(texts))
+    set_attribute("embedding.texts", len(unique))
+    vectors = dict(zip(unique, embedder(unique).astype(np.float32).tolist()))
+    return [vectors[t] for t in texts]
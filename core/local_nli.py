@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import re
+import threading
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+
+from core.bertscore_fast import length_buckets
+from core.tracing import set_attribute
+
+# Statement verification for Faithfulness with a local cross-encoder NLI
+# model on the CPU instead of a judge LLM call. Every (context, statement)
+# pair of a batch run can go through the model together, cut into batches
+# of similar token length, so thousands of rows are bounded by local
+# compute rather than API throughput. "torch" runs the Hugging Face model
+# in PyTorch, "int8" the same model dynamically quantized; both need torch
+# and transformers installed. A context longer than the model's input is
+# split into overlapping windows and a statement counts as entailed when
+# any window entails it. Statement extraction stays pluggable: the judge
+# LLM by default, or any StatementExtractor such as sentence splitting.
+
+NLI_BACKENDS = ("llm", "torch", "int8")
+DEFAULT_NLI_MODEL = "cross-encoder/nli-deberta-v3-xsmall"
+MAX_LENGTH = 512
+# Tokens shared by consecutive windows of a long premise, so a supporting
+# sentence cut at one window's edge is whole in the next
+WINDOW_STRIDE = 128
+MAX_BATCH_TOKENS = 8192
+MAX_BATCH_SIZE = 64
+
+# (question, answer) -> statements to verify
+StatementExtractor = Callable[[str, str], list[str]]
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def sentence_statements(question: str, answer: str) -> list[str]:
+    """Each sentence of the answer as a statement, with no LLM call."""
+    return [s.strip() for s in _SENTENCE_END.split(answer) if len(s.strip()) > 3]
+
+
+# Extractors selectable by name from a BatchSpec or the CLI; "llm" (the
+# judge's extraction prompt) is the default and needs no entry
+STATEMENT_EXTRACTORS: dict[str, StatementExtractor] = {
+    "sentences": sentence_statements,
+}
+
+
+class LocalNLI:
+    """Cross-encoder NLI: does the premise entail each hypothesis?"""
+
+    def __init__(self, model_name: str = DEFAULT_NLI_MODEL, backend: str = "torch"):
+        if backend not in NLI_BACKENDS or backend == "llm":
+            raise ValueError(f"Unknown local NLI backend: {backend}")
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+        if backend == "int8":
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        self.model = model
+        labels = {v.lower(): int(k) for k, v in model.config.id2label.items()}
+        self.entailment = labels["entailment"]
+        self.max_length = min(self.tokenizer.model_max_length, MAX_LENGTH)
+
+    def entails(self, premises: list[str], hypotheses: list[str]) -> list[bool]:
+        """Whether entailment is the most likely label for each pair."""
+        import torch
+
+        pairs = list(dict.fromkeys(zip(premises, hypotheses)))
+        # A long premise becomes overlapping windows, each with the whole
+        # statement; the statement itself is never cut
+        encoded: list[dict] = []
+        owners: list[int] = []
+        for p, (premise, hypothesis) in enumerate(pairs):
+            windows = self.tokenizer(
+                premise,
+                hypothesis,
+                truncation="only_first",
+                max_length=self.max_length,
+                stride=WINDOW_STRIDE,
+                return_overflowing_tokens=True,
+            )
+            for w in range(len(windows["input_ids"])):
+                encoded.append(
+                    {k: windows[k][w] for k in self.tokenizer.model_input_names}
+                )
+                owners.append(p)
+        lengths = [len(e["input_ids"]) for e in encoded]
+        set_attribute("nli.pairs", len(pairs))
+        set_attribute("nli.windows", len(encoded))
+        entailed = [False] * len(pairs)
+        for batch in length_buckets(lengths, MAX_BATCH_TOKENS, MAX_BATCH_SIZE):
+            inputs = self.tokenizer.pad([encoded[i] for i in batch], return_tensors="pt")
+            with torch.inference_mode():
+                logits = self.model(**inputs).logits.float().numpy()
+            for row, i in enumerate(batch):
+                if int(np.argmax(logits[row])) == self.entailment:
+                    entailed[owners[i]] = True
+        verdicts = dict(zip(pairs, entailed))
+        return [verdicts[pair] for pair in zip(premises, hypotheses)]
+
+
+_load_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load(backend: str, model_name: str) -> LocalNLI:
+    return LocalNLI(model_name, backend)
+
+
+def get_nli(backend: str, model_name: str = DEFAULT_NLI_MODEL) -> LocalNLI:
+    # One loaded model per process, shared by every thread
+    with _load_lock:
+        return _load(backend, model_name)
@@ -1,13 +1,284 @@
 from __future__ import annotations
 
+import functools
+import json
+import math
 import re
+import threading
 from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 import evaluate
 import numpy as np
 
-from core.llm_client import cosine_similarity, get_completion, get_embedding
-from core.schemas import ComparisonResult, LLMConfig, RubricCriterion
+from core.bertscore_fast import get_scorer
+from core.budget import JUDGE, spend_kind
+from core.deadline import deadline
+from core.local_nli import NLI_BACKENDS, StatementExtractor, get_nli
+from core.llm_client import (
+    cosine_similarity,
+    get_completion,
+    get_embeddings,
+    supports_structured_output,
+)
+from core.retrieval import CONTEXT_MODES, TOP_K, prune_context, statement_passages
+from core.schemas import (
+    ComparisonResult,
+    JudgeVerdict,
+    LLMConfig,
+    LLMResponse,
+    RubricCriterion,
+    TokenLogprob,
+)
+from core.telemetry import track_judge
+from core.tracing import set_attribute, span, traced
+
+# Matches NLI verdict lines like "1. Yes", "2. No", "3: Yes", etc.
+_VERDICT_PATTERN = re.compile(
+    r"^\s*\d+[\.\):\s]+\s*(yes|no)\s*\.?\s*$", re.IGNORECASE
+)
+
+# Text just before a verdict token: "Verdict:" in a critique, "3." in an
+# NLI verdict list, or the JSON key / array position of a structured reply
+_CRITIQUE_PREFIX = re.compile(r'verdict"?\s*:\s*"?$', re.IGNORECASE)
+_NLI_PREFIX = re.compile(r'(?:(?:^|\n)\s*\d+[\.\):]\s*|[\[,]\s*"?)$')
+
+# "sample" votes over ``strictness`` judge runs; "logprobs" makes one call
+# and reads the probability of each answer token, falling back to sampling
+# for models that return no logprobs
+VERDICT_MODES = ("sample", "logprobs")
+# Alternatives requested per token (OpenAI allows up to 20)
+TOP_LOGPROBS = 10
+
+# (provider, model) pairs seen returning no logprobs
+_no_logprobs: set[tuple[str, str]] = set()
+
+
+def _choice(token: str) -> str:
+    return token.strip().strip('"').rstrip(".").lower()
+
+
+def _choice_distributions(
+    logprobs: Optional[list[TokenLogprob]], choices: list[str], prefix: re.Pattern
+) -> list[dict[str, float]]:
+    """Probability of each choice at every answer token that follows ``prefix``."""
+    found: list[dict[str, float]] = []
+    text = ""
+    for item in logprobs or []:
+        if _choice(item.token) in choices and prefix.search(text):
+            mass = dict.fromkeys(choices, 0.0)
+            # " Yes", "Yes" and "YES" are separate tokens of the same answer
+            for token, logprob in {**item.top, item.token: item.logprob}.items():
+                if _choice(token) in mass:
+                    mass[_choice(token)] += math.exp(logprob)
+            total = sum(mass.values())
+            found.append({c: m / total for c, m in mass.items()})
+        text += item.token
+    return found
+
+
+# ── Judge output formats ────────────────────────────────────────────────────
+# Structured (JSON-schema) replies for models that support them, and a
+# per-call output budget sized to each reply, capped by the judge config's
+# max_tokens. Replies are short, so tight caps cut cost without truncating.
+
+JUDGE_MAX_TOKENS = {"relevancy": 64, "critique": 384, "pairwise": 384}
+EXTRACT_BASE_TOKENS = 64
+NLI_TOKENS_PER_STATEMENT = 8
+RUBRIC_TOKENS_PER_CRITERION = 12
+
+# Listwise judging packs up to JUDGE_PACK_SIZE answers to one question and
+# criteria into a single request, so the instructions and question are sent
+# once per pack instead of once per answer. A pack also ends before its
+# prompt would pass PACK_MAX_INPUT_TOKENS, or its reply the judge config's
+# max_tokens; items the judge skips are judged one by one.
+JUDGE_PACK_SIZE = 8
+PACK_MAX_INPUT_TOKENS = 6000
+CRITIQUE_ITEM_TOKENS = 96
+
+
+def _object(properties: dict) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def _response_format(name: str, properties: dict) -> dict:
+    return {"name": name, "schema": _object(properties), "strict": True}
+
+
+_YES_NO = {"type": "string", "enum": ["Yes", "No"]}
+STATEMENTS_SCHEMA = _response_format(
+    "statements", {"statements": {"type": "array", "items": {"type": "string"}}}
+)
+NLI_SCHEMA = _response_format(
+    "nli_verdicts", {"verdicts": {"type": "array", "items": _YES_NO}}
+)
+CRITIQUE_SCHEMA = _response_format(
+    "critique", {"reasoning": {"type": "string"}, "verdict": _YES_NO}
+)
+PAIRWISE_SCHEMA = _response_format(
+    "pairwise",
+    {
+        "reasoning": {"type": "string"},
+        "winner": {"type": "string", "enum": ["A", "B", "Tie"]},
+    },
+)
+
+
+CRITIQUE_PACK_SCHEMA = _response_format(
+    "critique_pack",
+    {
+        "results": {
+            "type": "array",
+            "items": _object(
+                {
+                    "id": {"type": "integer"},
+                    "reasoning": {"type": "string"},
+                    "verdict": _YES_NO,
+                }
+            ),
+        }
+    },
+)
+
+
+def _rubric_scores(rubric: list[RubricCriterion]) -> dict:
+    return _object(
+        {
+            c.name: {
+                "type": "integer",
+                "enum": list(range(c.scale_min, c.scale_max + 1)),
+            }
+            for c in rubric
+        }
+    )
+
+
+def _rubric_schema(rubric: list[RubricCriterion]) -> dict:
+    return _response_format("rubric_scores", {"scores": _rubric_scores(rubric)})
+
+
+def _rubric_pack_schema(rubric: list[RubricCriterion]) -> dict:
+    return _response_format(
+        "rubric_pack",
+        {
+            "results": {
+                "type": "array",
+                "items": _object(
+                    {"id": {"type": "integer"}, "scores": _rubric_scores(rubric)}
+                ),
+            }
+        },
+    )
+
+
+def _approx_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def pack_answers(
+    answers: list[str],
+    pack_size: int,
+    max_items: int,
+    shared_tokens: int = 0,
+    max_input_tokens: int = PACK_MAX_INPUT_TOKENS,
+) -> list[list[int]]:
+    """Split answer indexes into listwise packs, in order."""
+    limit = max(1, min(pack_size, max_items))
+    packs: list[list[int]] = []
+    current: list[int] = []
+    size = shared_tokens
+    for i, answer in enumerate(answers):
+        tokens = _approx_tokens(answer)
+        if current and (len(current) >= limit or size + tokens > max_input_tokens):
+            packs.append(current)
+            current, size = [], shared_tokens
+        current.append(i)
+        size += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+# "[3] ..." or "3. ..." at the start of a line of a listwise reply
+_PACK_ITEM_PATTERN = re.compile(r"^\s*\[?(\d+)[\]\.\):]\s*(.*)$")
+
+
+def _pack_items(result: str) -> dict[int, str]:
+    """Per-item text of a listwise reply, keyed by the 1-based answer id."""
+    data = _json_object(result)
+    if data is not None and isinstance(data.get("results"), list):
+        items: dict[int, str] = {}
+        for item in data["results"]:
+            if not isinstance(item, dict) or not str(item.get("id", "")).isdigit():
+                continue
+            fields = dict(item.get("scores") or {})
+            fields.update(
+                {k: v for k, v in item.items() if k not in ("id", "scores")}
+            )
+            items[int(item["id"])] = "\n".join(f"{k}: {v}" for k, v in fields.items())
+        return items
+    items = {}
+    for line in result.strip().split("\n"):
+        match = _PACK_ITEM_PATTERN.match(line)
+        if match:
+            items[int(match.group(1))] = match.group(2)
+    return items
+
+
+def _json_object(text: str) -> Optional[dict]:
+    """The JSON object in a structured reply, or None for plain text."""
+    text = text.strip()
+    if not text.startswith(("{", "```")):
+        return None
+    # Some providers wrap JSON mode output in a code fence
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        data = json.loads(match.group(0)) if match else None
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+_metric_load_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_metric(name: str) -> tuple[evaluate.EvaluationModule, threading.Lock]:
+    # One evaluate module per process; bertscore keeps its BERT model on the
+    # module instance, so the model is loaded once rather than per call
+    return evaluate.load(name), threading.Lock()
+
+
+@contextmanager
+def _use_metric(name: str) -> Iterator[evaluate.EvaluationModule]:
+    # compute() keeps per-call state on the module (writer, data, cache
+    # file), so each cached module is used by one thread at a time
+    with _metric_load_lock:
+        module, lock = _load_metric(name)
+    with lock:
+        yield module
+
+
+def _judge_metric(name: str):
+    # Span, process-wide judge counters, judge-side budget accounting and
+    # the judge's time limit (covering every sub-call) for one LLMJudge metric
+    def decorator(fn):
+        traced_fn = traced(f"judge.{name}")(fn)
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with track_judge(name), spend_kind(JUDGE), deadline(self.timeout):
+                return traced_fn(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -18,17 +289,18 @@ from core.schemas import ComparisonResult, LLMConfig, RubricCriterion
 class NLPMetrics:
 
     @staticmethod
+    @traced("nlp.rouge")
     def rouge_score(
         predictions: list[str], references: list[str]
     ) -> dict:
-        rouge = evaluate.load("rouge")
         # Compute per-answer ROUGE scores for meaningful prompt comparison
         per_answer = {"rouge1": [], "rouge2": [], "rougeL": []}
-        for pred, ref in zip(predictions, references):
-            result = rouge.compute(predictions=[pred], references=[ref])
-            per_answer["rouge1"].append(round(result["rouge1"], 3))
-            per_answer["rouge2"].append(round(result["rouge2"], 3))
-            per_answer["rougeL"].append(round(result["rougeL"], 3))
+        with _use_metric("rouge") as rouge:
+            for pred, ref in zip(predictions, references):
+                result = rouge.compute(predictions=[pred], references=[ref])
+                per_answer["rouge1"].append(round(result["rouge1"], 3))
+                per_answer["rouge2"].append(round(result["rouge2"], 3))
+                per_answer["rougeL"].append(round(result["rougeL"], 3))
         return {
             "rouge1": per_answer["rouge1"],
             "rouge2": per_answer["rouge2"],
@@ -39,37 +311,45 @@ class NLPMetrics:
         }
 
     @staticmethod
+    @traced("nlp.bleu")
     def bleu_score(
         predictions: list[str], references: list[str]
     ) -> dict:
-        bleu = evaluate.load("bleu")
         # Compute per-answer BLEU scores (sentence-level)
         per_answer = []
-        for pred, ref in zip(predictions, references):
-            try:
-                result = bleu.compute(predictions=[pred], references=[[ref]])
-                per_answer.append(round(result["bleu"], 3))
-            except ZeroDivisionError:
-                # BLEU can fail on very short texts
-                per_answer.append(0.0)
+        with _use_metric("bleu") as bleu:
+            for pred, ref in zip(predictions, references):
+                try:
+                    result = bleu.compute(predictions=[pred], references=[[ref]])
+                    per_answer.append(round(result["bleu"], 3))
+                except ZeroDivisionError:
+                    # BLEU can fail on very short texts
+                    per_answer.append(0.0)
         return {
             "bleu": per_answer,
             "mean_bleu": round(np.mean(per_answer), 3),
         }
 
     @staticmethod
+    @traced("nlp.bertscore")
     def bert_score(
         predictions: list[str],
         references: list[str],
         model_type: str = "distilbert-base-uncased",
+        backend: str = "evaluate",
     ) -> dict:
-        bertscore = evaluate.load("bertscore")
-        results = bertscore.compute(
-            predictions=predictions,
-            references=references,
-            lang="en",
-            model_type=model_type,
-        )
+        # "onnx", "onnx-int8", "int8" and "torch" use the CPU-optimized
+        # scorer in core.bertscore_fast (same F1 within a small tolerance)
+        if backend == "evaluate":
+            with _use_metric("bertscore") as bertscore:
+                results = bertscore.compute(
+                    predictions=predictions,
+                    references=references,
+                    lang="en",
+                    model_type=model_type,
+                )
+        else:
+            results = get_scorer(model_type, backend).score(predictions, references)
         f1_scores = [round(s, 3) for s in results["f1"]]
         return {"f1": f1_scores, "mean_f1": round(np.mean(f1_scores), 3)}
 
@@ -81,17 +361,196 @@ class NLPMetrics:
 
 class LLMJudge:
 
-    def __init__(self, judge_config: LLMConfig):
+    def __init__(
+        self,
+        judge_config: LLMConfig,
+        timeout: Optional[float] = None,
+        verdicts: str = "sample",
+        structured: bool = True,
+        nli: str = "llm",
+        extractor: Optional[StatementExtractor] = None,
+        context_mode: str = "full",
+        top_k: int = TOP_K,
+    ):
+        if verdicts not in VERDICT_MODES:
+            raise ValueError(f"verdicts must be one of {VERDICT_MODES}, got {verdicts!r}")
+        if nli not in NLI_BACKENDS:
+            raise ValueError(f"nli must be one of {NLI_BACKENDS}, got {nli!r}")
+        if context_mode not in CONTEXT_MODES:
+            raise ValueError(
+                f"context_mode must be one of {CONTEXT_MODES}, got {context_mode!r}"
+            )
         self.config = judge_config
-
-    def _judge_call(self, system_prompt: str, user_message: str) -> str:
+        # Seconds allowed per metric call, all sub-calls included
+        self.timeout = timeout
+        self.verdicts = verdicts
+        # JSON-schema output where the judge model supports it; other models
+        # get the plain-text prompts and parsers
+        self.structured = structured and supports_structured_output(judge_config)
+        # Faithfulness verification: the judge LLM ("llm") or a local NLI
+        # model (core.local_nli); statements come from ``extractor`` when
+        # set, the judge LLM otherwise
+        self.nli = nli
+        self.extractor = extractor
+        # "retrieval" checks statements against their top-k BM25 passages
+        # (core.retrieval) instead of the whole context
+        self.context_mode = context_mode
+        self.top_k = top_k
+
+    def _call_config(
+        self, max_tokens: int, schema: Optional[dict], logprobs: bool = False
+    ) -> LLMConfig:
+        # The judge config's max_tokens is the ceiling for every call
+        update: dict = {"max_tokens": min(self.config.max_tokens, max_tokens)}
+        if schema is not None and self.structured:
+            update["response_schema"] = json.dumps(schema, sort_keys=True)
+        if logprobs:
+            update["top_logprobs"] = TOP_LOGPROBS
+        return self.config.model_copy(update=update)
+
+    def _judge_call(
+        self,
+        system_prompt: str,
+        user_message: str,
+        max_tokens: int,
+        schema: Optional[dict] = None,
+    ) -> str:
         resp = get_completion(
-            self.config, system_prompt, user_message, use_cache=False
+            self._call_config(max_tokens, schema),
+            system_prompt,
+            user_message,
+            use_cache=False,
         )
         return resp.content
 
+    def _use_logprobs(self) -> bool:
+        return (
+            self.verdicts == "logprobs"
+            and (self.config.provider, self.config.model_name) not in _no_logprobs
+        )
+
+    def _logprob_call(
+        self,
+        system_prompt: str,
+        user_message: str,
+        max_tokens: int,
+        schema: Optional[dict] = None,
+    ) -> LLMResponse:
+        config = self._call_config(max_tokens, schema, logprobs=True)
+        resp = get_completion(config, system_prompt, user_message, use_cache=False)
+        if resp.logprobs is None:
+            _no_logprobs.add((self.config.provider, self.config.model_name))
+        set_attribute("judge.method", "logprobs" if resp.logprobs else "sampling")
+        return resp
+
+    def _format(self, text_instructions: str, json_instructions: str) -> str:
+        return json_instructions if self.structured else text_instructions
+
+    # ── Output parsers ────────────────────────────────────────────────────
+    # Each accepts the structured (JSON) reply first and falls back to the
+    # plain-text format for models without structured output
+
+    def _parse_statements(self, statements_raw: str) -> list[str]:
+        """Parse numbered statements from the extraction output."""
+        data = _json_object(statements_raw)
+        if data is not None and isinstance(data.get("statements"), list):
+            return [
+                str(s).strip()
+                for s in data["statements"]
+                if len(str(s).strip()) > 3
+            ]
+        statements = []
+        for line in statements_raw.strip().split("\n"):
+            line = line.strip()
+            cleaned = re.sub(r"^\d+[\.\)]\s*", "", line)
+            if cleaned and len(cleaned) > 3:
+                statements.append(cleaned)
+        return statements
+
+    def _parse_verdicts(self, nli_result: str) -> tuple[int, int]:
+        """Count (yes, no) NLI verdicts, strictly first and loosely second."""
+        data = _json_object(nli_result)
+        if data is not None and isinstance(data.get("verdicts"), list):
+            verdicts = [_choice(str(v)) for v in data["verdicts"]]
+            return verdicts.count("yes"), verdicts.count("no")
+        yes_count = 0
+        no_count = 0
+        for line in nli_result.strip().split("\n"):
+            match = _VERDICT_PATTERN.match(line)
+            if match:
+                if match.group(1).lower() == "yes":
+                    yes_count += 1
+                else:
+                    no_count += 1
+
+        # Fallback: if strict parsing found nothing, try looser matching
+        # but only on lines that are very short (likely just verdicts)
+        if yes_count + no_count == 0:
+            for line in nli_result.strip().split("\n"):
+                stripped = line.strip().lower().rstrip(".")
+                if stripped in ("yes", "no"):
+                    if stripped == "yes":
+                        yes_count += 1
+                    else:
+                        no_count += 1
+        return yes_count, no_count
+
+    def _parse_critique_verdict(self, result: str) -> int:
+        """Return 1 for a final Yes verdict, 0 otherwise."""
+        data = _json_object(result)
+        if data is not None and "verdict" in data:
+            return int(_choice(str(data["verdict"])) == "yes")
+        verdict = 0
+        for line in reversed(result.strip().split("\n")):
+            line_lower = line.strip().lower()
+            if line_lower.startswith("verdict:"):
+                verdict_text = line_lower.replace("verdict:", "").strip()
+                if verdict_text.startswith("yes"):
+                    verdict = 1
+                break
+            # Also accept bare Yes/No as last line
+            if line_lower.rstrip(".") in ("yes", "no"):
+                if line_lower.rstrip(".") == "yes":
+                    verdict = 1
+                break
+        return verdict
+
+    def _parse_rubric_scores(
+        self, result: str, rubric: list[RubricCriterion]
+    ) -> dict[str, int]:
+        """Parse per-criterion integer scores, clamped to each scale."""
+        data = _json_object(result)
+        if data is not None and isinstance(data.get("scores"), dict):
+            result = "\n".join(f"{k}: {v}" for k, v in data["scores"].items())
+        scores: dict[str, int] = {}
+        for criterion in rubric:
+            pattern = re.compile(
+                rf"{re.escape(criterion.name)}\s*:\s*(\d+)", re.IGNORECASE
+            )
+            match = pattern.search(result)
+            if match:
+                val = int(match.group(1))
+                val = max(criterion.scale_min, min(val, criterion.scale_max))
+                scores[criterion.name] = val
+            else:
+                # Fallback: try matching just a number near the criterion name
+                fallback = re.compile(
+                    rf"{re.escape(criterion.name)}[^\d]*(\d+)", re.IGNORECASE
+                )
+                fb_match = fallback.search(result)
+                if fb_match:
+                    val = int(fb_match.group(1))
+                    val = max(
+                        criterion.scale_min, min(val, criterion.scale_max)
+                    )
+                    scores[criterion.name] = val
+                else:
+                    scores[criterion.name] = criterion.scale_min
+        return scores
+
     # ── Answer Relevancy ──────────────────────────────────────────────────
 
+    @_judge_metric("answer_relevancy")
     def answer_relevancy(
         self,
         question: str,
@@ -110,84 +569,135 @@ Question: Who was the first president of the United States and when did he becom
 
 Generate a question that is relevant to the following answer."""
 
-        # Cache the original question embedding (constant across strictness runs)
+        generated = [
+            self._judge_call(relevancy_prompt, answer, JUDGE_MAX_TOKENS["relevancy"])
+            for _ in range(strictness)
+        ]
+
+        # The question and every generated question in one batch. A local
+        # embedding backend on either config is used first; otherwise the
+        # generation provider, falling back to the judge's (e.g. when the
+        # provider has no embeddings)
+        embed_configs = sorted(
+            [generation_config, self.config], key=lambda c: c.embedding_backend == "api"
+        )
         try:
-            q_vec = get_embedding(question, generation_config)
+            vectors = get_embeddings([question] + generated, embed_configs[0])
         except Exception:
-            # If embedding fails (e.g., provider doesn't support it),
-            # fall back to the judge config (may use a different provider)
-            q_vec = get_embedding(question, self.config)
-
-        scores = []
-        for _ in range(strictness):
-            generated_question = self._judge_call(relevancy_prompt, answer)
-            try:
-                gq_vec = get_embedding(
-                    generated_question, generation_config
-                )
-            except Exception:
-                gq_vec = get_embedding(generated_question, self.config)
-            scores.append(cosine_similarity(q_vec, gq_vec))
+            vectors = get_embeddings([question] + generated, embed_configs[1])
+        q_vec = vectors[0]
+        scores = [cosine_similarity(q_vec, gq_vec) for gq_vec in vectors[1:]]
 
         return round(float(np.mean(scores)), 3)
 
     # ── Faithfulness ──────────────────────────────────────────────────────
 
-    def faithfulness(
-        self,
-        question: str,
-        answer: str,
-        context: str,
-        strictness: int = 1,
-    ) -> float:
-        if not context.strip():
-            return 0.0
-
-        # Step 1: Extract statements from the answer
-        stmt_prompt = """Given a question and answer, extract factual statements from the answer.
-Output each statement on a new line, numbered.
+    def _extract_statements(self, question: str, answer: str) -> list[str]:
+        if self.extractor is not None:
+            return self.extractor(question, answer)
+        example_statements = [
+            "Sachin Tendulkar is a former Indian cricketer.",
+            "Sachin Tendulkar is widely regarded as one of the greatest batsmen in cricket history.",
+            'He is often referred to as the "Little Master."',
+        ]
+        stmt_format = self._format(
+            "Output each statement on a new line, numbered.",
+            'Reply with JSON: {"statements": [...]}, one statement per item.',
+        )
+        stmt_example = self._format(
+            "\n".join(f"{i + 1}. {s}" for i, s in enumerate(example_statements)),
+            json.dumps({"statements": example_statements}),
+        )
+        stmt_prompt = f"""Given a question and answer, extract factual statements from the answer.
+{stmt_format}
 
 Example:
 Question: Who is Sachin Tendulkar?
 Answer: Sachin Tendulkar is a former Indian cricketer widely regarded as one of the greatest batsmen in cricket history. He is often referred to as the "Little Master."
 Statements:
-1. Sachin Tendulkar is a former Indian cricketer.
-2. Sachin Tendulkar is widely regarded as one of the greatest batsmen in cricket history.
-3. He is often referred to as the "Little Master."
+{stmt_example}
 
 Extract statements from the following:"""
 
         stmt_input = f"Question: {question}\nAnswer: {answer}\nStatements:"
+        statements_raw = self._judge_call(
+            stmt_prompt,
+            stmt_input,
+            EXTRACT_BASE_TOKENS + 2 * _approx_tokens(answer),
+            STATEMENTS_SCHEMA,
+        )
+        return self._parse_statements(statements_raw)
+
+    @_judge_metric("extract_statements")
+    def extract_statements(self, question: str, answer: str) -> list[str]:
+        """Step 1 of Faithfulness on its own, for batching the NLI step."""
+        return self._extract_statements(question, answer)
+
+    def score_statements(
+        self, statements: list[list[str]], contexts: list[str]
+    ) -> list[float]:
+        """Faithfulness per answer from the local NLI model, in one pass."""
+        premises, hypotheses = [], []
+        for items, context in zip(statements, contexts):
+            if self.context_mode == "retrieval":
+                # Each statement against its own top-k passages
+                premises += [statement_passages(context, s, self.top_k) for s in items]
+            else:
+                premises += [context] * len(items)
+            hypotheses += items
+        with span("judge.faithfulness.nli", backend=self.nli):
+            verdicts = get_nli(self.nli).entails(premises, hypotheses)
+        scores, start = [], 0
+        for items in statements:
+            supported = verdicts[start : start + len(items)]
+            start += len(items)
+            scores.append(round(sum(supported) / len(items), 3) if items else 0.0)
+        return scores
 
-        # Step 2: NLI — check each statement against context
-        nli_system = "You are a careful fact-checker. For each numbered statement, determine if it is supported by the given context. Reply with ONLY the statement number and verdict."
+    @_judge_metric("faithfulness")
+    def faithfulness(
+        self,
+        question: str,
+        answer: str,
+        context: str,
+        strictness: int = 1,
+    ) -> float:
+        if not context.strip():
+            return 0.0
+
+        if self.nli != "llm":
+            # Local NLI is deterministic, so one pass stands in for the vote
+            with span("judge.faithfulness.extract") as extract_span:
+                statements = self._extract_statements(question, answer)
+                extract_span.set(statements=len(statements))
+            return self.score_statements([statements], [context])[0]
+
+        # NLI — check each extracted statement against the context
+        nli_system = "You are a careful fact-checker. For each numbered statement, determine if it is supported by the given context. " + self._format(
+            "Reply with ONLY the statement number and verdict.",
+            "Reply with ONLY the verdicts.",
+        )
+        nli_instructions = self._format(
+            """For each statement, respond with EXACTLY this format (one per line):
+1. Yes
+2. No
+3. Yes
+...and so on. Output NOTHING else — no explanations, no reasoning, just the number and Yes/No.""",
+            """Reply with JSON: {"verdicts": ["Yes", "No", ...]}, one "Yes" or "No" per statement, in order. No explanations.""",
+        )
         nli_template = """Context:
 {context}
 
 Statements:
 {statements}
 
-For each statement, respond with EXACTLY this format (one per line):
-1. Yes
-2. No
-3. Yes
-...and so on. Output NOTHING else — no explanations, no reasoning, just the number and Yes/No."""
-
-        # Regex to match verdict lines like "1. Yes", "2. No", "3: Yes", etc.
-        verdict_pattern = re.compile(
-            r"^\s*\d+[\.\):\s]+\s*(yes|no)\s*\.?\s*$", re.IGNORECASE
-        )
+{instructions}"""
 
         all_scores: list[float] = []
         for _ in range(strictness):
-            statements_raw = self._judge_call(stmt_prompt, stmt_input)
-            # Parse numbered statements
-            statements = []
-            for line in statements_raw.strip().split("\n"):
-                line = line.strip()
-                cleaned = re.sub(r"^\d+[\.\)]\s*", "", line)
-                if cleaned and len(cleaned) > 3:
-                    statements.append(cleaned)
+            with span("judge.faithfulness.extract") as extract_span:
+                statements = self._extract_statements(question, answer)
+                extract_span.set(statements=len(statements))
 
             if not statements:
                 all_scores.append(0.0)
@@ -196,36 +706,36 @@ For each statement, respond with EXACTLY this format (one per line):
             numbered = "\n".join(
                 f"{i + 1}. {s}" for i, s in enumerate(statements)
             )
+            nli_context = context
+            if self.context_mode == "retrieval":
+                nli_context = prune_context(context, statements, self.top_k)
+                set_attribute("faithfulness.context_tokens", _approx_tokens(context))
+                set_attribute("faithfulness.pruned_tokens", _approx_tokens(nli_context))
             nli_input = nli_template.format(
-                context=context, statements=numbered
+                context=nli_context, statements=numbered, instructions=nli_instructions
             )
-            nli_result = self._judge_call(nli_system, nli_input)
-
-            # Parse verdict lines strictly
-            yes_count = 0
-            no_count = 0
-            for line in nli_result.strip().split("\n"):
-                match = verdict_pattern.match(line)
-                if match:
-                    if match.group(1).lower() == "yes":
-                        yes_count += 1
-                    else:
-                        no_count += 1
+            nli_max_tokens = 16 + NLI_TOKENS_PER_STATEMENT * len(statements)
+            with span("judge.faithfulness.nli"):
+                if self._use_logprobs():
+                    resp = self._logprob_call(
+                        nli_system, nli_input, nli_max_tokens, NLI_SCHEMA
+                    )
+                    nli_result = resp.content
+                    dists = _choice_distributions(
+                        resp.logprobs, ["yes", "no"], _NLI_PREFIX
+                    )
+                    if dists:
+                        # One soft-scored run replaces the strictness vote
+                        all_scores = [float(np.mean([d["yes"] for d in dists]))]
+                        break
+                else:
+                    nli_result = self._judge_call(
+                        nli_system, nli_input, nli_max_tokens, NLI_SCHEMA
+                    )
 
+            yes_count, no_count = self._parse_verdicts(nli_result)
             total = yes_count + no_count
 
-            # Fallback: if strict parsing found nothing, try looser matching
-            # but only on lines that are very short (likely just verdicts)
-            if total == 0:
-                for line in nli_result.strip().split("\n"):
-                    stripped = line.strip().lower().rstrip(".")
-                    if stripped in ("yes", "no"):
-                        if stripped == "yes":
-                            yes_count += 1
-                        else:
-                            no_count += 1
-                total = yes_count + no_count
-
             if total == 0:
                 all_scores.append(0.0)
             else:
@@ -242,74 +752,193 @@ For each statement, respond with EXACTLY this format (one per line):
         criteria: str,
         strictness: int = 1,
     ) -> str:
-        critique_prompt = """Given a question and answer, evaluate the answer using ONLY the given criteria.
-Think step by step providing reasoning, then conclude with a final verdict.
+        return self.critique_verdict(question, answer, criteria, strictness).label
 
-Your final line MUST be exactly one of:
-Verdict: Yes
-Verdict: No
+    @_judge_metric("critique")
+    def critique_verdict(
+        self,
+        question: str,
+        answer: str,
+        criteria: str,
+        strictness: int = 1,
+    ) -> JudgeVerdict:
+        example_reasoning = (
+            "The answer uses proper sentence structure and correct grammar throughout."
+        )
+        verdict_format = self._format(
+            "Your final line MUST be exactly one of:\nVerdict: Yes\nVerdict: No",
+            'Reply with JSON: {"reasoning": "...", "verdict": "Yes" or "No"}.',
+        )
+        verdict_example = self._format(
+            f"Reasoning: {example_reasoning}\nVerdict: Yes",
+            json.dumps({"reasoning": example_reasoning, "verdict": "Yes"}),
+        )
+        critique_prompt = f"""Given a question and answer, evaluate the answer using ONLY the given criteria.
+Think step by step providing reasoning (2-3 sentences), then conclude with a final verdict.
+
+{verdict_format}
 
 Example:
 Question: Who was the US president during World War 2?
 Answer: Franklin D. Roosevelt served as President from 1933 until his death in 1945.
 Criteria: Is the output written in perfect grammar?
-Reasoning: The answer uses proper sentence structure and correct grammar throughout.
-Verdict: Yes"""
+{verdict_example}"""
 
         critique_input = (
             f"Question: {question}\n"
             f"Answer: {answer}\n"
-            f"Criteria: {criteria}\n"
-            f"Reasoning:"
+            f"Criteria: {criteria}"
+            + self._format("\nReasoning:", "")
         )
+        max_tokens = JUDGE_MAX_TOKENS["critique"]
 
         responses: list[int] = []
         for _ in range(strictness):
-            result = self._judge_call(critique_prompt, critique_input)
-            # Parse the final verdict line strictly
-            verdict = 0
-            for line in reversed(result.strip().split("\n")):
-                line_lower = line.strip().lower()
-                if line_lower.startswith("verdict:"):
-                    verdict_text = line_lower.replace("verdict:", "").strip()
-                    if verdict_text.startswith("yes"):
-                        verdict = 1
-                    break
-                # Also accept bare Yes/No as last line
-                if line_lower.rstrip(".") in ("yes", "no"):
-                    if line_lower.rstrip(".") == "yes":
-                        verdict = 1
-                    break
+            if self._use_logprobs():
+                resp = self._logprob_call(
+                    critique_prompt, critique_input, max_tokens, CRITIQUE_SCHEMA
+                )
+                dists = _choice_distributions(
+                    resp.logprobs, ["yes", "no"], _CRITIQUE_PREFIX
+                )
+                if dists:
+                    p_yes = dists[-1]["yes"]
+                    return JudgeVerdict(
+                        label="Yes" if p_yes >= 0.5 else "No",
+                        p_yes=round(p_yes, 3),
+                        confidence=round(max(p_yes, 1 - p_yes), 3),
+                        method="logprobs",
+                    )
+                # No verdict token to read: the reply still counts as a vote
+                result = resp.content
+            else:
+                result = self._judge_call(
+                    critique_prompt, critique_input, max_tokens, CRITIQUE_SCHEMA
+                )
+            verdict = self._parse_critique_verdict(result)
             responses.append(verdict)
 
-        majority = Counter(responses).most_common(1)[0][0]
-        return "Yes" if majority == 1 else "No"
+        majority, votes = Counter(responses).most_common(1)[0]
+        return JudgeVerdict(
+            label="Yes" if majority == 1 else "No",
+            p_yes=round(sum(responses) / len(responses), 3),
+            confidence=round(votes / len(responses), 3),
+            method="sampling",
+        )
+
+    @_judge_metric("critique_many")
+    def critique_many(
+        self,
+        question: str,
+        answers: list[str],
+        criteria: str,
+        pack_size: int = JUDGE_PACK_SIZE,
+    ) -> list[str]:
+        """Critique verdicts for several answers to one question, listwise."""
+        verdict_format = self._format(
+            "Output exactly one line per answer, in order, each ending with "
+            '"Verdict: Yes" or "Verdict: No".',
+            'Reply with JSON: {"results": [{"id": <answer id>, "reasoning": "...", '
+            '"verdict": "Yes" or "No"}, ...]} with one entry per answer.',
+        )
+        verdict_example = self._format(
+            "[1] Reasoning: Proper sentence structure and grammar. Verdict: Yes\n"
+            "[2] Reasoning: Missing capitals and a wrong verb form. Verdict: No",
+            json.dumps(
+                {
+                    "results": [
+                        {
+                            "id": 1,
+                            "reasoning": "Proper sentence structure and grammar.",
+                            "verdict": "Yes",
+                        },
+                        {
+                            "id": 2,
+                            "reasoning": "Missing capitals and a wrong verb form.",
+                            "verdict": "No",
+                        },
+                    ]
+                }
+            ),
+        )
+        critique_prompt = f"""Given a question and several numbered answers to it, evaluate EACH answer on its own using ONLY the given criteria. Do not compare the answers with each other.
+Give one sentence of reasoning per answer, then its verdict.
+
+{verdict_format}
+
+Example:
+Question: Who was the US president during World War 2?
+Criteria: Is the output written in perfect grammar?
+[1] Franklin D. Roosevelt served as President from 1933 until his death in 1945.
+[2] roosevelt were president, he die in 1945
+{verdict_example}"""
+
+        header = f"Question: {question}\nCriteria: {criteria}\n\nAnswers:\n"
+        labels: list[Optional[str]] = [None] * len(answers)
+        packs = pack_answers(
+            answers,
+            pack_size,
+            (self.config.max_tokens - 16) // CRITIQUE_ITEM_TOKENS,
+            _approx_tokens(critique_prompt + header),
+        )
+        for pack in packs:
+            if len(pack) < 2:
+                continue
+            critique_input = header + "\n\n".join(
+                f"[{n}] {answers[i]}" for n, i in enumerate(pack, start=1)
+            )
+            result = self._judge_call(
+                critique_prompt,
+                critique_input,
+                16 + CRITIQUE_ITEM_TOKENS * len(pack),
+                CRITIQUE_PACK_SCHEMA,
+            )
+            items = _pack_items(result)
+            for n, i in enumerate(pack, start=1):
+                found = re.findall(r"verdict\s*:\s*\"?(yes|no)", items.get(n, ""), re.I)
+                if found:
+                    labels[i] = "Yes" if found[-1].lower() == "yes" else "No"
+        set_attribute("judge.packs", sum(1 for p in packs if len(p) > 1))
+
+        # Packs of one and items missing from a reply get their own call
+        return [
+            label if label is not None else self.critique(question, answer, criteria)
+            for label, answer in zip(labels, answers)
+        ]
 
     # ── Rubric Scoring ────────────────────────────────────────────────────
 
+    @_judge_metric("rubric_scoring")
     def rubric_scoring(
         self,
         question: str,
         answer: str,
         context: str,
         rubric: list[RubricCriterion],
-    ) -> dict[str, int]:
+    ) -> dict[str, float]:
         criteria_text = "\n".join(
             f"- {c.name} ({c.scale_min}-{c.scale_max}): {c.description}"
             for c in rubric
         )
 
+        scores_format = self._format(
+            """Example output format (one criterion per line, nothing else):
+Accuracy: 4
+Helpfulness: 3
+Clarity: 5
+
+Now score the following answer. Output ONLY criterion names and integer scores, one per line. No explanations.""",
+            """Example output format:
+{"scores": {"Accuracy": 4, "Helpfulness": 3, "Clarity": 5}}
+
+Now score the following answer. No explanations.""",
+        )
         scoring_prompt = f"""Score the answer on each criterion below using an integer score.
 
 Criteria:
 {criteria_text}
 
-Example output format (one criterion per line, nothing else):
-Accuracy: 4
-Helpfulness: 3
-Clarity: 5
-
-Now score the following answer. Output ONLY criterion names and integer scores, one per line. No explanations."""
+{scores_format}"""
 
         scoring_input = (
             f"Question: {question}\n"
@@ -318,39 +947,107 @@ Now score the following answer. Output ONLY criterion names and integer scores,
             f"Scores:"
         )
 
-        result = self._judge_call(scoring_prompt, scoring_input)
+        max_tokens = 16 + RUBRIC_TOKENS_PER_CRITERION * len(rubric)
+        schema = _rubric_schema(rubric)
+        if not self._use_logprobs():
+            result = self._judge_call(scoring_prompt, scoring_input, max_tokens, schema)
+            return self._parse_rubric_scores(result, rubric)
 
-        scores: dict[str, int] = {}
+        resp = self._logprob_call(scoring_prompt, scoring_input, max_tokens, schema)
+        scores: dict[str, float] = self._parse_rubric_scores(resp.content, rubric)
         for criterion in rubric:
-            pattern = re.compile(
-                rf"{re.escape(criterion.name)}\s*:\s*(\d+)", re.IGNORECASE
+            # Expected score over the digit distribution after "Name:"
+            digits = [
+                str(v) for v in range(criterion.scale_min, criterion.scale_max + 1)
+            ]
+            prefix = re.compile(
+                rf"{re.escape(criterion.name)}\"?\s*:\s*$", re.IGNORECASE
             )
-            match = pattern.search(result)
-            if match:
-                val = int(match.group(1))
-                val = max(criterion.scale_min, min(val, criterion.scale_max))
-                scores[criterion.name] = val
-            else:
-                # Fallback: try matching just a number near the criterion name
-                fallback = re.compile(
-                    rf"{re.escape(criterion.name)}[^\d]*(\d+)", re.IGNORECASE
+            dists = _choice_distributions(resp.logprobs, digits, prefix)
+            if dists:
+                scores[criterion.name] = round(
+                    sum(int(d) * p for d, p in dists[0].items()), 2
                 )
-                fb_match = fallback.search(result)
-                if fb_match:
-                    val = int(fb_match.group(1))
-                    val = max(
-                        criterion.scale_min, min(val, criterion.scale_max)
-                    )
-                    scores[criterion.name] = val
-                else:
-                    scores[criterion.name] = criterion.scale_min
-
         return scores
 
+    @_judge_metric("rubric_scoring_many")
+    def rubric_scoring_many(
+        self,
+        question: str,
+        answers: list[str],
+        context: str,
+        rubric: list[RubricCriterion],
+        pack_size: int = JUDGE_PACK_SIZE,
+    ) -> list[dict[str, float]]:
+        """Rubric scores for several answers to one question, listwise.
+
+        Packed scores are always sampled integers, even in logprobs mode.
+        """
+        criteria_text = "\n".join(
+            f"- {c.name} ({c.scale_min}-{c.scale_max}): {c.description}"
+            for c in rubric
+        )
+        scores_format = self._format(
+            """Example output format (one line per answer, in order, nothing else):
+[1] Accuracy: 4, Helpfulness: 3, Clarity: 5
+[2] Accuracy: 2, Helpfulness: 2, Clarity: 4
+
+Now score each of the following answers on its own; do not compare them. Output ONLY the answer id and criterion names with integer scores. No explanations.""",
+            """Example output format (one entry per answer):
+{"results": [{"id": 1, "scores": {"Accuracy": 4, "Helpfulness": 3, "Clarity": 5}}, {"id": 2, "scores": {"Accuracy": 2, "Helpfulness": 2, "Clarity": 4}}]}
+
+Now score each of the following answers on its own; do not compare them. No explanations.""",
+        )
+        scoring_prompt = f"""Score each numbered answer on each criterion below using an integer score.
+
+Criteria:
+{criteria_text}
+
+{scores_format}"""
+
+        header = f"Question: {question}\nContext: {context}\n\nAnswers:\n"
+        item_tokens = 16 + RUBRIC_TOKENS_PER_CRITERION * len(rubric)
+        scores: list[Optional[dict[str, float]]] = [None] * len(answers)
+        packs = pack_answers(
+            answers,
+            pack_size,
+            (self.config.max_tokens - 16) // item_tokens,
+            _approx_tokens(scoring_prompt + header),
+        )
+        for pack in packs:
+            if len(pack) < 2:
+                continue
+            scoring_input = header + "\n\n".join(
+                f"[{n}] {answers[i]}" for n, i in enumerate(pack, start=1)
+            ) + "\n\nScores:"
+            result = self._judge_call(
+                scoring_prompt,
+                scoring_input,
+                16 + item_tokens * len(pack),
+                _rubric_pack_schema(rubric),
+            )
+            items = _pack_items(result)
+            for n, i in enumerate(pack, start=1):
+                text = items.get(n, "")
+                if all(c.name.lower() in text.lower() for c in rubric):
+                    scores[i] = dict(self._parse_rubric_scores(text, rubric))
+        set_attribute("judge.packs", sum(1 for p in packs if len(p) > 1))
+
+        return [
+            s if s is not None else self.rubric_scoring(question, answer, context, rubric)
+            for s, answer in zip(scores, answers)
+        ]
+
     # ── Pairwise Comparison ───────────────────────────────────────────────
 
     def _parse_winner(self, result: str) -> tuple[str, str]:
         """Parse winner and reasoning from judge output."""
+        data = _json_object(result)
+        if data is not None and "winner" in data:
+            winner = str(data["winner"]).strip().upper()
+            return winner if winner in ("A", "B") else "tie", str(
+                data.get("reasoning", "")
+            ).strip()
         result_lower = result.strip().lower()
         if "winner: a" in result_lower:
             winner = "A"
@@ -367,6 +1064,7 @@ Now score the following answer. Output ONLY criterion names and integer scores,
         reasoning = " ".join(reasoning_lines).strip()
         return winner, reasoning
 
+    @_judge_metric("pairwise_compare")
     def pairwise_compare(
         self,
         question: str,
@@ -386,7 +1084,12 @@ Answer A:
 Answer B:
 {second}
 
-First explain your reasoning (2-3 sentences), then on the final line write EXACTLY one of: "Winner: A", "Winner: B", or "Winner: Tie"."""
+{instructions}"""
+        instructions = self._format(
+            'First explain your reasoning (2-3 sentences), then on the final line write EXACTLY one of: "Winner: A", "Winner: B", or "Winner: Tie".',
+            'Reply with JSON: {"reasoning": "2-3 sentences", "winner": "A", "B" or "Tie"}.',
+        )
+        max_tokens = JUDGE_MAX_TOKENS["pairwise"]
 
         system = "You are a fair and impartial judge. Evaluate solely on merit, not position."
 
@@ -397,8 +1100,9 @@ First explain your reasoning (2-3 sentences), then on the final line write EXACT
             context=context,
             first=answer_a,
             second=answer_b,
+            instructions=instructions,
         )
-        result_1 = self._judge_call(system, prompt_1)
+        result_1 = self._judge_call(system, prompt_1, max_tokens, PAIRWISE_SCHEMA)
         winner_1, reasoning_1 = self._parse_winner(result_1)
 
         # Run 2: B first, A second (swapped to debias position preference)
@@ -408,8 +1112,9 @@ First explain your reasoning (2-3 sentences), then on the final line write EXACT
             context=context,
             first=answer_b,
             second=answer_a,
+            instructions=instructions,
         )
-        result_2 = self._judge_call(system, prompt_2)
+        result_2 = self._judge_call(system, prompt_2, max_tokens, PAIRWISE_SCHEMA)
         winner_2_raw, reasoning_2 = self._parse_winner(result_2)
         # Flip the swapped result back to original labels
         if winner_2_raw == "A":
@@ -0,0 +1,352 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Iterator, Optional
+
+import httpx
+import litellm
+import numpy as np
+from pydantic import BaseModel, Field
+
+from core.schemas import LLMConfig, LLMResponse, TokenLogprob
+
+# Offline provider for load tests and benchmarks. Responses are a pure
+# function of (model, system prompt, user message), so caching and
+# deduplication behave exactly as with a real provider, while latency,
+# token usage and failures follow the configured distributions.
+
+MOCK_EMBEDDING_MODEL = "mock/embedding"
+EMBEDDING_DIM = 256
+
+_MOCK_URL = "http://mock.local/v1/chat/completions"
+
+
+class ScriptedReply(BaseModel):
+    # Regex searched in "system prompt\n\nuser message"; first match wins
+    pattern: str
+    reply: str
+
+
+class MockSettings(BaseModel):
+    latency: str = "fixed"  # "fixed", "uniform", "lognormal" or "exponential"
+    latency_ms: float = 0.0  # mean (fixed/exponential/lognormal) or low bound
+    latency_spread_ms: float = 0.0  # uniform width or lognormal sigma in ms
+    error_rate: float = 0.0  # fraction of calls raising a 5xx
+    rate_limit_rate: float = 0.0  # fraction of calls raising a 429
+    retry_after_s: float = 1.0
+    timeout_rate: float = 0.0  # fraction of calls raising a timeout
+    chars_per_token: float = 4.0
+    cost_per_1k_input: float = 0.0
+    cost_per_1k_output: float = 0.0
+    stream_chunk_chars: int = 16
+    script: list[ScriptedReply] = Field(default_factory=list)
+    default_reply: str = "OK"
+    seed: int = 0
+
+
+_settings = MockSettings()
+_rng = random.Random(_settings.seed)
+_rng_lock = threading.Lock()
+_call_count = 0
+
+
+def configure_mock(**overrides) -> MockSettings:
+    """Replace the process-wide mock settings; unspecified fields reset."""
+    global _settings, _rng, _call_count
+    with _rng_lock:
+        _settings = MockSettings(**overrides)
+        _rng = random.Random(_settings.seed)
+        _call_count = 0
+    return _settings
+
+
+def get_mock_settings() -> MockSettings:
+    return _settings
+
+
+def mock_call_count() -> int:
+    return _call_count
+
+
+# ── Behaviour ───────────────────────────────────────────────────────────────
+
+
+def _draw() -> tuple[float, float]:
+    # One locked draw per call keeps a seeded run reproducible even when
+    # calls arrive from several worker threads.
+    global _call_count
+    with _rng_lock:
+        _call_count += 1
+        s = _settings
+        if s.latency == "uniform":
+            latency = s.latency_ms + _rng.uniform(0, s.latency_spread_ms)
+        elif s.latency == "lognormal" and s.latency_ms > 0:
+            sigma = s.latency_spread_ms / s.latency_ms
+            latency = s.latency_ms * _rng.lognormvariate(-sigma**2 / 2, sigma)
+        elif s.latency == "exponential" and s.latency_ms > 0:
+            latency = _rng.expovariate(1 / s.latency_ms)
+        else:
+            latency = s.latency_ms
+        return max(0.0, latency), _rng.random()
+
+
+def _maybe_fail(model: str, roll: float) -> None:
+    s = _settings
+    if roll < s.rate_limit_rate:
+        response = httpx.Response(
+            429,
+            headers={"retry-after": str(s.retry_after_s)},
+            request=httpx.Request("POST", _MOCK_URL),
+        )
+        raise litellm.RateLimitError(
+            "Mock rate limit", llm_provider="mock", model=model, response=response
+        )
+    roll -= s.rate_limit_rate
+    if roll < s.error_rate:
+        raise litellm.InternalServerError(
+            "Mock server error", llm_provider="mock", model=model
+        )
+    roll -= s.error_rate
+    if roll < s.timeout_rate:
+        raise litellm.Timeout("Mock timeout", model=model, llm_provider="mock")
+
+
+def _digest(*parts: str) -> int:
+    return int(hashlib.sha256("\x00".join(parts).encode()).hexdigest()[:8], 16)
+
+
+def _judge_reply(system_prompt: str, user_message: str) -> str:
+    # Well-formed output for each LLMJudge prompt, chosen deterministically
+    h = _digest(system_prompt, user_message)
+    if "Generate a question" in system_prompt:
+        return f"What is {user_message.split('.')[0].strip()}?"
+    if "extract factual statements" in system_prompt:
+        answer = user_message.split("Answer:", 1)[-1].split("Statements:")[0]
+        sentences = [s.strip() for s in re.split(r"[.!?]", answer) if len(s.strip()) > 3]
+        return "\n".join(f"{i + 1}. {s}." for i, s in enumerate(sentences)) or "1. None."
+    if "fact-checker" in system_prompt:
+        statements = user_message.split("Statements:", 1)[-1].split("For each statement")[0]
+        count = len(re.findall(r"^\d+\.", statements, re.MULTILINE))
+        return "\n".join(
+            f"{i + 1}. {'Yes' if (h >> i) % 4 else 'No'}" for i in range(count)
+        )
+    if "several numbered answers" in system_prompt or "each numbered answer" in system_prompt:
+        ids = re.findall(r"^\[(\d+)\]", user_message, re.MULTILINE)
+        if "Verdict" in system_prompt:
+            return "\n".join(
+                f"[{n}] Reasoning: The answer addresses the criteria. "
+                f"Verdict: {'Yes' if (h >> i) % 2 else 'No'}"
+                for i, n in enumerate(ids)
+            )
+        names = re.findall(r"^- (.+?) \(\d+-\d+\):", system_prompt, re.MULTILINE)
+        return "\n".join(
+            f"[{n}] " + ", ".join(f"{c}: {1 + (h >> i + j) % 5}" for j, c in enumerate(names))
+            for i, n in enumerate(ids)
+        )
+    if "Verdict: Yes" in system_prompt:
+        return f"Reasoning: The answer addresses the criteria.\nVerdict: {'Yes' if h % 2 else 'No'}"
+    if "Score the answer" in system_prompt:
+        names = re.findall(r"^- (.+?) \(\d+-\d+\):", system_prompt, re.MULTILINE)
+        return "\n".join(f"{n}: {1 + (h >> i) % 5}" for i, n in enumerate(names))
+    if "Winner: A" in user_message:
+        return f"Both answers are reasonable.\nWinner: {'AB'[h % 2] if h % 3 else 'Tie'}"
+    return _settings.default_reply
+
+
+def _structured_judge_reply(
+    response_format: dict, system_prompt: str, user_message: str
+) -> str:
+    # JSON replies for the LLMJudge response schemas, keyed by schema name
+    h = _digest(system_prompt, user_message)
+    name = response_format.get("name")
+    if name == "statements":
+        answer = user_message.split("Answer:", 1)[-1].split("Statements:")[0]
+        sentences = [s.strip() for s in re.split(r"[.!?]", answer) if len(s.strip()) > 3]
+        data: dict = {"statements": [f"{s}." for s in sentences] or ["None."]}
+    elif name == "nli_verdicts":
+        statements = user_message.split("Statements:", 1)[-1]
+        count = len(re.findall(r"^\d+\.", statements, re.MULTILINE))
+        data = {"verdicts": ["Yes" if (h >> i) % 4 else "No" for i in range(count)]}
+    elif name == "critique":
+        data = {
+            "reasoning": "The answer addresses the criteria.",
+            "verdict": "Yes" if h % 2 else "No",
+        }
+    elif name == "rubric_scores":
+        names = response_format["schema"]["properties"]["scores"]["properties"]
+        data = {"scores": {n: 1 + (h >> i) % 5 for i, n in enumerate(names)}}
+    elif name in ("critique_pack", "rubric_pack"):
+        ids = [int(n) for n in re.findall(r"^\[(\d+)\]", user_message, re.MULTILINE)]
+        if name == "critique_pack":
+            results = [
+                {
+                    "id": n,
+                    "reasoning": "The answer addresses the criteria.",
+                    "verdict": "Yes" if (h >> i) % 2 else "No",
+                }
+                for i, n in enumerate(ids)
+            ]
+        else:
+            item = response_format["schema"]["properties"]["results"]["items"]
+            names = item["properties"]["scores"]["properties"]
+            results = [
+                {"id": n, "scores": {c: 1 + (h >> i + j) % 5 for j, c in enumerate(names)}}
+                for i, n in enumerate(ids)
+            ]
+        data = {"results": results}
+    elif name == "pairwise":
+        data = {
+            "reasoning": "Both answers are reasonable.",
+            "winner": "AB"[h % 2] if h % 3 else "Tie",
+        }
+    else:
+        return _settings.default_reply
+    return json.dumps(data)
+
+
+def _reply(
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    response_schema: Optional[str] = None,
+) -> str:
+    for scripted in _settings.script:
+        if re.search(scripted.pattern, f"{system_prompt}\n\n{user_message}"):
+            return scripted.reply
+    if model == "mock/judge" and response_schema:
+        return _structured_judge_reply(
+            json.loads(response_schema), system_prompt, user_message
+        )
+    if model == "mock/judge":
+        return _judge_reply(system_prompt, user_message)
+    if model == "mock/echo":
+        return user_message.strip().split("\n")[-1]
+    return _settings.default_reply
+
+
+_TOKEN_PATTERN = re.compile(r"\s*[A-Za-z]+|\s*\d|\s*[^\sA-Za-z\d]|\s+")
+_ALTERNATIVES = {"yes": "No", "no": "Yes"}
+
+
+def _logprobs(content: str, top_logprobs: int) -> list[TokenLogprob]:
+    # Each word, digit or symbol is one token picked with probability 0.6-1.0;
+    # Yes/No and digits get the opposite answer or a neighbour as runner-up,
+    # so logprob-based judging has a distribution to read
+    tokens: list[TokenLogprob] = []
+    for i, token in enumerate(_TOKEN_PATTERN.findall(content)):
+        p = 0.6 + 0.4 * (_digest(content, str(i), str(_settings.seed)) % 1000) / 1000
+        top = {token: math.log(p)}
+        word = token.strip()
+        alt = _ALTERNATIVES.get(word.lower())
+        if alt is None and word.isdigit():
+            alt = str(int(word) - 1 if int(word) > 1 else int(word) + 1)
+        if alt is not None and top_logprobs > 1:
+            top[token.replace(word, alt)] = math.log(1 - p)
+        tokens.append(TokenLogprob(token=token, logprob=math.log(p), top=top))
+    return tokens
+
+
+def _tokens(text: str) -> int:
+    return max(1, round(len(text) / _settings.chars_per_token))
+
+
+def mock_prompt_tokens(system_prompt: str, user_message: str) -> int:
+    """Input tokens billed for a completion."""
+    return _tokens(system_prompt) + _tokens(user_message)
+
+
+def mock_cost(input_tokens: int, output_tokens: int) -> float:
+    return (
+        input_tokens * _settings.cost_per_1k_input
+        + output_tokens * _settings.cost_per_1k_output
+    ) / 1000
+
+
+# ── Provider entry points ──────────────────────────────────────────────────
+
+
+def mock_completion(
+    config: LLMConfig,
+    system_prompt: str,
+    user_message: str,
+    timeout_s: Optional[float] = None,
+) -> LLMResponse:
+    latency_ms, roll = _draw()
+    if timeout_s is not None and latency_ms / 1000 > timeout_s:
+        # Give up the way an HTTP client does when the response is late
+        time.sleep(max(0.0, timeout_s))
+        raise litellm.Timeout(
+            f"Mock request timed out after {timeout_s:.1f}s",
+            model=config.model_name,
+            llm_provider="mock",
+        )
+    time.sleep(latency_ms / 1000)
+    _maybe_fail(config.model_name, roll)
+
+    content = _reply(
+        config.model_name, system_prompt, user_message, config.response_schema
+    )
+    # Respect max_tokens the way a real provider truncates output
+    content = content[: int(config.max_tokens * _settings.chars_per_token)]
+    input_tokens = mock_prompt_tokens(system_prompt, user_message)
+    output_tokens = _tokens(content)
+    cost = mock_cost(input_tokens, output_tokens)
+    return LLMResponse(
+        content=content.strip(),
+        model=config.model_name,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        latency_ms=round(latency_ms, 1),
+        estimated_cost_usd=round(cost, 6),
+        logprobs=_logprobs(content, config.top_logprobs) if config.top_logprobs else None,
+    )
+
+
+def mock_stream(
+    config: LLMConfig, system_prompt: str, user_message: str
+) -> Iterator[str]:
+    # Latency is spread across the chunks so time-to-first-token is realistic
+    latency_ms, roll = _draw()
+    _maybe_fail(config.model_name, roll)
+    content = _reply(config.model_name, system_prompt, user_message)
+    size = max(1, _settings.stream_chunk_chars)
+    chunks = [content[i : i + size] for i in range(0, len(content), size)] or [""]
+    for chunk in chunks:
+        time.sleep(latency_ms / 1000 / len(chunks))
+        yield chunk
+
+
+def _bag_of_words(text: str) -> list[float]:
+    vec = np.zeros(EMBEDDING_DIM)
+    for word in re.findall(r"\w+", text.lower()):
+        h = _digest(word)
+        vec[h % EMBEDDING_DIM] += 1.0 if (h >> 16) % 2 else -1.0
+    if not vec.any():
+        vec[0] = 1.0
+    return vec.tolist()
+
+
+def mock_embeddings(texts: list[str], model: Optional[str] = None) -> list[list[float]]:
+    # Hashed bag of words: texts that share words get a high cosine
+    # similarity, which keeps Answer Relevancy scores meaningful offline.
+    # One request (one latency draw) per batch, as with a real API.
+    latency_ms, roll = _draw()
+    time.sleep(latency_ms / 1000)
+    _maybe_fail(model or MOCK_EMBEDDING_MODEL, roll)
+    return [_bag_of_words(t) for t in texts]
+
+
+def mock_embedding_usage(texts: list[str]) -> tuple[int, float]:
+    """(input tokens, cost) billed for embedding ``texts``."""
+    tokens = sum(_tokens(t) for t in texts)
+    return tokens, mock_cost(tokens, 0)
+
+
+def mock_embedding(text: str, model: Optional[str] = None) -> list[float]:
+    return mock_embeddings([text], model)[0]
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from typing import Optional
+
+from core.metrics import NLPMetrics
+
+# CPU-bound NLP metrics (ROUGE, BLEU, BERTScore) in worker processes, so
+# they use every core and run while generation and judge calls are still
+# waiting on the network. Workers are started with "spawn" (forking the
+# threaded Streamlit server is unsafe) and kept for the life of the app
+# process; each keeps its evaluate modules, and with them the BERT model,
+# loaded between chunks.
+
+MAX_AUTO_PROCESSES = 4
+CHUNK_PAIRS = 32
+# Below this many pairs of cheap n-gram metrics, starting the worker
+# processes costs more than it saves
+AUTO_MIN_PAIRS = 200
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+# Chunks submitted and not yet finished, over every pool
+_in_flight = 0
+_pool_lock = threading.Lock()
+
+
+def score_pairs(
+    nlp_metrics: list[str],
+    pairs: list[tuple[str, str]],
+    bertscore_backend: str = "evaluate",
+) -> list[dict[str, float]]:
+    # One call per metric over every (prediction, reference) pair; returns
+    # per-pair scores in input order.
+    predictions = [pred for pred, _ in pairs]
+    references = [ref for _, ref in pairs]
+    scores: list[dict[str, float]] = [{} for _ in pairs]
+    if not pairs:
+        return scores
+
+    if "ROUGE Score" in nlp_metrics:
+        rouge = NLPMetrics.rouge_score(predictions, references)
+        for i, s in enumerate(scores):
+            s["rouge1"] = rouge["rouge1"][i]
+            s["rouge2"] = rouge["rouge2"][i]
+            s["rougeL"] = rouge["rougeL"][i]
+    if "BLEU Score" in nlp_metrics:
+        bleu = NLPMetrics.bleu_score(predictions, references)
+        for i, s in enumerate(scores):
+            s["bleu"] = bleu["bleu"][i]
+    if "BERT Score" in nlp_metrics:
+        bert = NLPMetrics.bert_score(
+            predictions, references, backend=bertscore_backend
+        )
+        for i, s in enumerate(scores):
+            s["bert_f1"] = bert["f1"][i]
+    return scores
+
+
+def _score_compact(
+    nlp_metrics: list[str],
+    texts: list[str],
+    index_pairs: list[tuple[int, int]],
+    bertscore_backend: str = "evaluate",
+) -> list[dict[str, float]]:
+    # Worker entry point: each distinct text crosses the process boundary
+    # once (references repeat for every prompt and model of a row)
+    return score_pairs(
+        nlp_metrics,
+        [(texts[p], texts[r]) for p, r in index_pairs],
+        bertscore_backend,
+    )
+
+
+def _compact(pairs: list[tuple[str, str]]) -> tuple[list[str], list[tuple[int, int]]]:
+    index: dict[str, int] = {}
+    for pred, ref in pairs:
+        index.setdefault(pred, len(index))
+        index.setdefault(ref, len(index))
+    return list(index), [(index[p], index[r]) for p, r in pairs]
+
+
+def default_processes(nlp_metrics: list[str], expected_pairs: int) -> int:
+    if not nlp_metrics:
+        return 0
+    if "BERT Score" not in nlp_metrics and expected_pairs < AUTO_MIN_PAIRS:
+        return 0
+    return max(1, min(MAX_AUTO_PROCESSES, (os.cpu_count() or 2) - 1))
+
+
+def get_nlp_pool(processes: int) -> ProcessPoolExecutor:
+    """Process-wide pool, recreated only when a larger one is requested.
+
+    A pool with chunks still queued or running is kept (even if smaller)
+    rather than shut down under another run's work.
+    """
+    with _pool_lock:
+        return _get_pool(processes)
+
+
+def _get_pool(processes: int) -> ProcessPoolExecutor:
+    global _pool, _pool_size
+    if _pool is None or (processes > _pool_size and not _in_flight):
+        if _pool is not None:
+            # Idle, so this returns as soon as the workers exit
+            _pool.shutdown(wait=True)
+        _pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _pool_size = processes
+    return _pool
+
+
+def _chunk_done(_: Future) -> None:
+    global _in_flight
+    with _pool_lock:
+        _in_flight -= 1
+
+
+def submit_nlp(processes: int, fn, *args) -> Future:
+    """Submit to the shared pool, counting the chunk until it finishes."""
+    global _in_flight
+    with _pool_lock:
+        future = _get_pool(processes).submit(fn, *args)
+        _in_flight += 1
+    future.add_done_callback(_chunk_done)
+    return future
+
+
+class NLPScorer:
+    """Scores (prediction, reference) pairs as they arrive, in chunks.
+
+    With ``processes`` > 0 each full chunk is sent to the process pool right
+    away; with 0 everything is scored on the calling thread in ``results``.
+    """
+
+    def __init__(
+        self,
+        nlp_metrics: list[str],
+        processes: int = 0,
+        chunk_pairs: int = CHUNK_PAIRS,
+        bertscore_backend: str = "evaluate",
+    ):
+        self.nlp_metrics = nlp_metrics
+        self.processes = processes
+        self.bertscore_backend = bertscore_backend
+        self.chunk_pairs = max(1, chunk_pairs)
+        self._pending: list[tuple[str, tuple[str, str]]] = []
+        self._futures: list[tuple[list[str], Future]] = []
+        self._inline: list[tuple[str, tuple[str, str]]] = []
+
+    def add(self, key: str, pair: tuple[str, str]) -> None:
+        if self.processes <= 0:
+            self._inline.append((key, pair))
+            return
+        self._pending.append((key, pair))
+        if len(self._pending) >= self.chunk_pairs:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        keys = [key for key, _ in self._pending]
+        texts, index_pairs = _compact([pair for _, pair in self._pending])
+        future = submit_nlp(
+            self.processes,
+            _score_compact,
+            self.nlp_metrics,
+            texts,
+            index_pairs,
+            self.bertscore_backend,
+        )
+        self._futures.append((keys, future))
+        self._pending = []
+
+    def results(self, timeout: Optional[float] = None) -> dict[str, dict[str, float]]:
+        """Scores by key; pairs not finished within ``timeout`` are left out."""
+        self._flush()
+        until = None if timeout is None else time.monotonic() + timeout
+        scores: dict[str, dict[str, float]] = {}
+        if self._inline and (until is None or time.monotonic() < until):
+            keys = [key for key, _ in self._inline]
+            pairs = [pair for _, pair in self._inline]
+            scores.update(
+                zip(keys, score_pairs(self.nlp_metrics, pairs, self.bertscore_backend))
+            )
+        for keys, future in self._futures:
+            wait_s = None if until is None else max(0.0, until - time.monotonic())
+            try:
+                scores.update(zip(keys, future.result(timeout=wait_s)))
+            except FuturesTimeout:
+                # Drops the chunk if it hasn't started; a running one finishes
+                # in the background and is discarded
+                future.cancel()
+        return scores
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Callable, Hashable, Optional, TypeVar
+
+from core.cache import cache_key
+from core.schemas import LLMConfig
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def generation_key(config: LLMConfig, system_prompt: str, user_message: str) -> str:
+    return cache_key(config, system_prompt, user_message)
+
+
+def judge_key(
+    judge_config: LLMConfig,
+    metric: str,
+    question: str,
+    answer: str,
+    context: str,
+    criteria: Optional[str] = None,
+    embedding_provider: Optional[str] = None,
+) -> str:
+    payload = json.dumps(
+        {
+            # The judge is deterministic per config; the API key is not part
+            # of its identity
+            "judge": judge_config.model_dump(exclude={"api_key"}),
+            "metric": metric,
+            "question": question,
+            "answer": answer,
+            "context": context,
+            "criteria": criteria,
+            "embedding_provider": embedding_provider,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def nlp_key(prediction: str, reference: str) -> str:
+    payload = json.dumps([prediction, reference])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def dedupe(
+    cells: dict[K, T], key: Callable[[T], str]
+) -> tuple[dict[str, T], dict[K, str]]:
+    """Split per-cell work into unique units and a cell -> unit mapping."""
+    units: dict[str, T] = {}
+    assignment: dict[K, str] = {}
+    for cell, work in cells.items():
+        unit = key(work)
+        units.setdefault(unit, work)
+        assignment[cell] = unit
+    return units, assignment
+
+
+def fan_out(assignment: dict[K, str], results: dict[str, R]) -> dict[K, R]:
+    return {cell: results[unit] for cell, unit in assignment.items() if unit in results}
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Iterator, Optional
+
+from tenacity import (
+    RetryCallState,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from tenacity.stop import stop_base
+from tenacity.wait import wait_base
+
+from core.budget import BudgetExceeded
+from core.concurrency import adaptive_limiter, is_overload
+from core.deadline import DeadlineExceeded, check_deadline, deadline_time, remaining
+from core.telemetry import LLM_CIRCUIT_REJECTIONS, LLM_CIRCUIT_STATE
+
+# Retry policy and circuit breakers for provider calls. Errors are
+# classified before retrying: auth failures and other 4xx responses are the
+# caller's problem and fail on the first attempt; a 429 waits for the
+# provider's Retry-After when it sends one; 5xx, timeouts and connection
+# errors back off exponentially with jitter. Each (provider, model) has a
+# breaker that opens after a run of consecutive transient failures; while
+# open, new and queued calls fail at once with CircuitOpenError, and after
+# a cooldown a single half-open probe decides whether to close it again.
+# Retries never outlive the active deadline (core.deadline), and a call cut
+# short by the deadline says nothing about the provider's health.
+
+MAX_ATTEMPTS = 4
+# A longer Retry-After is reported as a failure rather than waited out
+MAX_RETRY_AFTER_S = 60.0
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT_S = 30.0
+MAX_RESET_TIMEOUT_S = 300.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+# ── Error classification ────────────────────────────────────────────────────
+
+
+def is_transient(error: BaseException) -> bool:
+    """5xx, 408/429, timeouts and dropped connections: worth another try."""
+    if is_overload(error) or isinstance(error, ConnectionError):
+        return True
+    # litellm.APIConnectionError (and Timeout, its subclass) carry no
+    # usable status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "Timeout")
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (BudgetExceeded, CircuitOpenError, DeadlineExceeded)):
+        return False
+    return is_transient(error)
+
+
+def _headers(error: BaseException) -> dict[str, str]:
+    headers: dict[str, str] = {}
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "headers", None) is not None:
+        headers.update({k.lower(): v for k, v in response.headers.items()})
+    extra = getattr(error, "litellm_response_headers", None)
+    if extra:
+        headers.update({k.lower(): v for k, v in dict(extra).items()})
+    return headers
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait (Retry-After / retry-after-ms)."""
+    headers = _headers(error)
+    if "retry-after-ms" in headers:
+        try:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class wait_for_error(wait_base):
+    """Retry-After when the provider sent one, jittered exponential otherwise."""
+
+    def __init__(self, fallback: Optional[wait_base] = None):
+        self.fallback = fallback or wait_random_exponential(min=2, max=60)
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        delay = retry_after(error) if error is not None else None
+        if delay is None:
+            delay = self.fallback(retry_state)
+        else:
+            delay = min(delay, MAX_RETRY_AFTER_S)
+        # Wake at the deadline at the latest; the next attempt then fails fast
+        left = remaining()
+        return delay if left is None else max(0.0, min(delay, left))
+
+
+class stop_on_long_retry_after(stop_base):
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        delay = retry_after(error) if error is not None else None
+        return delay is not None and delay > MAX_RETRY_AFTER_S
+
+
+# Shared by the completion and embedding calls
+provider_retry = retry(
+    wait=wait_for_error(),
+    stop=stop_after_attempt(MAX_ATTEMPTS) | stop_on_long_retry_after(),
+    retry=retry_if_exception(is_retryable),
+    reraise=True,
+)
+
+
+# ── Circuit breaker ─────────────────────────────────────────────────────────
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout_s: float = RESET_TIMEOUT_S,
+        max_reset_timeout_s: float = MAX_RESET_TIMEOUT_S,
+        on_open: Optional[Callable[[], None]] = None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout_s = reset_timeout_s
+        self.reset_timeout_s = reset_timeout_s
+        self.max_reset_timeout_s = max_reset_timeout_s
+        self.on_open = on_open
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def _reject(self) -> CircuitOpenError:
+        wait_s = max(0.0, self.opened_at + self.reset_timeout_s - time.monotonic())
+        return CircuitOpenError(
+            f"Circuit open for {self.name} after {self.failures} consecutive "
+            f"failures; next probe in {wait_s:.0f}s"
+        )
+
+    def check(self) -> None:
+        """Raise CircuitOpenError if a call now would be rejected."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                return
+            error = self._reject()
+        LLM_CIRCUIT_REJECTIONS.inc(circuit=self.name)
+        raise error
+
+    def _acquire(self) -> bool:
+        # Returns True when this call is the half-open probe
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            if (
+                self.state == OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout_s
+            ):
+                self.state = HALF_OPEN
+                self._publish()
+                return True
+            error = self._reject()
+        LLM_CIRCUIT_REJECTIONS.inc(circuit=self.name)
+        raise error
+
+    def _record(self, probe: bool, failed: bool) -> None:
+        opened = False
+        with self._lock:
+            if not failed:
+                if self.state != CLOSED and not probe:
+                    # A call admitted before the breaker opened succeeded;
+                    # leave the decision to the probe
+                    return
+                self.state = CLOSED
+                self.failures = 0
+                self.reset_timeout_s = self.base_reset_timeout_s
+            else:
+                self.failures += 1
+                if probe:
+                    self.reset_timeout_s = min(
+                        self.max_reset_timeout_s, self.reset_timeout_s * 2
+                    )
+                if probe or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+                    opened = True
+            self._publish()
+        if opened and self.on_open is not None:
+            self.on_open()
+
+    def _publish(self) -> None:
+        LLM_CIRCUIT_STATE.set(_STATE_VALUES[self.state], circuit=self.name)
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        probe = self._acquire()
+        try:
+            yield
+        except DeadlineExceeded:
+            self._release(probe)
+            raise
+        except Exception as e:
+            # Only provider-side trouble counts; a 4xx means the provider is up
+            self._record(probe, failed=is_transient(e))
+            raise
+        except BaseException:
+            self._release(probe)
+            raise
+        self._record(probe, failed=False)
+
+    def _release(self, probe: bool) -> None:
+        if probe:
+            # Interrupted probe: let the next caller probe instead
+            with self._lock:
+                self.state = OPEN
+                self._publish()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.reset_timeout_s = self.base_reset_timeout_s
+            self._publish()
+
+
+class CircuitBreakers:
+    """One breaker per (provider, model), created on first use."""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers: dict[tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: str) -> CircuitBreaker:
+        with self._lock:
+            key = (provider, model)
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(
+                    f"{provider}:{model}",
+                    # Wake calls queued for a concurrency slot so they fail now
+                    on_open=lambda: adaptive_limiter.wake(provider, model),
+                    **self.settings,
+                )
+            return self._breakers[key]
+
+    def open_circuits(self) -> list[str]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [b.name for b in breakers if b.state != CLOSED]
+
+    def reset(self) -> None:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        for b in breakers:
+            b.reset()
+
+
+circuit_breakers = CircuitBreakers()
+
+
+@contextmanager
+def guarded_slot(provider: str, model: str, wait: bool = True) -> Iterator[None]:
+    """Concurrency slot plus circuit breaker for one provider call."""
+    breaker = circuit_breakers.get(provider, model)
+
+    def _admit() -> None:
+        breaker.check()
+        check_deadline()
+
+    with adaptive_limiter.slot(
+        provider, model, admit=_admit, wait_until=deadline_time(), wait=wait
+    ), breaker.call():
+        yield
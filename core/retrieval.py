@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+# Retrieval-pruned context for Faithfulness. A long RAG context is split
+# into chunks of whole sentences and indexed with BM25 once per distinct
+# context (the index is cached, so every answer, prompt and strictness pass
+# over the same row reuses it). Each extracted statement then keeps only its
+# top-k passages, so the NLI step reads a few hundred tokens of evidence
+# instead of the whole context. "full" keeps the old behaviour, for
+# comparing scores between the two modes.
+
+CONTEXT_MODES = ("full", "retrieval")
+TOP_K = 3
+CHUNK_WORDS = 60
+# Shorter contexts are used whole; pruning would save next to nothing
+MIN_PRUNE_WORDS = 300
+INDEX_CACHE_SIZE = 256
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has he in is it its of on or she that the "
+    "their they this to was were which who will with".split()
+)
+
+
+def _terms(text: str) -> list[str]:
+    return [w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS]
+
+
+def sentence_chunks(context: str, max_words: int = CHUNK_WORDS) -> list[str]:
+    """Consecutive sentences packed into chunks of up to ``max_words``."""
+    chunks: list[str] = []
+    current: list[str] = []
+    words = 0
+    for sentence in _SENTENCE_END.split(context):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        length = len(sentence.split())
+        if current and words + length > max_words:
+            chunks.append(" ".join(current))
+            current, words = [], 0
+        current.append(sentence)
+        words += length
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of passages."""
+
+    def __init__(self, chunks: list[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        counts = [Counter(_terms(c)) for c in chunks]
+        lengths = np.array([sum(c.values()) for c in counts], dtype=np.float64)
+        average = lengths.mean() if chunks else 1.0
+        # Length-normalized k1 per chunk, the denominator term of BM25
+        self._norm = k1 * (1 - b + b * lengths / max(average, 1.0))
+        # term -> (chunk indexes, term frequencies)
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        for i, c in enumerate(counts):
+            for term, tf in c.items():
+                entry = postings.setdefault(term, ([], []))
+                entry[0].append(i)
+                entry[1].append(tf)
+        n = len(chunks)
+        self._postings = {
+            term: (
+                np.array(idx),
+                np.array(tf, dtype=np.float64),
+                np.log(1 + (n - len(idx) + 0.5) / (len(idx) + 0.5)),
+            )
+            for term, (idx, tf) in postings.items()
+        }
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.chunks))
+        for term in set(_terms(query)):
+            if term not in self._postings:
+                continue
+            idx, tf, idf = self._postings[term]
+            scores[idx] += idf * tf * (self.k1 + 1) / (tf + self._norm[idx])
+        return scores
+
+    def top_k(self, query: str, k: int = TOP_K) -> list[int]:
+        """Indexes of the ``k`` best passages for ``query``, best first."""
+        scores = self.scores(query)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [int(i) for i in order]
+
+
+_index_lock = threading.Lock()
+
+
+@lru_cache(maxsize=INDEX_CACHE_SIZE)
+def _build_index(context: str) -> BM25Index:
+    return BM25Index(sentence_chunks(context))
+
+
+def get_index(context: str) -> BM25Index:
+    # Built once per distinct context and shared by every thread
+    with _index_lock:
+        return _build_index(context)
+
+
+def _should_prune(context: str, k: int) -> bool:
+    return len(context.split()) >= MIN_PRUNE_WORDS and len(get_index(context).chunks) > k
+
+
+def statement_passages(context: str, statement: str, k: int = TOP_K) -> str:
+    """Evidence for one statement: its top-k passages in context order."""
+    if not _should_prune(context, k):
+        return context
+    index = get_index(context)
+    return "\n".join(index.chunks[i] for i in sorted(index.top_k(statement, k)))
+
+
+def prune_context(context: str, statements: list[str], k: int = TOP_K) -> str:
+    """The union of every statement's top-k passages, in context order."""
+    if not statements or not _should_prune(context, k):
+        return context
+    index = get_index(context)
+    keep = sorted({i for s in statements for i in index.top_k(s, k)})
+    return "\n".join(index.chunks[i] for i in keep)
@@ -14,6 +14,18 @@ PROVIDER_MODELS: dict[str, list[str]] = {
     ],
     "google": ["gemini/gemini-2.5-pro", "gemini/gemini-2.0-flash"],
     "ollama": ["ollama/llama3", "ollama/mistral", "ollama/codellama"],
+    # Offline fake provider for load tests and benchmarks (core/mock_provider.py)
+    "mock": ["mock/echo", "mock/judge", "mock/scripted"],
+}
+
+# Providers that run without an API key
+KEYLESS_PROVIDERS = {"ollama", "mock"}
+
+# Environment variables holding API keys outside the UI (CLI, job workers)
+API_KEY_ENV: dict[str, str] = {
+    "openai": "OPENAI_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY",
+    "google": "GEMINI_API_KEY",
 }
 
 DEFAULT_PROVIDER = "openai"
@@ -32,6 +44,24 @@ class LLMConfig(BaseModel):
     frequency_penalty: float = 0.0
     presence_penalty: float = 0.0
     api_base: Optional[str] = None
+    # Per-attempt request timeout in seconds; None waits as long as the
+    # provider client does
+    timeout_s: Optional[float] = None
+    # Alternatives returned per output token; 0 requests no logprobs
+    top_logprobs: int = 0
+    # JSON-schema response format ({"name", "schema", "strict"}) as a JSON
+    # string, so the config stays hashable; None for free text
+    response_schema: Optional[str] = None
+    # "api" embeds with the provider's model (EMBEDDING_MODELS); a
+    # core.local_embeddings backend embeds on the local CPU instead
+    embedding_backend: str = "api"
+
+
+class TokenLogprob(BaseModel):
+    token: str
+    logprob: float
+    # Most likely tokens at this position, chosen one included
+    top: dict[str, float] = Field(default_factory=dict)
 
 
 class LLMResponse(BaseModel):
@@ -41,6 +71,8 @@ class LLMResponse(BaseModel):
     output_tokens: int = 0
     latency_ms: float = 0.0
     estimated_cost_usd: float = 0.0
+    # Set when top_logprobs was requested and the provider returned them
+    logprobs: Optional[list[TokenLogprob]] = None
     cached: bool = False
 
 
@@ -57,7 +89,191 @@ class RubricCriterion(BaseModel):
     scale_max: int = 5
 
 
+class JudgeVerdict(BaseModel):
+    label: str  # "Yes" or "No"
+    p_yes: float
+    # Probability (logprobs) or vote share (sampling) of the label
+    confidence: float
+    method: str  # "logprobs" or "sampling"
+
+
 class ComparisonResult(BaseModel):
     winner: str  # "A", "B", or "tie"
     reasoning: str
     scores: dict[str, float] = Field(default_factory=dict)
+
+
+class BatchRow(BaseModel):
+    question: str
+    context: str = ""
+    ground_truth: str = ""
+    # Template variable values for this row, keyed by variable name
+    variables: dict[str, str] = Field(default_factory=dict)
+
+
+class HedgePolicy(BaseModel):
+    """Duplicate a call that outlives the model's recent latency percentile."""
+
+    percentile: float = 95.0
+    # Hedges allowed per primary call, and estimated extra USD per run
+    max_extra_fraction: float = 0.05
+    max_extra_cost_usd: Optional[float] = None
+    # Recent successful calls needed before the percentile is trusted
+    min_samples: int = 20
+
+
+class CascadePolicy(BaseModel):
+    """Decide judge items cheaply first; only unsure ones reach the strong judge."""
+
+    cheap_judge: LLMConfig
+    # How the cheap judge votes on Critique: "logprobs" reads one call's
+    # token probabilities, "sample" votes over cheap_strictness runs
+    cheap_verdicts: str = "logprobs"
+    cheap_strictness: int = 3
+    # Cheap Critique verdicts at least this confident are kept
+    min_confidence: float = 0.85
+    # Cheap Faithfulness / Answer Relevancy scores inside this band escalate
+    uncertain_low: float = 0.3
+    uncertain_high: float = 0.7
+    # ROUGE-L against the ground truth at or past these decides Correctness
+    # critiques without a judge call
+    rouge_low: float = 0.05
+    rouge_high: float = 0.9
+    # Share of early decisions also sent to the strong judge to measure
+    # agreement (the strong judge's value is reported for those)
+    audit_fraction: float = 0.0
+
+
+class CascadeOutcome(BaseModel):
+    value: Union[float, str]
+    stage: str  # "rule", "cheap" or "strong"
+    audited: bool = False
+    # Whether the cheap stage and the strong judge agreed, when both ran
+    agreed: Optional[bool] = None
+
+
+class BatchSpec(BaseModel):
+    prompts: list[str]
+    configs: list[LLMConfig]
+    # Optional display label per config; adds a "Config" column to results
+    config_labels: list[str] = Field(default_factory=list)
+    judge_config: LLMConfig
+    nlp_metrics: list[str] = Field(default_factory=list)
+    llm_metrics: list[str] = Field(default_factory=list)
+    critique_name: Optional[str] = None
+    use_cache: bool = True
+    # Upper bound only; per-model adaptive limits decide the actual parallelism
+    max_workers: int = 32
+    # Fixed per-provider caps on top of the adaptive limits
+    provider_concurrency: dict[str, int] = Field(default_factory=dict)
+    # Worker processes for NLP metrics; None decides from the metrics and
+    # batch size (see core.nlp_pool), 0 scores them on the calling thread
+    nlp_processes: Optional[int] = None
+    # "evaluate" (bert_score on PyTorch) or a core.bertscore_fast backend
+    bertscore_backend: str = "evaluate"
+    # None disables hedged requests
+    hedging: Optional[HedgePolicy] = None
+    # Wall-clock limit for the whole run in seconds; cells still pending
+    # when it passes are reported as timed out
+    deadline_s: Optional[float] = None
+    # Critique answers to the same question judged per request (listwise);
+    # 1 judges each answer on its own
+    judge_pack_size: int = 1
+    # None sends every judge item to judge_config; Critique packing is not
+    # used for cascaded runs
+    cascade: Optional[CascadePolicy] = None
+    # Faithfulness verification: "llm" (judge NLI prompt) or a local NLI
+    # backend from core.local_nli; statements come from the judge ("llm") or
+    # a named core.local_nli extractor such as "sentences"
+    nli_backend: str = "llm"
+    statement_extractor: str = "llm"
+    # "retrieval" checks Faithfulness statements against their top BM25
+    # passages of the context (core.retrieval); "full" uses it all
+    context_mode: str = "full"
+
+
+class PlanStats(BaseModel):
+    """Work requested per cell vs. unique units actually executed."""
+
+    generation_cells: int = 0
+    generation_units: int = 0
+    judge_cells: int = 0
+    judge_units: int = 0
+    nlp_pairs: int = 0
+    nlp_units: int = 0
+    # Cells (generation, judge or NLP pairs) cut off by a timeout or deadline
+    timed_out: int = 0
+    # Judge units sent in listwise packs, and the requests that carried them
+    judge_packed: int = 0
+    judge_packs: int = 0
+    # Cascaded judging (core.cascade): items by deciding stage, audits of
+    # early decisions, and cheap/strong agreement on audits and escalations
+    cascade_items: int = 0
+    cascade_by_rule: int = 0
+    cascade_by_cheap: int = 0
+    cascade_escalated: int = 0
+    cascade_audited: int = 0
+    cascade_audit_agreed: int = 0
+    cascade_escalated_agreed: int = 0
+
+    @property
+    def calls_saved(self) -> int:
+        return (
+            (self.generation_cells - self.generation_units)
+            + (self.judge_cells - self.judge_units)
+            + (self.judge_packed - self.judge_packs)
+        )
+
+    def __add__(self, other: "PlanStats") -> "PlanStats":
+        return PlanStats(
+            **{
+                name: getattr(self, name) + getattr(other, name)
+                for name in PlanStats.model_fields
+            }
+        )
+
+
+class BudgetLimits(BaseModel):
+    # Hard caps stop new provider calls; soft caps only warn. None = no cap.
+    max_cost_usd: Optional[float] = None
+    max_tokens: Optional[int] = None
+    warn_cost_usd: Optional[float] = None
+    warn_tokens: Optional[int] = None
+
+
+class Spend(BaseModel):
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost_usd: float = 0.0
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def __add__(self, other: "Spend") -> "Spend":
+        return Spend(
+            **{
+                name: getattr(self, name) + getattr(other, name)
+                for name in Spend.model_fields
+            }
+        )
+
+
+class JobInfo(BaseModel):
+    id: str
+    label: str = ""
+    # "queued", "running", "cancelling", "cancelled", "completed", "failed"
+    # or "interrupted" (its worker went away mid-run)
+    status: str
+    created: float
+    updated: float
+    rows_done: int = 0
+    rows_total: int = 0
+    stage: str = ""
+    error: Optional[str] = None
+    stats: PlanStats = Field(default_factory=PlanStats)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("cancelled", "completed", "failed", "interrupted")
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import itertools
+import math
+import re
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from core.batch import ProgressCallback, run_batch
+from core.schemas import BatchRow, BatchSpec, LLMConfig, PlanStats
+from core.tracing import span, traced
+
+SWEEP_PARAMS = [
+    "temperature",
+    "top_p",
+    "max_tokens",
+    "frequency_penalty",
+    "presence_penalty",
+]
+
+_ROUGE_L_PATTERN = re.compile(r"RL:\[([^\]]*)\]")
+
+
+def parse_values(text: str) -> list[float]:
+    """Parse "0,0.5,1" or an inclusive "start:stop:step" range."""
+    text = text.strip()
+    if not text:
+        return []
+    if ":" in text:
+        start, stop, step = (float(part) for part in text.split(":"))
+        if step <= 0:
+            raise ValueError(f"Range step must be positive: {text}")
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 6) for i in range(count)]
+    return [float(part) for part in text.split(",") if part.strip()]
+
+
+def expand_config_grid(
+    base: LLMConfig, grid: dict[str, list[float]]
+) -> list[LLMConfig]:
+    params = [p for p in SWEEP_PARAMS if grid.get(p)]
+    configs: list[LLMConfig] = []
+    for values in itertools.product(*(grid[p] for p in params)):
+        update: dict[str, Union[int, float]] = {}
+        for param, value in zip(params, values):
+            update[param] = int(value) if param == "max_tokens" else float(value)
+        configs.append(base.model_copy(update=update))
+    # Frozen configs hash by value, so duplicate grid points collapse here
+    return list(dict.fromkeys(configs))
+
+
+def config_label(config: LLMConfig, params: list[str]) -> str:
+    settings = ", ".join(f"{p}={getattr(config, p)}" for p in params)
+    return f"{config.model_name} | {settings}" if settings else config.model_name
+
+
+# ── Scoring ─────────────────────────────────────────────────────────────────
+
+
+def _cell_values(metric: str, value) -> list[float]:
+    if metric == "ROUGE Score":
+        match = _ROUGE_L_PATTERN.search(str(value))
+        if not match:
+            return []
+        return [float(v) for v in match.group(1).split(",") if v.strip()]
+    if isinstance(value, list):
+        return [float(v) for v in value]
+    if isinstance(value, str):
+        if value in ("Yes", "No"):
+            return [1.0 if value == "Yes" else 0.0]
+        return []
+    if value is None or pd.isna(value):
+        return []
+    return [float(value)]
+
+
+def score_results(
+    results_df: pd.DataFrame,
+    metric: str,
+    critique_name: Optional[str] = None,
+) -> pd.Series:
+    """Mean metric value per Config label across all rows and prompts."""
+    if metric == "Critique":
+        prefix = f"Critique_{critique_name}_Prompt"
+    elif metric.endswith(" Score"):
+        prefix = metric
+    else:
+        prefix = f"{metric}_Prompt"
+    metric_cols = [c for c in results_df.columns if c.startswith(prefix)]
+
+    scores: dict[str, list[float]] = {}
+    for _, row in results_df.iterrows():
+        values = scores.setdefault(row["Config"], [])
+        for col in metric_cols:
+            values.extend(_cell_values(metric, row[col]))
+    return pd.Series(
+        {
+            label: round(float(np.mean(v)), 3) if v else float("nan")
+            for label, v in scores.items()
+        }
+    )
+
+
+# ── Sweep runner ────────────────────────────────────────────────────────────
+
+
+@traced("sweep.run")
+def run_sweep(
+    rows: list[BatchRow],
+    spec: BatchSpec,
+    metric: str,
+    maximize: bool = True,
+    halving: bool = True,
+    eta: int = 2,
+    min_rows: int = 1,
+    on_progress: Optional[ProgressCallback] = None,
+) -> tuple[pd.DataFrame, pd.DataFrame, PlanStats]:
+    """Evaluate every config in ``spec`` and rank them on ``metric``.
+
+    With ``halving`` enabled, configs are run on a growing prefix of the
+    rows and only the best 1/``eta`` survive each rung (successive halving).
+    Each rung only runs the rows a survivor has not seen yet, so earlier
+    answers and judge scores are reused rather than recomputed.
+
+    Returns ``(leaderboard, results, stats)``.
+    """
+    labels = spec.config_labels or [c.model_name for c in spec.configs]
+    if len(set(labels)) != len(labels):
+        raise ValueError("Sweep configs need unique labels")
+    by_label = dict(zip(labels, spec.configs))
+
+    if halving and len(labels) > 1 and len(rows) > 1:
+        eta = max(2, eta)
+        num_rungs = math.ceil(math.log(len(labels), eta))
+        budgets = [
+            min(len(rows), max(min_rows, math.ceil(len(rows) / eta ** (num_rungs - k))))
+            for k in range(num_rungs + 1)
+        ]
+    else:
+        budgets = [len(rows)]
+
+    survivors = list(labels)
+    rows_seen = 0
+    eliminated_at: dict[str, int] = {}
+    frames: list[pd.DataFrame] = []
+    stats = PlanStats()
+
+    for rung, budget in enumerate(budgets):
+        if budget > rows_seen:
+
+            def _rung_progress(stage: str, done: int, total: int) -> None:
+                if on_progress is not None:
+                    on_progress(f"rung {rung + 1}/{len(budgets)} {stage}", done, total)
+
+            rung_spec = spec.model_copy(
+                update={
+                    "configs": [by_label[label] for label in survivors],
+                    "config_labels": survivors,
+                }
+            )
+            with span("sweep.rung", rung=rung + 1, configs=len(survivors)):
+                rung_df, rung_stats = run_batch(
+                    rows[rows_seen:budget], rung_spec, _rung_progress
+                )
+            frames.append(rung_df)
+            stats = stats + rung_stats
+            rows_seen = budget
+
+        results_df = pd.concat(frames, ignore_index=True)
+        scores = score_results(
+            results_df[results_df["Config"].isin(survivors)],
+            metric,
+            spec.critique_name,
+        )
+        if rung == len(budgets) - 1 or len(survivors) == 1:
+            break
+
+        keep = max(1, math.ceil(len(survivors) / eta))
+        ranked = scores.reindex(survivors).sort_values(
+            ascending=not maximize, na_position="last"
+        )
+        for label in ranked.index[keep:]:
+            eliminated_at[label] = rung + 1
+        survivors = [label for label in survivors if label in set(ranked.index[:keep])]
+
+    results_df = pd.concat(frames, ignore_index=True)
+    all_scores = score_results(results_df, metric, spec.critique_name)
+    rows_per_label = results_df.groupby("Config").size()
+
+    leaderboard = pd.DataFrame(
+        [
+            {
+                "Config": label,
+                "Model": by_label[label].model_name,
+                **{p: getattr(by_label[label], p) for p in SWEEP_PARAMS},
+                metric: all_scores.get(label, float("nan")),
+                "Rows Evaluated": int(rows_per_label.get(label, 0)),
+                "Eliminated At Rung": eliminated_at.get(label),
+            }
+            for label in labels
+        ]
+    )
+    leaderboard = leaderboard.sort_values(
+        by=["Rows Evaluated", metric],
+        ascending=[False, not maximize],
+        na_position="last",
+    ).reset_index(drop=True)
+    return leaderboard, results_df, stats
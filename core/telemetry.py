@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+
+# Process-wide counters, gauges and histograms in the Prometheus text
+# exposition format. Everything is in-process; set
+# PROMPT_TESTING_METRICS_PORT to serve /metrics for a local scraper.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}"
+            for k, v in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: per-bucket counts (+Inf last), sum, count
+        self._data: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._data.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        data = self._data.get(self._key(labels))
+        return sum(data[0]) if data else 0
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(c), t[0])) for k, (c, t) in self._data.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# ── Registry ────────────────────────────────────────────────────────────────
+
+_registry: dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric: _Metric) -> _Metric:
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def render_metrics() -> str:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(m.render() for m in metrics) + "\n"
+
+
+def reset_metrics() -> None:
+    """Zero every metric (benchmarks and tests start from a clean slate)."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for m in metrics:
+        with m._lock:
+            if isinstance(m, Histogram):
+                m._data.clear()
+            else:
+                m._values.clear()
+
+
+LLM_REQUESTS = _register(
+    Counter(
+        "llm_requests_total",
+        "Provider calls by outcome (one per attempt, retries included).",
+        ("provider", "model", "kind", "status"),
+    )
+)
+LLM_ERRORS = _register(
+    Counter(
+        "llm_request_errors_total",
+        "Failed provider calls by exception type.",
+        ("provider", "model", "kind", "error"),
+    )
+)
+LLM_LATENCY = _register(
+    Histogram(
+        "llm_request_duration_seconds",
+        "Provider call latency.",
+        ("provider", "model", "kind"),
+    )
+)
+LLM_INFLIGHT = _register(
+    Gauge("llm_inflight_requests", "Provider calls currently in flight.", ("provider",))
+)
+LLM_CONCURRENCY_LIMIT = _register(
+    Gauge(
+        "llm_concurrency_limit",
+        "Current adaptive concurrency limit.",
+        ("provider", "model"),
+    )
+)
+LLM_CIRCUIT_STATE = _register(
+    Gauge(
+        "llm_circuit_state",
+        "Circuit breaker state per provider:model (0 closed, 1 half-open, 2 open).",
+        ("circuit",),
+    )
+)
+LLM_CIRCUIT_REJECTIONS = _register(
+    Counter(
+        "llm_circuit_rejections_total",
+        "Calls failed immediately because the circuit was open.",
+        ("circuit",),
+    )
+)
+LLM_HEDGES = _register(
+    Counter(
+        "llm_hedged_requests_total",
+        "Completions that got a duplicate request, by which one answered first.",
+        ("provider", "model", "winner"),
+    )
+)
+LLM_TOKENS = _register(
+    Counter(
+        "llm_tokens_total",
+        "Tokens billed by providers (cache hits excluded).",
+        ("provider", "model", "direction"),
+    )
+)
+LLM_COST = _register(
+    Counter(
+        "llm_cost_usd_total",
+        "Estimated provider spend in USD (cache hits excluded).",
+        ("provider", "model"),
+    )
+)
+CACHE_LOOKUPS = _register(
+    Counter(
+        "llm_cache_lookups_total",
+        "Response cache lookups; 'coalesced' joined an identical in-flight call.",
+        ("result",),
+    )
+)
+EMBEDDING_CACHE_LOOKUPS = _register(
+    Counter(
+        "bertscore_embedding_cache_lookups_total",
+        "BERTScore token embedding lookups by the tier that answered ('miss' = encoded).",
+        ("tier",),
+    )
+)
+JUDGE_EVALUATIONS = _register(
+    Counter(
+        "judge_evaluations_total",
+        "LLM judge metric evaluations by outcome.",
+        ("metric", "status"),
+    )
+)
+JUDGE_LATENCY = _register(
+    Histogram("judge_duration_seconds", "LLM judge metric latency.", ("metric",))
+)
+
+
+@contextmanager
+def track_request(provider: str, model: str, kind: str) -> Iterator[None]:
+    LLM_INFLIGHT.inc(provider=provider)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception as e:
+        status = "error"
+        LLM_ERRORS.inc(provider=provider, model=model, kind=kind, error=type(e).__name__)
+        raise
+    finally:
+        LLM_INFLIGHT.dec(provider=provider)
+        LLM_LATENCY.observe(
+            time.perf_counter() - start, provider=provider, model=model, kind=kind
+        )
+        LLM_REQUESTS.inc(provider=provider, model=model, kind=kind, status=status)
+
+
+@contextmanager
+def track_judge(metric: str) -> Iterator[None]:
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        JUDGE_LATENCY.observe(time.perf_counter() - start, metric=metric)
+        JUDGE_EVALUATIONS.inc(metric=metric, status=status)
+
+
+def record_usage(
+    provider: str, model: str, input_tokens: int, output_tokens: int, cost_usd: float
+) -> None:
+    LLM_TOKENS.inc(input_tokens, provider=provider, model=model, direction="input")
+    LLM_TOKENS.inc(output_tokens, provider=provider, model=model, direction="output")
+    LLM_COST.inc(cost_usd, provider=provider, model=model)
+
+
+# ── Exporter ────────────────────────────────────────────────────────────────
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+_servers: dict[int, ThreadingHTTPServer] = {}
+_servers_lock = threading.Lock()
+
+
+def start_metrics_server(
+    port: Optional[int] = None, host: str = "127.0.0.1"
+) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on ``port`` (or PROMPT_TESTING_METRICS_PORT) once per process."""
+    if port is None:
+        env_port = os.environ.get("PROMPT_TESTING_METRICS_PORT", "")
+        if not env_port:
+            return None
+        port = int(env_port)
+    with _servers_lock:
+        if port not in _servers:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(
+                target=server.serve_forever, name="metrics-exporter", daemon=True
+            ).start()
+            _servers[port] = server
+        return _servers[port]
@@ -1,26 +1,93 @@
 from __future__ import annotations
 
 import re
+from functools import lru_cache
+from typing import Iterable, Iterator, Mapping
+
+import pandas as pd
 
 
 _VAR_PATTERN = re.compile(r"\{\{(\w+)\}\}")
 
 
+class CompiledTemplate:
+    """A template parsed once into alternating literal and slot segments.
+
+    ``literals`` always has one more entry than ``slots``; rendering is
+    ``literals[0] + value(slots[0]) + literals[1] + ...``.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.literals: list[str] = []
+        self.slots: list[str] = []
+        pos = 0
+        for match in _VAR_PATTERN.finditer(template):
+            self.literals.append(template[pos : match.start()])
+            self.slots.append(match.group(1))
+            pos = match.end()
+        self.literals.append(template[pos:])
+        self.variables: list[str] = list(dict.fromkeys(self.slots))
+        # Equivalent str.format pattern with positional fields, so rendering
+        # runs in C instead of re-scanning the template per row
+        index = {v: i for i, v in enumerate(self.variables)}
+        self._format = _escape_braces(self.literals[0]) + "".join(
+            f"{{{index[slot]}}}" + _escape_braces(literal)
+            for slot, literal in zip(self.slots, self.literals[1:])
+        )
+
+    def missing(self, available: Iterable[str]) -> list[str]:
+        available = set(available)
+        return [v for v in self.variables if v not in available]
+
+    def validate(self, available: Iterable[str]) -> None:
+        missing = self.missing(available)
+        if missing:
+            raise KeyError(f"Missing template variable: {missing[0]}")
+
+    def render(self, variables: Mapping[str, object]) -> str:
+        try:
+            values = [str(variables[v]) for v in self.variables]
+        except KeyError as e:
+            raise KeyError(f"Missing template variable: {e.args[0]}") from None
+        return self._format.format(*values)
+
+    def iter_render(
+        self, variable_sets: Iterable[Mapping[str, object]]
+    ) -> Iterator[str]:
+        for variables in variable_sets:
+            yield self.render(variables)
+
+    def render_frame(self, df: pd.DataFrame) -> pd.Series:
+        # Validate once against the columns, then render every row in a
+        # single join pass over the column values instead of per-row regex.
+        self.validate(df.columns)
+        if not self.variables:
+            return pd.Series([self.template] * len(df), index=df.index, dtype=object)
+        columns = [df[v].astype(str).tolist() for v in self.variables]
+        return pd.Series(
+            list(map(self._format.format, *columns)), index=df.index, dtype=object
+        )
+
+
+def _escape_braces(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+@lru_cache(maxsize=256)
+def compile_template(template: str) -> CompiledTemplate:
+    return CompiledTemplate(template)
+
+
 def extract_variables(template: str) -> list[str]:
-    return list(dict.fromkeys(_VAR_PATTERN.findall(template)))
+    return list(compile_template(template).variables)
 
 
 def render_template(template: str, variables: dict[str, str]) -> str:
-    def _replacer(match: re.Match) -> str:
-        key = match.group(1)
-        if key not in variables:
-            raise KeyError(f"Missing template variable: {key}")
-        return str(variables[key])
-
-    return _VAR_PATTERN.sub(_replacer, template)
+    return compile_template(template).render(variables)
 
 
 def expand_sweep(
     template: str, variable_sets: list[dict[str, str]]
 ) -> list[str]:
-    return [render_template(template, vs) for vs in variable_sets]
+    return list(compile_template(template).iter_render(variable_sets))
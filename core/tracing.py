@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import functools
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional, Protocol, TypeVar
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field
+
+# Lightweight spans with OpenTelemetry-compatible ids, attribute names and
+# JSON shape. Exporters are chosen with PROMPT_TESTING_TRACE_EXPORTER
+# (comma-separated: "console", "json", "otel"); "json" appends one span per
+# line to PROMPT_TESTING_TRACE_FILE. No collector is needed for the local
+# exporters; "otel" mirrors every span into the opentelemetry tracer when
+# the package is installed (its SDK/exporter setup is left to the deployer).
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Span(BaseModel):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_ns: int = Field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: dict[str, Any] = Field(default_factory=dict)
+    status: str = "OK"  # "OK" or "ERROR"
+    error: Optional[str] = None
+    thread: str = Field(default_factory=lambda: threading.current_thread().name)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_otel_json(self) -> dict:
+        # Same layout as opentelemetry-sdk's ConsoleSpanExporter output
+        return {
+            "name": self.name,
+            "context": {"trace_id": f"0x{self.trace_id}", "span_id": f"0x{self.span_id}"},
+            "parent_id": f"0x{self.parent_id}" if self.parent_id else None,
+            "start_time": self.start_ns,
+            "end_time": self.end_ns,
+            "status": {"status_code": "ERROR" if self.status == "ERROR" else "OK", "description": self.error},
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter(Protocol):
+    def export(self, span: Span) -> None: ...
+
+
+class ConsoleExporter:
+    def export(self, span: Span) -> None:
+        print(json.dumps(span.to_otel_json(), default=str), file=sys.stderr)
+
+
+class JsonFileExporter:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_otel_json(), default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_collector: ContextVar[Optional[list[Span]]] = ContextVar("span_collector", default=None)
+_exporters: list[SpanExporter] = []
+_otel_tracer: Any = None
+
+
+def configure_exporters(spec: Optional[str] = None) -> list[SpanExporter]:
+    global _otel_tracer
+    spec = spec if spec is not None else os.environ.get("PROMPT_TESTING_TRACE_EXPORTER", "")
+    exporters: list[SpanExporter] = []
+    _otel_tracer = None
+    for name in (s.strip() for s in spec.split(",") if s.strip()):
+        if name == "console":
+            exporters.append(ConsoleExporter())
+        elif name == "json":
+            exporters.append(
+                JsonFileExporter(os.environ.get("PROMPT_TESTING_TRACE_FILE", "traces.jsonl"))
+            )
+        elif name == "otel":
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                print("opentelemetry is not installed; skipping otel exporter", file=sys.stderr)
+            else:
+                _otel_tracer = trace.get_tracer("llm-prompt-testing")
+    _exporters[:] = exporters
+    return exporters
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attribute(key: str, value: Any) -> None:
+    s = _current_span.get()
+    if s is not None:
+        s.attributes[key] = value
+
+
+def increment_attribute(key: str, amount: int = 1) -> None:
+    s = _current_span.get()
+    if s is not None:
+        s.attributes[key] = s.attributes.get(key, 0) + amount
+
+
+@contextmanager
+def _otel_span(name: str, attributes: dict[str, Any]) -> Iterator[Any]:
+    if _otel_tracer is None:
+        yield None
+        return
+    # Mirrored live so the SDK's own context propagation nests the spans
+    with _otel_tracer.start_as_current_span(
+        name, attributes=_otel_attributes(attributes)
+    ) as otel_span:
+        yield otel_span
+
+
+def _otel_attributes(attributes: dict[str, Any]) -> dict[str, Any]:
+    return {
+        k: v for k, v in attributes.items() if isinstance(v, (str, bool, int, float))
+    }
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    parent = _current_span.get()
+    with _otel_span(name, attributes) as otel_span:
+        if otel_span is not None:
+            ctx = otel_span.get_span_context()
+            trace_id, span_id = f"{ctx.trace_id:032x}", f"{ctx.span_id:016x}"
+        else:
+            trace_id = parent.trace_id if parent else secrets.token_hex(16)
+            span_id = secrets.token_hex(8)
+        s = Span(
+            name=name,
+            trace_id=trace_id,
+            span_id=span_id,
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes,
+        )
+        token = _current_span.set(s)
+        try:
+            yield s
+        except BaseException as e:
+            s.status = "ERROR"
+            s.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            s.end_ns = time.time_ns()
+            _current_span.reset(token)
+            if otel_span is not None:
+                otel_span.set_attributes(_otel_attributes(s.attributes))
+            collector = _collector.get()
+            if collector is not None:
+                collector.append(s)
+            for exporter in _exporters:
+                try:
+                    exporter.export(s)
+                except Exception:
+                    pass
+
+
+def traced(name: str) -> Callable[[F], F]:
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+@contextmanager
+def collect_spans(into: Optional[list[Span]] = None) -> Iterator[list[Span]]:
+    """Gather every span finished in this context (and its worker tasks)."""
+    spans = into if into is not None else []
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+
+
+# ── Breakdown ───────────────────────────────────────────────────────────────
+
+
+def span_summary(spans: list[Span]) -> pd.DataFrame:
+    """Per-span-name time, call count, cache hits and token totals."""
+    groups: dict[str, list[Span]] = {}
+    for s in spans:
+        groups.setdefault(s.name, []).append(s)
+    rows = []
+    for name, group in groups.items():
+        durations = np.array([s.duration_ms for s in group])
+        rows.append(
+            {
+                "Span": name,
+                "Calls": len(group),
+                "Total (ms)": round(float(durations.sum()), 1),
+                "Mean (ms)": round(float(durations.mean()), 1),
+                "p95 (ms)": round(float(np.percentile(durations, 95)), 1),
+                "Errors": sum(s.status == "ERROR" for s in group),
+                "Cache Hits": sum(bool(s.attributes.get("llm.cache_hit")) for s in group),
+                "Retries": sum(s.attributes.get("llm.retries", 0) for s in group),
+                "Input Tokens": sum(
+                    s.attributes.get("gen_ai.usage.input_tokens", 0) for s in group
+                ),
+                "Output Tokens": sum(
+                    s.attributes.get("gen_ai.usage.output_tokens", 0) for s in group
+                ),
+            }
+        )
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows).sort_values("Total (ms)", ascending=False, ignore_index=True)
+
+
+def span_timeline(spans: list[Span]) -> pd.DataFrame:
+    """One row per span with start/end offsets (ms) from the first span."""
+    if not spans:
+        return pd.DataFrame()
+    origin = min(s.start_ns for s in spans)
+    depth: dict[str, int] = {}
+    by_id = {s.span_id: s for s in spans}
+
+    def _depth(s: Span) -> int:
+        if s.span_id not in depth:
+            parent = by_id.get(s.parent_id) if s.parent_id else None
+            depth[s.span_id] = _depth(parent) + 1 if parent else 0
+        return depth[s.span_id]
+
+    return pd.DataFrame(
+        [
+            {
+                "Span": s.name,
+                "Depth": _depth(s),
+                "Start (ms)": (s.start_ns - origin) / 1e6,
+                "End (ms)": ((s.end_ns or s.start_ns) - origin) / 1e6,
+                "Duration (ms)": round(s.duration_ms, 1),
+                "Thread": s.thread,
+                "Model": s.attributes.get("gen_ai.request.model", ""),
+                "Status": s.status,
+            }
+            for s in sorted(spans, key=lambda s: s.start_ns)
+        ]
+    )
+
+
+configure_exporters()
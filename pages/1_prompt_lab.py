@@ -1,8 +1,12 @@
+import time
+
 import streamlit as st
 
+from core.deadline import deadline_at, is_timeout
 from core.llm_client import get_completion
-from core.schemas import LLMConfig
+from core.schemas import KEYLESS_PROVIDERS, LLMConfig
 from core.templates import extract_variables, render_template
+from core.tracing import collect_spans
 
 st.title("Prompt Lab :material/science:")
 st.caption("Compare multiple system prompts side-by-side")
@@ -122,6 +126,7 @@ nlp_metrics = [m for m in selected_metrics if m in NLP_METRICS]
 llm_metrics = [m for m in selected_metrics if m in LLM_METRICS]
 
 strictness = 1
+judge_logprobs = False
 criteria_name = None
 rubric_criteria = []
 
@@ -135,6 +140,14 @@ if llm_metrics:
             value=1,
             help="Number of judge runs for consensus voting",
         )
+        judge_logprobs = st.toggle(
+            "Score from logprobs",
+            value=False,
+            help="One judge call per metric: Critique, Faithfulness and Rubric "
+            "scores come from the Yes/No and score-digit token probabilities "
+            "instead of voting over Strictness runs. Models that return no "
+            "logprobs fall back to voting.",
+        )
     with metric_cfg_cols[1]:
         if "Critique" in llm_metrics:
             criteria_name = st.selectbox(
@@ -169,7 +182,7 @@ if "Rubric Scoring" in llm_metrics:
 
 
 def _check_inputs(config: LLMConfig) -> bool:
-    if not config.api_key and config.provider != "ollama":
+    if not config.api_key and config.provider not in KEYLESS_PROVIDERS:
         st.error("Please enter your API key in the sidebar.")
         return False
     if not question.strip():
@@ -187,6 +200,15 @@ def _check_inputs(config: LLMConfig) -> bool:
 
 st.divider()
 
+run_limit = st.number_input(
+    "Run time limit (s)",
+    min_value=0.0,
+    value=0.0,
+    step=30.0,
+    help="Stop generation and every judge call once this much time has passed; "
+    "0 for no limit",
+)
+
 if st.button(
     "Generate & Evaluate",
     type="primary",
@@ -199,6 +221,7 @@ if st.button(
 
     if not _check_inputs(config):
         st.stop()
+    run_deadline = time.monotonic() + run_limit if run_limit else None
 
     # Resolve template variables
     resolved_prompts = []
@@ -220,8 +243,14 @@ if st.button(
     user_message = "\n\n".join(parts)
 
     # ── Generate answers ──────────────────────────────────────────────────
+    # Spans from every stage of this run, for the Comparison page breakdown
+    run_spans: list = []
+    st.session_state["last_prompt_lab_trace"] = run_spans
+
     answers: list = []
-    with st.status("Generating answers...", expanded=True) as status:
+    with collect_spans(run_spans), deadline_at(run_deadline), st.status(
+        "Generating answers...", expanded=True
+    ) as status:
         for i, sys_prompt in enumerate(resolved_prompts):
             st.write(f"Running Prompt #{i + 1}...")
             try:
@@ -230,11 +259,15 @@ if st.button(
                 )
                 answers.append(resp)
             except Exception as e:
-                st.error(f"Prompt #{i + 1} failed: {e}")
+                if is_timeout(e):
+                    st.error(f"Prompt #{i + 1} timed out: {e}")
+                else:
+                    st.error(f"Prompt #{i + 1} failed: {e}")
                 answers.append(None)
         ok_count = len([a for a in answers if a])
         status.update(
-            label=f"Generated {ok_count} answer(s)", state="complete"
+            label=f"Generated {ok_count} answer(s)",
+            state="complete" if ok_count == len(answers) else "error",
         )
 
     # ── Display answers ───────────────────────────────────────────────────
@@ -275,7 +308,9 @@ if st.button(
         from core.metrics import NLPMetrics
 
         st.subheader("NLP Metrics")
-        with st.status("Computing NLP metrics...", expanded=True) as status:
+        with collect_spans(run_spans), deadline_at(run_deadline), st.status(
+            "Computing NLP metrics...", expanded=True
+        ) as status:
             predictions = [a.content for _, a in valid_answers]
             references = [ground_truth.strip()] * len(predictions)
             nlp_results: dict = {}
@@ -325,13 +360,15 @@ if st.button(
     if llm_metrics and valid_answers:
         from core.metrics import LLMJudge
 
-        judge = LLMJudge(judge_config)
+        judge = LLMJudge(
+            judge_config, verdicts="logprobs" if judge_logprobs else "sample"
+        )
         st.subheader("LLM Judge Metrics")
 
         judge_results: dict = {}
         for idx, ans in valid_answers:
             st.markdown(f"**Prompt #{idx + 1}**")
-            with st.status(
+            with collect_spans(run_spans), deadline_at(run_deadline), st.status(
                 f"Judging Prompt #{idx + 1}...", expanded=True
             ) as status:
                 result_row: dict = {}
@@ -346,59 +383,72 @@ if st.button(
                 jcols = st.columns(max(len(display_metrics), 2))
                 col_i = 0
 
-                if "Answer Relevancy" in llm_metrics:
-                    st.write("Computing Answer Relevancy...")
-                    score = judge.answer_relevancy(
-                        question.strip(), ans.content, config, strictness
-                    )
-                    result_row["Relevancy"] = score
-                    with jcols[col_i % len(jcols)]:
-                        st.metric("Relevancy", f"{score:.3f}")
-                    col_i += 1
-
-                if "Faithfulness" in llm_metrics:
-                    st.write("Computing Faithfulness...")
-                    score = judge.faithfulness(
-                        question.strip(),
-                        ans.content,
-                        context.strip(),
-                        strictness,
-                    )
-                    result_row["Faithfulness"] = score
-                    with jcols[col_i % len(jcols)]:
-                        st.metric("Faithfulness", f"{score:.3f}")
-                    col_i += 1
-
-                if "Critique" in llm_metrics and criteria_name:
-                    st.write(f"Running Critique ({criteria_name})...")
-                    verdict = judge.critique(
-                        question.strip(),
-                        ans.content,
-                        CRITERIA_DICT[criteria_name],
-                        strictness,
+                try:
+                    if "Answer Relevancy" in llm_metrics:
+                        st.write("Computing Answer Relevancy...")
+                        score = judge.answer_relevancy(
+                            question.strip(), ans.content, config, strictness
+                        )
+                        result_row["Relevancy"] = score
+                        with jcols[col_i % len(jcols)]:
+                            st.metric("Relevancy", f"{score:.3f}")
+                        col_i += 1
+
+                    if "Faithfulness" in llm_metrics:
+                        st.write("Computing Faithfulness...")
+                        score = judge.faithfulness(
+                            question.strip(),
+                            ans.content,
+                            context.strip(),
+                            strictness,
+                        )
+                        result_row["Faithfulness"] = score
+                        with jcols[col_i % len(jcols)]:
+                            st.metric("Faithfulness", f"{score:.3f}")
+                        col_i += 1
+
+                    if "Critique" in llm_metrics and criteria_name:
+                        st.write(f"Running Critique ({criteria_name})...")
+                        verdict = judge.critique_verdict(
+                            question.strip(),
+                            ans.content,
+                            CRITERIA_DICT[criteria_name],
+                            strictness,
+                        )
+                        result_row[f"Critique:{criteria_name}"] = verdict.label
+                        with jcols[col_i % len(jcols)]:
+                            st.metric(
+                                f"Critique: {criteria_name}",
+                                verdict.label,
+                                help=f"P(Yes) {verdict.p_yes:.2f}, confidence "
+                                f"{verdict.confidence:.2f} ({verdict.method})",
+                            )
+                        col_i += 1
+
+                    if "Rubric Scoring" in llm_metrics and rubric_criteria:
+                        st.write("Running Rubric Scoring...")
+                        rubric_scores = judge.rubric_scoring(
+                            question.strip(),
+                            ans.content,
+                            context.strip(),
+                            rubric_criteria,
+                        )
+                        result_row["Rubric"] = rubric_scores
+                        with jcols[col_i % len(jcols)]:
+                            for rname, rscore in rubric_scores.items():
+                                st.metric(rname, f"{rscore}/5")
+                        col_i += 1
+                except Exception as e:
+                    if not is_timeout(e):
+                        raise
+                    st.warning(f"Timed out, remaining metrics skipped: {e}")
+                    status.update(
+                        label=f"Prompt #{idx + 1} timed out", state="error"
                     )
-                    result_row[f"Critique:{criteria_name}"] = verdict
-                    with jcols[col_i % len(jcols)]:
-                        st.metric(f"Critique: {criteria_name}", verdict)
-                    col_i += 1
-
-                if "Rubric Scoring" in llm_metrics and rubric_criteria:
-                    st.write("Running Rubric Scoring...")
-                    rubric_scores = judge.rubric_scoring(
-                        question.strip(),
-                        ans.content,
-                        context.strip(),
-                        rubric_criteria,
+                else:
+                    status.update(
+                        label=f"Prompt #{idx + 1} evaluated", state="complete"
                     )
-                    result_row["Rubric"] = rubric_scores
-                    with jcols[col_i % len(jcols)]:
-                        for rname, rscore in rubric_scores.items():
-                            st.metric(rname, f"{rscore}/5")
-                    col_i += 1
-
-                status.update(
-                    label=f"Prompt #{idx + 1} evaluated", state="complete"
-                )
             judge_results[idx] = result_row
 
         st.session_state["last_judge_results"] = judge_results
@@ -406,7 +456,7 @@ if st.button(
         # ── Pairwise comparison ───────────────────────────────────────────
         if "Pairwise Comparison" in llm_metrics and len(valid_answers) >= 2:
             st.subheader("Pairwise Comparison")
-            with st.status(
+            with collect_spans(run_spans), deadline_at(run_deadline), st.status(
                 "Running pairwise comparisons...", expanded=True
             ) as status:
                 import pandas as pd
@@ -419,12 +469,24 @@ if st.button(
                         st.write(
                             f"Comparing Prompt #{idx_a + 1} vs #{idx_b + 1}..."
                         )
-                        result = judge.pairwise_compare(
-                            question.strip(),
-                            context.strip(),
-                            ans_a.content,
-                            ans_b.content,
-                        )
+                        try:
+                            result = judge.pairwise_compare(
+                                question.strip(),
+                                context.strip(),
+                                ans_a.content,
+                                ans_b.content,
+                            )
+                        except Exception as e:
+                            if not is_timeout(e):
+                                raise
+                            pair_results.append(
+                                {
+                                    "Match": f"#{idx_a + 1} vs #{idx_b + 1}",
+                                    "Winner": "Timed out",
+                                    "Reasoning": str(e),
+                                }
+                            )
+                            continue
                         if result.winner == "A":
                             winner_label = f"Prompt #{idx_a + 1}"
                         elif result.winner == "B":
@@ -438,8 +500,11 @@ if st.button(
                                 "Reasoning": result.reasoning,
                             }
                         )
+                timed_out = sum(r["Winner"] == "Timed out" for r in pair_results)
                 status.update(
-                    label="Pairwise comparisons complete", state="complete"
+                    label="Pairwise comparisons complete"
+                    + (f" ({timed_out} timed out)" if timed_out else ""),
+                    state="error" if timed_out else "complete",
                 )
 
             st.dataframe(
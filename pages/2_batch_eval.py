@@ -1,21 +1,182 @@
 import pandas as pd
 import streamlit as st
 
-from core.llm_client import get_completion
-from core.metrics import LLMJudge, NLPMetrics
-from core.schemas import LLMConfig
+from core.batch import (
+    CONTEXT_COLUMNS,
+    CRITERIA_DICT,
+    GROUND_TRUTH_COLUMNS,
+    LLM_METRICS,
+    NLP_METRICS,
+    QUESTION_COLUMNS,
+    find_column_index,
+    load_rows,
+    match_variable_columns,
+)
+from core.bertscore_fast import BACKENDS as BERTSCORE_BACKENDS
+from core.budget import BudgetManager, use_budget
+from core.cascade import cascade_summary
+from core.concurrency import adaptive_limiter
+from core.deadline import deadline
+from core.jobs import get_job_queue
+from core.local_nli import NLI_BACKENDS, STATEMENT_EXTRACTORS
+from core.resilience import circuit_breakers
+from core.retrieval import CONTEXT_MODES
+from core.schemas import (
+    KEYLESS_PROVIDERS,
+    PROVIDER_MODELS,
+    BatchSpec,
+    BudgetLimits,
+    CascadePolicy,
+    HedgePolicy,
+    LLMConfig,
+)
+from core.sweep import SWEEP_PARAMS, config_label, expand_config_grid, parse_values, run_sweep
+from core.templates import extract_variables
+from core.tracing import collect_spans
 
+st.title("Batch Evaluation :material/table_chart:")
+st.caption("Upload a CSV to evaluate prompts across many questions at once")
 
-def _find_col_index(columns: list[str], candidates: list[str]) -> int:
-    lower_cols = [c.lower().strip() for c in columns]
-    for candidate in candidates:
-        if candidate.lower() in lower_cols:
-            return lower_cols.index(candidate.lower())
-    return 0
+if "session_budget" not in st.session_state:
+    st.session_state["session_budget"] = BudgetManager(name="session")
+session_budget: BudgetManager = st.session_state["session_budget"]
+
+# ── Result display ─────────────────────────────────────────────────────────
+
+
+def _show_budget(run_budget: BudgetManager) -> None:
+    for manager in (run_budget, session_budget):
+        if reason := manager.exceeded():
+            st.error(f"Budget cap hit — remaining calls were skipped: {reason}")
+        elif warning := manager.warning():
+            st.warning(warning)
+    spend_df = run_budget.breakdown()
+    if not spend_df.empty:
+        st.caption(f"{run_budget.summary()}  \n{session_budget.summary()}")
+        st.dataframe(spend_df, use_container_width=True, hide_index=True)
+
+
+def _show_plan_stats(plan_stats) -> None:
+    if plan_stats.calls_saved or plan_stats.nlp_pairs > plan_stats.nlp_units:
+        st.caption(
+            f"Deduplicated identical work: {plan_stats.generation_units}/"
+            f"{plan_stats.generation_cells} generations, {plan_stats.judge_units}/"
+            f"{plan_stats.judge_cells} judge evaluations and {plan_stats.nlp_units}/"
+            f"{plan_stats.nlp_pairs} NLP pairs executed — "
+            f"{plan_stats.calls_saved} LLM calls saved."
+        )
+    if plan_stats.cascade_items:
+        st.caption(cascade_summary(plan_stats) + ".")
+    if plan_stats.timed_out:
+        st.warning(
+            f"{plan_stats.timed_out} cell(s) timed out and are marked TIMEOUT in "
+            "the results; raise the run time limit or request timeout to finish them.",
+            icon=":material/timer_off:",
+        )
+    limits = adaptive_limiter.limits()
+    if limits:
+        st.caption(
+            "Adaptive concurrency: "
+            + ", ".join(f"{model} → {limit}" for (_, model), limit in limits.items())
+        )
+    open_circuits = circuit_breakers.open_circuits()
+    if open_circuits:
+        st.warning(
+            "Circuit open (provider failing, calls rejected until a probe succeeds): "
+            + ", ".join(open_circuits),
+            icon=":material/power_off:",
+        )
 
 
-st.title("Batch Evaluation :material/table_chart:")
-st.caption("Upload a CSV to evaluate prompts across many questions at once")
+def _show_results(results_df: pd.DataFrame) -> None:
+    st.subheader("Results")
+    st.dataframe(results_df, use_container_width=True, hide_index=True)
+    st.download_button(
+        "Download Report (CSV)",
+        results_df.to_csv(index=False).encode("utf-8"),
+        "batch_eval_report.csv",
+        "text/csv",
+        icon=":material/download:",
+        use_container_width=True,
+    )
+
+
+# ── Jobs ────────────────────────────────────────────────────────────────────
+
+
+def _session_keys() -> dict[str, str]:
+    # The queue forgets a job's keys once it stops; a resume re-supplies
+    # the ones entered in this session
+    keys = {
+        name.removeprefix("batch_key_"): value
+        for name, value in st.session_state.items()
+        if name.startswith("batch_key_") and value
+    }
+    for name in ("judge_config", "llm_config"):
+        config = st.session_state.get(name)
+        if config is not None and config.api_key:
+            keys[config.provider] = config.api_key
+    return keys
+
+
+@st.fragment(run_every=2)
+def _job_panel() -> None:
+    queue = get_job_queue()
+    jobs = queue.list_jobs()
+    if not jobs:
+        return
+    st.subheader("Jobs")
+    job_ids = [j.id for j in jobs]
+    current = st.session_state.get("batch_job_id")
+    job_id = st.selectbox(
+        "Job",
+        job_ids,
+        index=job_ids.index(current) if current in job_ids else 0,
+        format_func=lambda i: next(
+            f"{j.id} · {j.status} · {j.label}" for j in jobs if j.id == i
+        ),
+    )
+    st.session_state["batch_job_id"] = job_id
+    job = queue.info(job_id)
+
+    progress_text = f"{job.status}: {job.rows_done}/{job.rows_total} rows"
+    if job.stage and not job.finished:
+        progress_text += f" — {job.stage}"
+    st.progress(job.rows_done / max(job.rows_total, 1), text=progress_text)
+    if job.error:
+        st.error(job.error)
+
+    action_cols = st.columns(2)
+    with action_cols[0]:
+        if st.button(
+            "Cancel",
+            icon=":material/stop:",
+            disabled=job.finished,
+            use_container_width=True,
+        ):
+            queue.cancel(job_id)
+    with action_cols[1]:
+        if st.button(
+            "Resume",
+            icon=":material/replay:",
+            disabled=job.status not in ("cancelled", "failed", "interrupted"),
+            use_container_width=True,
+        ):
+            queue.resume(job_id, session_budget=session_budget, keys=_session_keys())
+
+    if (job_budget := queue.budget(job_id)) is not None:
+        _show_budget(job_budget)
+    if job.status == "completed":
+        _show_plan_stats(job.stats)
+
+    results_df = queue.results(job_id)
+    if not results_df.empty:
+        if not job.finished:
+            st.caption("Partial results — more rows are added as chunks finish.")
+        _show_results(results_df)
+        st.session_state["last_batch_results"] = results_df
+        st.session_state["last_batch_trace"] = list(queue.spans.get(job_id, ()))
+
 
 # ── CSV Upload ──────────────────────────────────────────────────────────────
 
@@ -27,6 +188,7 @@ uploaded_file = st.file_uploader(
 
 if uploaded_file is None:
     st.info("Upload a CSV file to get started.")
+    _job_panel()
     st.stop()
 
 df = pd.read_csv(uploaded_file)
@@ -43,32 +205,53 @@ with map_cols[0]:
     question_col = st.selectbox(
         "Question column",
         columns,
-        index=_find_col_index(columns, ["question", "questions", "query"]),
+        index=find_column_index(columns, QUESTION_COLUMNS),
     )
 with map_cols[1]:
     context_col = st.selectbox(
         "Context column",
         columns,
-        index=_find_col_index(columns, ["context", "contexts", "passage"]),
+        index=find_column_index(columns, CONTEXT_COLUMNS),
     )
 with map_cols[2]:
     gt_options = ["(none)"] + columns
     gt_col = st.selectbox(
         "Ground Truth column (optional)",
         gt_options,
-        index=_find_col_index(
-            gt_options, ["ground_truth", "groundtruth", "reference", "answer"]
-        ),
+        index=find_column_index(gt_options, GROUND_TRUTH_COLUMNS),
     )
     has_ground_truth = gt_col != "(none)"
 
+# ── Template Variables ─────────────────────────────────────────────────────
+
+prompts = st.session_state.get("system_prompts", ["You are a helpful AI Assistant."])
+template_vars = list(
+    dict.fromkeys(v for p in prompts for v in extract_variables(p))
+)
+variable_columns: dict[str, str] = {}
+if template_vars:
+    st.subheader("Template Variables")
+    st.caption(
+        "Each `{{variable}}` in your system prompts is filled per row from a CSV column."
+    )
+    auto_matched = match_variable_columns(template_vars, columns)
+    var_options = ["(none)"] + columns
+    var_cols = st.columns(min(len(template_vars), 3))
+    for idx, var in enumerate(template_vars):
+        with var_cols[idx % len(var_cols)]:
+            chosen = st.selectbox(
+                f"`{{{{{var}}}}}`",
+                var_options,
+                index=var_options.index(auto_matched.get(var, "(none)")),
+                key=f"batch_var_{var}",
+            )
+            if chosen != "(none)":
+                variable_columns[var] = chosen
+
 # ── Metrics Selection ──────────────────────────────────────────────────────
 
 st.divider()
 
-NLP_METRICS = ["ROUGE Score", "BLEU Score", "BERT Score"]
-LLM_METRICS = ["Answer Relevancy", "Faithfulness", "Critique"]
-
 available_metrics = LLM_METRICS.copy()
 if has_ground_truth:
     available_metrics = NLP_METRICS + LLM_METRICS
@@ -82,19 +265,272 @@ batch_metrics = st.multiselect(
 nlp_batch = [m for m in batch_metrics if m in NLP_METRICS]
 llm_batch = [m for m in batch_metrics if m in LLM_METRICS]
 
-CRITERIA_DICT = {
-    "Harmfulness": "Does the answer cause or have the potential to cause harm?",
-    "Coherence": "Does the answer present ideas in a logical and organized manner?",
-    "Correctness": "Is the answer factually accurate and free from errors?",
-    "Conciseness": "Does the answer convey information clearly and efficiently?",
-}
-
 critique_criteria_name = None
+judge_pack_size = 1
 if "Critique" in llm_batch:
-    critique_criteria_name = st.selectbox(
-        "Critique Criteria", list(CRITERIA_DICT.keys()), key="batch_criteria"
+    criteria_cols = st.columns(2)
+    with criteria_cols[0]:
+        critique_criteria_name = st.selectbox(
+            "Critique Criteria", list(CRITERIA_DICT.keys()), key="batch_criteria"
+        )
+    with criteria_cols[1]:
+        judge_pack_size = st.number_input(
+            "Answers per critique call",
+            min_value=1,
+            max_value=16,
+            value=1,
+            key="batch_judge_pack",
+            help="Judge several answers to the same question in one request. "
+            "Fewer calls and tokens; 1 judges each answer on its own.",
+        )
+
+nli_backend, statement_extractor, context_mode = "llm", "llm", "full"
+if "Faithfulness" in llm_batch:
+    nli_cols = st.columns(3)
+    with nli_cols[0]:
+        nli_backend = st.selectbox(
+            "Faithfulness NLI",
+            NLI_BACKENDS,
+            key="batch_nli_backend",
+            help="torch / int8 check statements with a local cross-encoder NLI "
+            "model instead of a judge call; every statement in the run goes "
+            "through the model together. They need torch and transformers.",
+        )
+    with nli_cols[1]:
+        statement_extractor = st.selectbox(
+            "Statement extraction",
+            ["llm", *STATEMENT_EXTRACTORS],
+            key="batch_statement_extractor",
+            help="llm asks the judge to extract statements; sentences uses each "
+            "sentence of the answer.",
+        )
+    with nli_cols[2]:
+        context_mode = st.selectbox(
+            "NLI context",
+            CONTEXT_MODES,
+            key="batch_context_mode",
+            help="retrieval checks each statement against its top BM25 passages "
+            "instead of the whole context: far fewer judge tokens on long "
+            "contexts. Run both to compare scores.",
+        )
+
+bertscore_backend = "evaluate"
+if "BERT Score" in nlp_batch:
+    bertscore_backend = st.selectbox(
+        "BERTScore backend",
+        BERTSCORE_BACKENDS,
+        key="batch_bertscore_backend",
+        help="onnx / onnx-int8 / int8 run a CPU-optimized encoder and cache "
+        "token embeddings, so repeated references and reruns skip encoding. "
+        "They need onnxruntime or torch installed.",
     )
 
+# ── Models ──────────────────────────────────────────────────────────────────
+
+st.divider()
+
+sidebar_config: LLMConfig = st.session_state.get("llm_config")
+sidebar_label = (
+    f"{sidebar_config.provider}:{sidebar_config.model_name}"
+    if sidebar_config
+    else None
+)
+model_options = [
+    f"{provider}:{model}"
+    for provider, models in PROVIDER_MODELS.items()
+    for model in models
+]
+if sidebar_label and sidebar_label not in model_options:
+    model_options.insert(0, sidebar_label)
+
+selected_models = st.multiselect(
+    "Models",
+    model_options,
+    default=[sidebar_label] if sidebar_label else [],
+    help="Every row and prompt is run against each selected model. "
+    "Hyperparameters come from the sidebar.",
+)
+
+extra_keys: dict[str, str] = {}
+extra_providers = sorted(
+    {
+        label.split(":", 1)[0]
+        for label in selected_models
+        if sidebar_config and label.split(":", 1)[0] != sidebar_config.provider
+    }
+    - KEYLESS_PROVIDERS
+)
+if extra_providers:
+    key_cols = st.columns(len(extra_providers))
+    for col, provider in zip(key_cols, extra_providers):
+        with col:
+            extra_keys[provider] = st.text_input(
+                f"{provider.capitalize()} API Key",
+                type="password",
+                key=f"batch_key_{provider}",
+            )
+
+# ── Hyperparameter Sweep ───────────────────────────────────────────────────
+
+sweep_grid: dict[str, list[float]] = {}
+sweep_metric = None
+with st.expander("Hyperparameter sweep", icon=":material/tune:"):
+    sweep_enabled = st.toggle(
+        "Sweep settings instead of using the sidebar values",
+        value=False,
+        key="sweep_enabled",
+    )
+    st.caption(
+        "Comma-separated values (`0, 0.5, 1`) or an inclusive range "
+        "(`0:1:0.25`). Blank keeps the sidebar value."
+    )
+    grid_cols = st.columns(len(SWEEP_PARAMS))
+    for col, param in zip(grid_cols, SWEEP_PARAMS):
+        with col:
+            raw = st.text_input(param, key=f"sweep_{param}")
+            try:
+                sweep_grid[param] = parse_values(raw)
+            except ValueError:
+                st.error(f"Invalid values for {param}")
+                sweep_grid[param] = []
+
+    sweep_cols = st.columns(3)
+    with sweep_cols[0]:
+        sweep_metric = st.selectbox(
+            "Optimize metric", batch_metrics or [None], key="sweep_metric"
+        )
+    with sweep_cols[1]:
+        sweep_halving = st.toggle(
+            "Successive halving",
+            value=True,
+            help="Drop the worst configs early on a subset of rows",
+        )
+    with sweep_cols[2]:
+        sweep_eta = st.number_input(
+            "Keep 1 in", min_value=2, max_value=8, value=2, disabled=not sweep_halving
+        )
+
+# ── Budget ──────────────────────────────────────────────────────────────────
+
+with st.expander("Budget", icon=":material/savings:"):
+    st.caption(
+        "Hard caps stop new LLM calls once reached; warning levels only alert. "
+        "0 means no limit. Cached answers are free."
+    )
+    budget_cols = st.columns(4)
+    with budget_cols[0]:
+        run_max_cost = st.number_input(
+            "Run cost cap ($)", min_value=0.0, value=0.0, step=0.5, format="%.2f"
+        )
+    with budget_cols[1]:
+        run_warn_cost = st.number_input(
+            "Run warning at ($)", min_value=0.0, value=0.0, step=0.5, format="%.2f"
+        )
+    with budget_cols[2]:
+        run_max_tokens = st.number_input(
+            "Run token cap", min_value=0, value=0, step=10_000
+        )
+    with budget_cols[3]:
+        session_max_cost = st.number_input(
+            "Session cost cap ($)", min_value=0.0, value=0.0, step=1.0, format="%.2f"
+        )
+    session_budget.limits = BudgetLimits(max_cost_usd=session_max_cost or None)
+    st.caption(session_budget.summary())
+    run_time_limit = st.number_input(
+        "Run time limit (s)",
+        min_value=0.0,
+        value=0.0,
+        step=60.0,
+        help="Cells still pending when the limit passes are reported as TIMEOUT. "
+        "Per-request timeouts are set in the sidebar.",
+    )
+
+# ── Hedged requests ─────────────────────────────────────────────────────────
+
+with st.expander("Hedged requests", icon=":material/call_split:"):
+    hedge_enabled = st.toggle(
+        "Send a duplicate when a call runs past the model's recent latency percentile",
+        value=False,
+        key="hedge_enabled",
+        help="The first answer wins and the other request is cancelled. "
+        "Duplicates may still be billed, so they count against the budget.",
+    )
+    hedge_cols = st.columns(3)
+    with hedge_cols[0]:
+        hedge_percentile = st.number_input(
+            "Latency percentile",
+            min_value=50.0,
+            max_value=99.9,
+            value=95.0,
+            step=1.0,
+            disabled=not hedge_enabled,
+        )
+    with hedge_cols[1]:
+        hedge_max_extra = st.number_input(
+            "Max extra requests (%)",
+            min_value=1,
+            max_value=50,
+            value=5,
+            disabled=not hedge_enabled,
+        )
+    with hedge_cols[2]:
+        hedge_max_cost = st.number_input(
+            "Max extra spend ($)",
+            min_value=0.0,
+            value=0.0,
+            step=0.1,
+            format="%.2f",
+            disabled=not hedge_enabled,
+        )
+hedge_policy = (
+    HedgePolicy(
+        percentile=hedge_percentile,
+        max_extra_fraction=hedge_max_extra / 100,
+        max_extra_cost_usd=hedge_max_cost or None,
+    )
+    if hedge_enabled
+    else None
+)
+
+# ── Cascaded judging ────────────────────────────────────────────────────────
+
+with st.expander("Cascaded judging", icon=":material/filter_alt:"):
+    cascade_enabled = st.toggle(
+        "Score with a cheap judge first and escalate only unsure items",
+        value=False,
+        key="cascade_enabled",
+        help="Correctness critiques with ROUGE-L near 0 or 1 against the ground "
+        "truth skip the judges entirely. The sidebar judge scores the rest only "
+        "when the cheap judge is unsure.",
+    )
+    cascade_cols = st.columns(3)
+    with cascade_cols[0]:
+        cascade_model = st.selectbox(
+            "Cheap judge",
+            model_options,
+            key="cascade_model",
+            disabled=not cascade_enabled,
+        )
+    with cascade_cols[1]:
+        cascade_confidence = st.slider(
+            "Keep verdicts at confidence",
+            min_value=0.5,
+            max_value=1.0,
+            value=0.85,
+            step=0.05,
+            disabled=not cascade_enabled,
+        )
+    with cascade_cols[2]:
+        cascade_audit = st.number_input(
+            "Audit early decisions (%)",
+            min_value=0,
+            max_value=100,
+            value=0,
+            disabled=not cascade_enabled,
+            help="Also send this share of cheap decisions to the sidebar judge "
+            "to measure agreement.",
+        )
+
 # ── Run ─────────────────────────────────────────────────────────────────────
 
 st.divider()
@@ -109,128 +545,156 @@ if st.button(
     judge_config: LLMConfig = st.session_state.get("judge_config")
     use_cache = st.session_state.get("use_cache", True)
 
-    if not config or (not config.api_key and config.provider != "ollama"):
+    if not config or (not config.api_key and config.provider not in KEYLESS_PROVIDERS):
         st.error("Please configure your API key in the sidebar.")
         st.stop()
+    if not selected_models:
+        st.error("Select at least one model.")
+        st.stop()
 
-    prompts = st.session_state.get("system_prompts", ["You are a helpful AI Assistant."])
-    num_prompts = len(prompts)
-
-    # Build result columns
-    result_cols = ["Question", "Context"]
-    if has_ground_truth:
-        result_cols.append("Ground Truth")
-    result_cols.append("Model")
-    for i in range(num_prompts):
-        result_cols.append(f"System_Prompt_{i + 1}")
-        result_cols.append(f"Answer_{i + 1}")
-        result_cols.append(f"Tokens_{i + 1}")
-        result_cols.append(f"Cost_{i + 1}")
-
-    if nlp_batch:
-        result_cols.extend(nlp_batch)
-    for m in llm_batch:
-        for i in range(num_prompts):
-            if m == "Critique" and critique_criteria_name:
-                result_cols.append(f"{m}_{critique_criteria_name}_Prompt{i + 1}")
-            else:
-                result_cols.append(f"{m}_Prompt{i + 1}")
-
-    results_data: list[dict] = []
-
-    with st.status(
-        f"Processing {len(df)} rows...", expanded=True
-    ) as status:
-        for row_idx, row in df.iterrows():
-            st.write(f"Row {row_idx + 1}/{len(df)}")
-            q = str(row[question_col])
-            ctx = str(row[context_col]) if pd.notna(row[context_col]) else ""
-            gt = str(row[gt_col]) if has_ground_truth and pd.notna(row.get(gt_col)) else ""
-
-            parts = []
-            if ctx:
-                parts.append(ctx)
-            parts.append(q)
-            user_message = "\n\n".join(parts)
-
-            result_row: dict = {
-                "Question": q,
-                "Context": ctx,
-                "Model": config.model_name,
-            }
-            if has_ground_truth:
-                result_row["Ground Truth"] = gt
-
-            # Generate answers for each prompt
-            answer_contents: list[str] = []
-            for i, sys_prompt in enumerate(prompts):
-                try:
-                    resp = get_completion(
-                        config, sys_prompt, user_message, use_cache=use_cache
-                    )
-                    result_row[f"System_Prompt_{i + 1}"] = sys_prompt
-                    result_row[f"Answer_{i + 1}"] = resp.content
-                    result_row[f"Tokens_{i + 1}"] = f"{resp.input_tokens}+{resp.output_tokens}"
-                    result_row[f"Cost_{i + 1}"] = f"${resp.estimated_cost_usd:.5f}"
-                    answer_contents.append(resp.content)
-                except Exception as e:
-                    result_row[f"System_Prompt_{i + 1}"] = sys_prompt
-                    result_row[f"Answer_{i + 1}"] = f"ERROR: {e}"
-                    result_row[f"Tokens_{i + 1}"] = "0"
-                    result_row[f"Cost_{i + 1}"] = "$0"
-                    answer_contents.append("")
-
-            # NLP metrics (need ground truth)
-            if nlp_batch and gt:
-                predictions = answer_contents
-                references = [gt] * len(predictions)
-                if "ROUGE Score" in nlp_batch:
-                    r = NLPMetrics.rouge_score(predictions, references)
-                    result_row["ROUGE Score"] = f"R1:{r['rouge1']} R2:{r['rouge2']} RL:{r['rougeL']}"
-                if "BLEU Score" in nlp_batch:
-                    b = NLPMetrics.bleu_score(predictions, references)
-                    result_row["BLEU Score"] = b["bleu"]
-                if "BERT Score" in nlp_batch:
-                    bs = NLPMetrics.bert_score(predictions, references)
-                    result_row["BERT Score"] = bs["mean_f1"]
-
-            # LLM judge metrics
-            if llm_batch:
-                judge = LLMJudge(judge_config)
-                for i, ans_content in enumerate(answer_contents):
-                    if not ans_content:
-                        continue
-                    if "Answer Relevancy" in llm_batch:
-                        score = judge.answer_relevancy(q, ans_content, config)
-                        result_row[f"Answer Relevancy_Prompt{i + 1}"] = score
-                    if "Faithfulness" in llm_batch:
-                        score = judge.faithfulness(q, ans_content, ctx)
-                        result_row[f"Faithfulness_Prompt{i + 1}"] = score
-                    if "Critique" in llm_batch and critique_criteria_name:
-                        verdict = judge.critique(
-                            q, ans_content, CRITERIA_DICT[critique_criteria_name]
-                        )
-                        result_row[f"Critique_{critique_criteria_name}_Prompt{i + 1}"] = verdict
-
-            results_data.append(result_row)
-
-        status.update(
-            label=f"Processed {len(df)} rows", state="complete"
-        )
-
-    # ── Display & Download ────────────────────────────────────────────────
-    results_df = pd.DataFrame(results_data)
-    st.subheader("Results")
-    st.dataframe(results_df, use_container_width=True, hide_index=True)
+    configs: list[LLMConfig] = []
+    for label in selected_models:
+        provider, model = label.split(":", 1)
+        api_key = (
+            config.api_key
+            if provider == config.provider
+            else extra_keys.get(provider, "")
+        )
+        if not api_key and provider not in KEYLESS_PROVIDERS:
+            st.error(f"Please enter an API key for {provider}.")
+            st.stop()
+        configs.append(
+            config.model_copy(
+                update={"provider": provider, "model_name": model, "api_key": api_key}
+            )
+        )
 
-    csv_data = results_df.to_csv(index=False).encode("utf-8")
-    st.download_button(
-        "Download Report (CSV)",
-        csv_data,
-        "batch_eval_report.csv",
-        "text/csv",
-        icon=":material/download:",
-        use_container_width=True,
+    cascade_policy = None
+    if cascade_enabled:
+        provider, model = cascade_model.split(":", 1)
+        api_key = {
+            config.provider: config.api_key,
+            judge_config.provider: judge_config.api_key,
+        }.get(provider) or extra_keys.get(provider, "")
+        if not api_key and provider not in KEYLESS_PROVIDERS:
+            st.error(f"Please enter an API key for {provider}.")
+            st.stop()
+        cascade_policy = CascadePolicy(
+            cheap_judge=judge_config.model_copy(
+                update={"provider": provider, "model_name": model, "api_key": api_key}
+            ),
+            min_confidence=cascade_confidence,
+            audit_fraction=cascade_audit / 100,
+        )
+
+    unmapped = [v for v in template_vars if v not in variable_columns]
+    if unmapped:
+        st.error(
+            "Map a CSV column to each template variable: "
+            + ", ".join(f"`{{{{{v}}}}}`" for v in unmapped)
+        )
+        st.stop()
+
+    rows = load_rows(
+        df,
+        question_col,
+        context_col,
+        gt_col if has_ground_truth else None,
+        variable_columns,
+    )
+    config_labels: list[str] = []
+    if sweep_enabled:
+        if not sweep_metric:
+            st.error("Select a metric to optimize for the sweep.")
+            st.stop()
+        swept = [p for p in SWEEP_PARAMS if sweep_grid.get(p)]
+        configs = [
+            variant for c in configs for variant in expand_config_grid(c, sweep_grid)
+        ]
+        config_labels = [config_label(c, swept) for c in configs]
+
+    spec = BatchSpec(
+        prompts=prompts,
+        configs=configs,
+        config_labels=config_labels,
+        judge_config=judge_config,
+        nlp_metrics=nlp_batch,
+        llm_metrics=llm_batch,
+        critique_name=critique_criteria_name,
+        use_cache=use_cache,
+        bertscore_backend=bertscore_backend,
+        hedging=hedge_policy,
+        deadline_s=run_time_limit or None,
+        judge_pack_size=int(judge_pack_size),
+        cascade=cascade_policy,
+        nli_backend=nli_backend,
+        statement_extractor=statement_extractor,
+        context_mode=context_mode,
     )
 
-    st.session_state["last_batch_results"] = results_df
+    run_limits = BudgetLimits(
+        max_cost_usd=run_max_cost or None,
+        max_tokens=run_max_tokens or None,
+        warn_cost_usd=run_warn_cost or None,
+    )
+
+    if not sweep_enabled:
+        # Plain batch runs go to the background queue; the Jobs panel below
+        # polls them, so reruns and closing the tab do not stop the work.
+        job_id = get_job_queue().submit(
+            rows,
+            spec,
+            run_limits,
+            session_budget=session_budget,
+            label=f"{len(rows)} rows × {len(configs)} model(s) × {len(prompts)} prompt(s)",
+        )
+        st.session_state["batch_job_id"] = job_id
+        st.toast(f"Submitted job {job_id}", icon=":material/schedule:")
+    else:
+        run_budget = BudgetManager(run_limits)
+
+        # One time limit across every rung of the sweep
+        with collect_spans() as run_spans, use_budget(
+            run_budget, session_budget
+        ), deadline(spec.deadline_s), st.status(
+            f"Processing {len(rows)} rows × {len(configs)} config(s)...", expanded=True
+        ) as status:
+            progress = st.progress(0.0)
+            budget_line = st.empty()
+
+            def _on_progress(stage: str, done: int, total: int) -> None:
+                progress.progress(done / max(total, 1), text=f"{stage}: {done}/{total}")
+                budget_line.caption(
+                    f"{run_budget.summary()}  \n{session_budget.summary()}"
+                )
+
+            leaderboard, results_df, plan_stats = run_sweep(
+                rows,
+                spec,
+                sweep_metric,
+                maximize=not (
+                    sweep_metric == "Critique"
+                    and critique_criteria_name == "Harmfulness"
+                ),
+                halving=sweep_halving,
+                eta=int(sweep_eta),
+                on_progress=_on_progress,
+            )
+            status.update(
+                label=f"Processed {len(rows)} rows × {len(configs)} config(s)",
+                state="complete",
+            )
+
+        _show_budget(run_budget)
+        _show_plan_stats(plan_stats)
+
+        st.subheader("Sweep Leaderboard")
+        st.dataframe(leaderboard, use_container_width=True, hide_index=True)
+        _show_results(results_df)
+
+        st.session_state["last_batch_results"] = results_df
+        st.session_state["last_batch_trace"] = run_spans
+
+# ── Jobs ────────────────────────────────────────────────────────────────────
+
+_job_panel()
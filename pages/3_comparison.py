@@ -1,6 +1,9 @@
+import altair as alt
 import pandas as pd
 import streamlit as st
 
+from core.tracing import span_summary, span_timeline
+
 st.title("Comparison :material/compare:")
 st.caption("Visualize and compare results from Prompt Lab or Batch Evaluation")
 
@@ -33,6 +36,29 @@ if has_batch_data:
 
 source = st.pills("Data source", sources, default=sources[0])
 
+
+def _time_breakdown(spans) -> None:
+    if not spans:
+        return
+    st.subheader("Time Breakdown")
+    st.dataframe(span_summary(spans), use_container_width=True, hide_index=True)
+
+    # Flame-style timeline: one bar per span, nested spans on lower rows
+    timeline = span_timeline(spans)
+    chart = (
+        alt.Chart(timeline)
+        .mark_bar()
+        .encode(
+            x=alt.X("Start (ms):Q", title="Time since run start (ms)"),
+            x2="End (ms):Q",
+            y=alt.Y("Span:N", sort=alt.EncodingSortField("Depth", op="min")),
+            color=alt.Color("Span:N", legend=None),
+            tooltip=["Span", "Duration (ms)", "Model", "Thread", "Status"],
+        )
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+
 # ═══════════════════════════════════════════════════════════════════════════
 # Prompt Lab Results
 # ═══════════════════════════════════════════════════════════════════════════
@@ -141,6 +167,8 @@ if source == "Prompt Lab" and has_prompt_lab_data:
             hide_index=True,
         )
 
+    _time_breakdown(st.session_state.get("last_prompt_lab_trace"))
+
     # ── Export All Results ────────────────────────────────────────────────
     st.divider()
     st.subheader("Export")
@@ -199,6 +227,8 @@ if source == "Batch Eval" and has_batch_data:
         if selected_col:
             st.bar_chart(batch_results[selected_col])
 
+    _time_breakdown(st.session_state.get("last_batch_trace"))
+
     st.divider()
     csv_data = batch_results.to_csv(index=False).encode("utf-8")
     st.download_button(